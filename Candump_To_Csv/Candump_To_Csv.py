@@ -5,7 +5,6 @@ Converts candump into csv
 '''
 
 import csv
-import pandas
 
 #important CAN IDs
 PROP_STATE_REPORT = 127
@@ -36,22 +35,13 @@ conversionVals = { #[M,B]
     }
 
 #--------------------------------------------------------------
-data = {'Time' : [], "State": [], "Lox High": [], "Fuel High": [], "Lox Dome": [], "Fuel Dome": [], "Lox Tank1": [], "Lox Tank2": [],\
-    "Fuel Tank1": [], "Fuel Tank2": [], "Pneumatics": [], "Lox Inlet": [], "Fuel Inlet": [], "Fuel Injector": [], "Chamber1": [], "Chamber2": []}
+COLUMNS = ['Time', "State", "Lox High", "Fuel High", "Lox Dome", "Fuel Dome", "Lox Tank1", "Lox Tank2",\
+    "Fuel Tank1", "Fuel Tank2", "Pneumatics", "Lox Inlet", "Fuel Inlet", "Fuel Injector", "Chamber1", "Chamber2"]
 
-df = pandas.DataFrame(data)
 
-canDump = open("Candump_To_Csv/WaterflowCANDump.txt", "r")
-newLine = {
-    'Time' : -1, "State": -1, "Lox High": -1, "Fuel High": -1, "Lox Dome": -1, "Fuel Dome": -1, "Lox Tank1": -1, "Lox Tank2": -1,\
-        "Fuel Tank1": -1, "Fuel Tank2": -1, "Pneumatics": -1, "Lox Inlet": -1, "Fuel Inlet": -1, "Fuel Injector": -1, "Chamber1": -1, "Chamber2": -1
-} 
-
-
-def readSensor(line):
+def readSensor(line, msgID, newLine):
     
-    for I in range(len(sensorID[int(line[1], 16)])):
-        name = sensorID[int(line[1], 16)][I]
+    for I, name in enumerate(sensorID[msgID]):
         val = int(str(int(line[3 + I*2],16)) + str(int(line[4 + I*2],16)))
         
         #converting raw val
@@ -61,21 +51,54 @@ def readSensor(line):
 
 
     return 1
-print("Starting parse")
-for line in canDump:
-    line = line.split()
-    if line[0] == "can0":            #skipping weird null lines (null line ID seems to be 129 so we are missing propNode1)
-        if int(line[1], 16) in cmdID.keys():        # if a state change
-            newLine["State"] = int(line[1], 16) 
-
-        if int(line[1], 16) in sensorID.keys():     # if sensor reading 
-            readSensor(line)
-        
-        if int(line[1], 16) in [128]:    #if engine node state report 
-            newTime = line[3] + line[4] + line[5] + line[6]
-            newLine['Time'] = int(newTime, 16)
-            newLine['State'] = int(line[7], 16)
-            df = df._append(newLine, ignore_index = True)   #add newline
-
-df.to_csv("WaterflowCANDump" + '.csv', index=False)
-print("Done!")
+
+
+def iterRows(lines):
+    """
+    Yields one row (a list in COLUMNS order) per engine node state report.
+    Every other message just updates the forward-filled newLine.
+    """
+    newLine = {name: -1 for name in COLUMNS}
+    for line in lines:
+        line = line.split()
+        if line and line[0] == "can0":            #skipping weird null lines (null line ID seems to be 129 so we are missing propNode1)
+            msgID = int(line[1], 16)
+            if msgID in cmdID:              # if a state change
+                newLine["State"] = msgID
+
+            if msgID in sensorID:           # if sensor reading
+                readSensor(line, msgID, newLine)
+
+            if msgID == ENGINE_STATE_REPORT:    #if engine node state report
+                newTime = line[3] + line[4] + line[5] + line[6]
+                newLine['Time'] = int(newTime, 16)
+                newLine['State'] = int(line[7], 16)
+                yield [float(newLine[name]) for name in COLUMNS]   #add newline
+
+
+def convert(src="Candump_To_Csv/WaterflowCANDump.txt", dst="WaterflowCANDump.csv", chunkRows=4096):
+    """
+    Converts a candump to csv in one pass.  Rows are buffered and written
+    chunkRows at a time, so memory stays bounded on any length of dump.
+    Returns the number of rows written.
+    """
+    rows = 0
+    with open(src, "r") as canDump, open(dst, "w", newline='') as out:
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(COLUMNS)
+        chunk = []
+        for row in iterRows(canDump):
+            chunk.append(row)
+            if len(chunk) == chunkRows:
+                writer.writerows(chunk)
+                rows += len(chunk)
+                chunk.clear()
+        writer.writerows(chunk)
+        rows += len(chunk)
+    return rows
+
+
+if __name__ == "__main__":
+    print("Starting parse")
+    convert()
+    print("Done!")
@@ -0,0 +1,53 @@
+# test_Candump_To_Csv.py
+################################################################################
+#     Checks the streaming converter: one row per engine state report, with the
+# state and sensor values forward filled from the messages before it.
+#
+#   python -m pytest Candump_To_Csv
+
+import csv
+
+import pytest
+
+import Candump_To_Csv as converter
+
+DUMP = [
+    "  can0  002   [0]",
+    "  can0  081   [8]  01 02 03 04 05 06 07 08",
+    "",
+    "  can0  080   [8]  00 00 01 00 03 00 00 00",
+    "  can0  084   [4]  10 01 00 0A",
+    "  can0  006   [0]",
+    "  can0  083   [8]  00 01 00 02 00 03 00 04",
+    "  can0  080   [8]  00 00 02 00 05 00 00 00",
+    "  can0  080   [8]  00 00 03 00 01 00 00 00",
+]
+
+def calibrated(name, high, low):
+    m, b = converter.conversionVals[name]
+    return round(int(str(high) + str(low))*m + b, 2)
+
+def expected_rows():
+    row = dict.fromkeys(converter.COLUMNS, -1.0)
+    row.update({'Lox High': calibrated('Lox High', 1, 2), 'Fuel High': calibrated('Fuel High', 3, 4),
+        'Lox Dome': calibrated('Lox Dome', 5, 6), 'Fuel Dome': calibrated('Fuel Dome', 7, 8)})
+    first = dict(row, Time=256.0, State=3.0)
+    row.update({'Chamber1': calibrated('Chamber1', 16, 1), 'Chamber2': calibrated('Chamber2', 0, 10),
+        'Pneumatics': calibrated('Pneumatics', 0, 1), 'Lox Inlet': calibrated('Lox Inlet', 0, 2),
+        'Fuel Inlet': calibrated('Fuel Inlet', 0, 3), 'Fuel Injector': calibrated('Fuel Injector', 0, 4)})
+    second = dict(row, Time=512.0, State=5.0)
+    third = dict(row, Time=768.0, State=1.0)
+    return [[float(r[name]) for name in converter.COLUMNS] for r in (first, second, third)]
+
+def test_rows():
+    assert list(converter.iterRows(line + '\n' for line in DUMP)) == expected_rows()
+
+@pytest.mark.parametrize('chunkRows', [1, 2, 4096])
+def test_convert(tmp_path, chunkRows):
+    src, dst = tmp_path/'dump.txt', tmp_path/'dump.csv'
+    src.write_text('\n'.join(DUMP) + '\n')
+    assert converter.convert(str(src), str(dst), chunkRows) == 3
+    with open(dst, newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == converter.COLUMNS
+    assert [[float(value) for value in row] for row in rows[1:]] == expected_rows()
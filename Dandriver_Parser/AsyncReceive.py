@@ -0,0 +1,286 @@
+# AsyncReceive.py
+################################################################################
+#     asyncio front end for CanReceive.  Frames come off the bus through
+# python-can's Notifier and AsyncBufferedReader, are translated on the event
+# loop, and every state change is published as an Event to subscribers:
+#
+#   async with AsyncReceive.AsyncReceive(receiver) as live:
+#       async for event in live.subscribe('sensor', ids=[50, 52]):
+#           print(event.id, event.value)
+#
+# Event kinds, and what id and value are:
+#   sensor        sensor ID, (raw value, ledger time)
+#   valves        'Valves', 'ValvesRenegadeEngine' or 'ValvesRenegadeProp',
+#                 the bank as a tuple
+#   node          'NodeStatusBang', 'NodeStatusRenegadeEngine' or
+#                 'NodeStatusRenegadeProp', the state name
+#   controller    ControllerID, that controller's values as a tuple
+#   autosequence  1100, AutosequenceTime
+#   throttle      1506, ThrottlePoints as a tuple of (time, point)
+#   clock         268, (rocketDriverSeconds, rocketDriverMicros)
+#
+# Each subscription has a bounded buffer, and what happens when it is full
+# depends on how it was subscribed:
+#   coalesce=True   keeps only the newest event per (kind, id), and drops the
+#                   oldest (kind, id) to make room for a new one
+#   coalesce=False  drops its oldest event
+#   wait=True       never drops: ingest waits until the consumer has made room
+#                   (a coalescing one still coalesces, and waits for new keys)
+# Dropped and coalesced events are counted.  A slow dropping consumer sees
+# fewer, newer events and ingest never stalls for it; a slow waiting one holds
+# up decoding for every subscriber, while frames queue in the bus reader.
+# Only the receive loop and put() wait; ingest() hands back what full waiting
+# subscriptions refused.
+
+import asyncio
+import collections
+
+import can
+
+import CanReceive, Schema
+
+Event = collections.namedtuple('Event', ('kind', 'id', 'value', 'timestamp'))
+
+NODE_STATES = {514: 'NodeStatusRenegadeEngine', 515: 'NodeStatusRenegadeProp', 520: 'NodeStatusBang'}
+
+################################################################################
+############################### Event extraction ###############################
+################################################################################
+
+# Which events a frame produced, by its ID.  Read after translating, so the
+# values are the receiver's new state.
+def event_sources(receiver):
+    def sensor(ID_A, msg_id, data, timestamp):
+        n = len(data)
+        ids = [ID_A] if n >= 2 else []
+        if n > 4:
+            ids.append(data[2])
+        if n > 7:
+            ids.append(data[5])
+        return [Event('sensor', i, (receiver.Sensors[i], receiver.sensorTimestamps[i]), timestamp) for i in ids]
+
+    def valves(bank):
+        def events(ID_A, msg_id, data, timestamp):
+            return [Event('valves', bank, tuple(getattr(receiver, bank)), timestamp)]
+        return events
+
+    def node(ID_A, msg_id, data, timestamp):
+        bank = NODE_STATES.get(ID_A)
+        return [Event('node', bank, getattr(receiver, bank), timestamp)] if bank and data else []
+
+    def controller(ID_A, msg_id, data, timestamp):
+        ControllerID = (round(ID_A, -2)-1000)//100
+        return [Event('controller', ControllerID, tuple(receiver.Controllers[ControllerID]), timestamp)] if data else []
+
+    def autosequence(ID_A, msg_id, data, timestamp):
+        return [Event('autosequence', ID_A, receiver.AutosequenceTime, timestamp)]
+
+    def throttle(ID_A, msg_id, data, timestamp):
+        points = tuple(tuple(point) for point in receiver.ThrottlePoints)
+        return [Event('throttle', ID_A, points, timestamp)] if data else []
+
+    def clock(ID_A, msg_id, data, timestamp):
+        return [Event('clock', ID_A, (receiver.rocketDriverSeconds, receiver.rocketDriverMicros), timestamp)]
+
+    # By ID rather than by handler, so events keep coming when a handler is
+    # swapped for another (ClockModel's sensor handler, say).
+    sources = [()] * CanReceive.ID_SPACE
+    def add(ids, source):
+        for ID_A in ids:
+            sources[ID_A] += (source,)
+    add([268], clock)
+    add(CanReceive.SENSOR_IDS, sensor)
+    add(CanReceive.NODE_STATE_IDS, node)
+    add([1100], autosequence)
+    add([1506], throttle)
+    for family in Schema.FAMILIES:
+        add(family.ids, valves(family.target) if family.event == 'valves' else controller)
+    return sources
+
+################################################################################
+################################# Subscriptions ################################
+################################################################################
+
+class Subscription:
+    """
+    Async iterator of Events matching kinds and ids (None matches all).
+    Ends when the AsyncReceive stops or unsubscribe() is called.
+    """
+    def __init__(self, kinds=None, ids=None, maxsize=256, coalesce=True, wait=False):
+        if isinstance(kinds, str):
+            kinds = (kinds,)
+        self.kinds = None if kinds is None else frozenset(kinds)
+        self.ids = None if ids is None else frozenset(ids)
+        self.maxsize = maxsize
+        self.coalesce = coalesce
+        self.wait = wait
+        self._events = collections.OrderedDict() if coalesce else collections.deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._closed = False
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def matches(self, event):
+        return (self.kinds is None or event.kind in self.kinds) and \
+            (self.ids is None or event.id in self.ids)
+
+    def publish(self, event):
+        """Queues event.  A full waiting subscription refuses it, returning False."""
+        events = self._events
+        if self.coalesce:
+            key = (event.kind, event.id)
+            if key in events:
+                # Newest value, in the place the key first queued.
+                events[key] = event
+                self.coalesced += 1
+            else:
+                if len(events) >= self.maxsize:
+                    if self.wait:
+                        return False
+                    events.popitem(last=False)
+                    self.dropped += 1
+                events[key] = event
+        else:
+            if len(events) >= self.maxsize:
+                if self.wait:
+                    return False
+                events.popleft()
+                self.dropped += 1
+            events.append(event)
+        self._ready.set()
+        return True
+
+    async def put(self, event):
+        """Queues event, waiting for room if the subscription is full.  Dropped once closed."""
+        while not self._closed:
+            if self.publish(event):
+                return
+            self._space.clear()
+            await self._space.wait()
+
+    def close(self):
+        self._closed = True
+        self._ready.set()
+        self._space.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._events:
+            if self._closed:
+                raise StopAsyncIteration
+            self._ready.clear()
+            await self._ready.wait()
+        self.delivered += 1
+        self._space.set()
+        if self.coalesce:
+            return self._events.popitem(last=False)[1]
+        return self._events.popleft()
+
+    def counters(self):
+        return {'queued': len(self._events), 'delivered': self.delivered,
+            'coalesced': self.coalesced, 'dropped': self.dropped}
+
+################################################################################
+################################### Receiver ###################################
+################################################################################
+
+class AsyncReceive:
+    """
+    receiver: the CanReceive to decode into, a fresh one by default.
+    bus: an open python-can bus, or None to open one from receiver.busargs
+         (shut down again by stop()).
+    """
+    def __init__(self, receiver=None, bus=None):
+        self.receiver = CanReceive.CanReceive() if receiver is None else receiver
+        self.bus = bus
+        self._own_bus = bus is None
+        self.subscriptions = []
+        self.sources = event_sources(self.receiver)
+        self.errors = 0
+        self.last_error = None
+        self._reader = None
+        self._notifier = None
+        self._task = None
+
+    async def start(self):
+        if self.bus is None:
+            self.bus = can.interface.Bus(**self.receiver.busargs)
+        self._reader = can.AsyncBufferedReader()
+        self._notifier = can.Notifier(self.bus, [self._reader], loop=asyncio.get_running_loop())
+        self._task = asyncio.ensure_future(self._ingest())
+        return self
+
+    async def _ingest(self):
+        async for msg in self._reader:
+            await self.put(msg)
+
+    async def put(self, msg):
+        """ingest(), then waits until the waiting subscriptions have queued its events."""
+        for subscription, event in self.ingest(msg):
+            await subscription.put(event)
+
+    def ingest(self, msg):
+        """
+        Translates one python-can message and publishes its events.  Returns
+        the (subscription, event) pairs full waiting subscriptions refused, in
+        order, for put() to wait on.
+        """
+        receiver = self.receiver
+        msg_id = msg.arbitration_id
+        ID_A = msg_id & CanReceive.ID_MASK
+        data = bytes(msg.data)
+        try:
+            receiver.translateFrame(ID_A, msg_id, data)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = e
+            return []
+        refused, waiting = [], set()
+        if not self.subscriptions:
+            return refused
+        for source in self.sources[ID_A]:
+            for event in source(ID_A, msg_id, data, msg.timestamp):
+                for subscription in self.subscriptions:
+                    if subscription.matches(event):
+                        # Once one is refused, the subscription's later events
+                        # wait behind it.
+                        if subscription in waiting or not subscription.publish(event):
+                            waiting.add(subscription)
+                            refused.append((subscription, event))
+        return refused
+
+    def subscribe(self, kinds=None, ids=None, maxsize=256, coalesce=True, wait=False):
+        subscription = Subscription(kinds, ids, maxsize, coalesce, wait)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+        subscription.close()
+
+    async def stop(self):
+        if self._notifier is not None:
+            self._notifier.stop()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for subscription in self.subscriptions:
+            subscription.close()
+        self.subscriptions = []
+        if self._own_bus and self.bus is not None:
+            self.bus.shutdown()
+            self.bus = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
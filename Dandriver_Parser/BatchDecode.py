@@ -0,0 +1,127 @@
+# BatchDecode.py
+################################################################################
+#     Vectorized decoding of packed sensor frames (IDs 51-426).  Works on a
+# whole block of frames at once, for offline post-test analysis.
+#
+# A packed sensor frame carries up to three (ID, value) entries:
+#   entry 0: ID and 18 bit timestamp from the arbitration ID, value in bytes 0-1
+#   entry 1: one byte ID in byte 2, value in bytes 3-4, no timestamp
+#   entry 2: one byte ID in byte 5, value in bytes 6-7, no timestamp
+# which is what CanReceive.ID_Between_050_427_frame decodes one at a time.
+
+import numpy as np
+
+import CanReceive, SensorDefs
+
+# Boolean lookup over the 11 bit ID space: which IDs are packed sensor frames.
+SENSOR_FRAME_IDS = np.zeros(CanReceive.ID_SPACE, dtype=bool)
+SENSOR_FRAME_IDS[51:427] = True
+SENSOR_FRAME_IDS[[s[1][0] for s in SensorDefs.sensorList]] = True
+
+def sensor_frame_mask(ids):
+    """True for the arbitration IDs that are packed sensor frames."""
+    return SENSOR_FRAME_IDS[np.asarray(ids) & CanReceive.ID_MASK]
+
+# Rollover state carried from one block to the next.  A CanReceive works here
+# too, so a batch can pick up where a live/serial parse left off.
+class RolloverState:
+    def __init__(self, sensorTimestamp=0.0, sensorRollover=0.0):
+        self.sensorTimestamp = sensorTimestamp
+        self.sensorRollover = sensorRollover
+
+def sensor_entries(ids, payloads, lengths=None):
+    """
+    Splits a block of packed sensor frames into its entries, in frame order.
+
+    ids: (N,) arbitration IDs.
+    payloads: (N, 8) uint8 payloads.
+    lengths: (N,) payload lengths.  Defaults to 8.
+
+    Returns frame index, sensor ID, raw 18 bit timestamp and raw value per
+    entry.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    payloads = np.asarray(payloads, dtype=np.uint8).reshape(-1, 8)
+    if lengths is None:
+        lengths = np.full(len(ids), 8)
+    lengths = np.asarray(lengths)
+
+    p = payloads.astype(np.int64)
+    n = len(ids)
+
+    sensor_id = np.empty((n, 3), dtype=np.int64)
+    sensor_id[:, 0] = ids & CanReceive.ID_MASK
+    sensor_id[:, 1] = p[:, 2]
+    sensor_id[:, 2] = p[:, 5]
+
+    timestamp = np.zeros((n, 3), dtype=np.int64)
+    timestamp[:, 0] = ids >> 11
+
+    value = np.empty((n, 3), dtype=np.int64)
+    value[:, 0] = (p[:, 0] << 8) | p[:, 1]
+    value[:, 1] = (p[:, 3] << 8) | p[:, 4]
+    value[:, 2] = (p[:, 6] << 8) | p[:, 7]
+
+    valid = np.empty((n, 3), dtype=bool)
+    valid[:, 0] = lengths > 1
+    valid[:, 1] = lengths > 4
+    valid[:, 2] = lengths > 7
+
+    frame = np.broadcast_to(np.arange(n)[:, None], (n, 3))
+    return frame[valid], sensor_id[valid], timestamp[valid], value[valid]
+
+def unwrap_columns(raw_timestamp, state):
+    """
+    Converts raw 18 bit timestamps to seconds, and the rollover (seconds) each
+    one is counted with, unwrapping the 10 second rollover with a diff/cumsum
+    instead of a per-entry state update.
+
+    state is updated in place, so consecutive blocks unwrap as one stream.
+    """
+    t = np.asarray(raw_timestamp, dtype=np.int64) * 10 / 2**18
+    if len(t) == 0:
+        return t, t
+
+    prev = np.empty_like(t)
+    prev[0] = state.sensorTimestamp
+    prev[1:] = t[:-1]
+    rollover = state.sensorRollover + 10.0*np.cumsum(t < prev)
+
+    state.sensorTimestamp = float(t[-1])
+    state.sensorRollover = float(rollover[-1])
+    return t, rollover
+
+def unwrap_rollover(raw_timestamp, state=None):
+    """Ledger times of raw 18 bit timestamps, as unwrap_columns counts them."""
+    if state is None:
+        state = RolloverState()
+    t, rollover = unwrap_columns(raw_timestamp, state)
+    return (t + rollover)/8000
+
+def decode_sensor_batch(ids, payloads, lengths=None, state=None):
+    """
+    Decodes a block of packed sensor frames.
+
+    ids: (N,) arbitration IDs.
+    payloads: (N, 8) uint8 payloads.
+    lengths: (N,) payload lengths.  Defaults to 8.
+    state: rollover state, a RolloverState or CanReceive.  Updated in place.
+
+    Returns (sensor_id, timestamp, raw_value) columns, one row per entry, with
+    the same timestamps CanReceive puts in sensorLedgers.
+    """
+    frame, sensor_id, raw_timestamp, value = sensor_entries(ids, payloads, lengths)
+    return sensor_id, unwrap_rollover(raw_timestamp, state), value
+
+def apply_sensor_batch(receiver, sensor_id, timestamp, raw_value):
+    """Appends decoded entries to a CanReceive's ledgers and latest values."""
+    if len(sensor_id) == 0:
+        return
+    order = np.argsort(sensor_id, kind='stable')
+    sensor_id, timestamp, raw_value = sensor_id[order], timestamp[order], raw_value[order]
+    sensors, starts = np.unique(sensor_id, return_index=True)
+    stops = np.append(starts[1:], len(sensor_id))
+    for sensor, start, stop in zip(sensors.tolist(), starts.tolist(), stops.tolist()):
+        receiver.sensorLedgers[sensor].extend_columns(timestamp[start:stop], raw_value[start:stop])
+        receiver.Sensors[sensor] = int(raw_value[stop - 1])
+        receiver.sensorTimestamps[sensor] = float(timestamp[stop - 1])
@@ -0,0 +1,222 @@
+# Benchmark.py
+################################################################################
+#     Per-stage benchmarks of the parser on synthetic dumps.
+#
+# A generator writes candump or Coolterm files with a configurable number of
+# frames and message mix, using the real ID ranges: packed sensor frames on
+# the SensorDefs IDs, 546/547/552 valves, 514/515/520 node states, the 268
+# clock, 1100 autosequence, 1506 throttle points and the other 15xx
+# controllers.  Each stage is then timed on its own, and reported as
+# frames/sec and input bytes/sec, plus its peak traced memory.  Results are
+# written as JSON, so runs can be compared.  The shard-parallel parse is timed
+# against the serial one on the same dump, and its speedup reported with them:
+#
+#   python Benchmark.py --frames 200000 --out new.json --compare old.json
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import CanReceive, SensorDefs, Pipeline, ParallelParse, Export
+import blt_parser_rd2_hrc as parser
+
+################################################################################
+################################### Generator ##################################
+################################################################################
+
+MIX = {'sensor': 0.85, 'valves': 0.03, 'node': 0.02, 'clock': 0.03,
+    'autosequence': 0.02, 'throttle': 0.01, 'controller': 0.04}
+
+SENSOR_IDS = [s[1][0] for s in SensorDefs.sensorList]
+CONTROLLER_IDS = [i for i in range(1501, 1521) if i != 1506]
+
+def synthetic_frames(n, mix=MIX, seed=0):
+    """n (arbitration_id, data) frames, in the proportions of mix."""
+    rng = np.random.default_rng(seed)
+    kinds = list(mix)
+    weights = np.array([mix[k] for k in kinds], dtype=np.float64)
+    choice = rng.choice(len(kinds), size=n, p=weights/weights.sum())
+    # Sensor timestamps count up in 18 bits, and roll over.
+    raw_ts = np.cumsum(rng.integers(1, 64, size=n)) % (1 << 18)
+    sensor = rng.choice(SENSOR_IDS, size=(n, 3))
+    values = rng.integers(0, 1 << 16, size=(n, 3))
+    def count(kind):
+        return np.cumsum(choice == kinds.index(kind)) if kind in kinds else np.zeros(n, dtype=np.int64)
+    autosequence = -5_000_000 + 10_000*count('autosequence')
+    # Throttle tables of four frames, each starting at time 0.
+    throttle = count('throttle') - 1
+
+    frames = []
+    for i, kind in enumerate(choice.tolist()):
+        kind = kinds[kind]
+        if kind == 'sensor':
+            s, v = sensor[i].tolist(), values[i].tolist()
+            arbitration_id = (int(raw_ts[i]) << 11) | s[0]
+            data = bytes([v[0] >> 8, v[0] & 0xFF, s[1], v[1] >> 8, v[1] & 0xFF, s[2], v[2] >> 8, v[2] & 0xFF])
+        elif kind == 'valves':
+            fields = int(rng.integers(0, 1 << 16))
+            arbitration_id = (fields << 12) | int(rng.choice((546, 547, 552)))
+            data = bytes(rng.integers(0, 2, size=8).tolist())
+        elif kind == 'node':
+            arbitration_id = int(rng.choice((514, 515, 520)))
+            data = bytes([int(rng.integers(0, len(CanReceive.CanReceive.VehicleStates)))])
+        elif kind == 'clock':
+            arbitration_id = 268
+            data = struct.pack('<II', i//1000, (i % 1000)*1000)
+        elif kind == 'autosequence':
+            arbitration_id = 1100
+            data = int(autosequence[i]).to_bytes(8, 'big', signed=True)
+        elif kind == 'throttle':
+            arbitration_id = 1506
+            t = 200*(int(throttle[i]) % 4)
+            data = struct.pack('>HHHH', t, 100, t + 100, 200)
+        else:
+            arbitration_id = int(rng.choice(CONTROLLER_IDS))
+            data = struct.pack('>ff', *rng.random(2).tolist())
+        frames.append((arbitration_id, data))
+    return frames
+
+def write_candump(path, frames):
+    with open(path, 'w') as file:
+        for arbitration_id, data in frames:
+            file.write("  can0  %08X   [%d]  %s\n"%(arbitration_id, len(data), ' '.join('%02X'%b for b in data)))
+
+# Coolterm records always carry 8 data bytes, short frames are zero padded.
+def write_coolterm(path, frames):
+    with open(path, 'w') as file:
+        for arbitration_id, data in frames:
+            file.write("%d:%s,\n"%(arbitration_id, ','.join(map(str, data.ljust(8, b'\0')))))
+
+FORMATS = {'candump': (parser.Candump, write_candump), 'coolterm': (parser.Coolterm, write_coolterm)}
+
+################################################################################
+#################################### Stages ####################################
+################################################################################
+
+# Handlers print as they go (autosequence changes); benchmarks don't.
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        yield
+
+def measure(stage, frames, size, memory=True):
+    """
+    Runs stage() once timed, and once more under tracemalloc for its peak
+    memory.  Returns (result, report).
+    """
+    with quiet():
+        t0 = time.perf_counter()
+        result = stage()
+        seconds = time.perf_counter() - t0
+    report = {'frames': frames, 'bytes': size, 'seconds': seconds,
+        'frames_per_sec': frames/seconds if seconds else None,
+        'bytes_per_sec': size/seconds if seconds else None}
+    if memory:
+        tracemalloc.start()
+        try:
+            with quiet():
+                stage()
+            report['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, report
+
+def run(n=100000, fmt='candump', mix=MIX, seed=0, memory=True, directory=None, processes=None):
+    reader, write = FORMATS[fmt]
+    stages = {}
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        path = os.path.join(tmp, 'synthetic.' + fmt + '.txt')
+        write(path, synthetic_frames(n, mix, seed))
+        size = os.path.getsize(path)
+
+        # String path, as translateMessage uses it.
+        def read_lines():
+            with open(path) as file:
+                return list(reader.generate_entries(file))
+        lines, stages['read_lines'] = measure(read_lines, n, size, memory)
+        prepped, stages['prep_format'] = measure(lambda: [reader.prep_format(line) for line in lines], n, size, memory)
+        messages, stages['RD2.prep'] = measure(lambda: [parser.RD2.prep(*p) for p in prepped], n, size, memory)
+        parsed, stages['RD2.parse'] = measure(lambda: [parser.RD2.parse(m) for m in messages], n, size, memory)
+        def translate_messages():
+            receiver = CanReceive.CanReceive('virtual', 'virtual')
+            for p in parsed:
+                receiver.translateMessage(*p)
+            return receiver
+        _, stages['translateMessage'] = measure(translate_messages, n, size, memory)
+
+        # Bytes path, as Pipeline.parse_stream uses it.
+        frames, stages['generate_frames'] = measure(lambda: list(reader.generate_frames(path)), n, size, memory)
+        decoded = list(Pipeline.decode_frames(frames))
+        def translate_frames():
+            return Pipeline.translate_frames(CanReceive.CanReceive('virtual', 'virtual'), decoded)
+        receiver, stages['translateFrame'] = measure(translate_frames, n, size, memory)
+        _, stages['parse_stream'] = measure(lambda: Pipeline.parse_stream(path, reader, progress=False), n, size, memory)
+        # Worker processes' memory isn't traced, so only the timed run.
+        _, stages['parse_parallel'] = measure(
+            lambda: ParallelParse.parse_parallel(path, reader, processes=processes), n, size, False)
+        serial, parallel = stages['parse_stream']['seconds'], stages['parse_parallel']['seconds']
+        checks = {'parallel_speedup': serial/parallel if parallel else None,
+            'processes': processes or os.cpu_count()}
+
+        for export in ('npz', 'parquet'):
+            if export == 'parquet' and Export.pq is None:
+                continue
+            prefix = os.path.join(tmp, 'export_' + export)
+            _, stages['export_' + export] = measure(
+                lambda: Export.export_receiver(receiver, prefix, export), n, size, memory)
+
+    return {
+        'config': {'frames': n, 'format': fmt, 'mix': mix, 'seed': seed, 'bytes': size,
+            'decoder_version': CanReceive.DECODER_VERSION, 'python': platform.python_version(),
+            'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'stages': stages,
+        'checks': checks,
+    }
+
+def compare(old, new):
+    """Prints each stage's frames/sec, new over old."""
+    for stage, report in new['stages'].items():
+        before = old['stages'].get(stage)
+        if before and before['frames_per_sec'] and report['frames_per_sec']:
+            print("%-18s %12.0f -> %12.0f frames/s  x%.2f"%(stage, before['frames_per_sec'],
+                report['frames_per_sec'], report['frames_per_sec']/before['frames_per_sec']))
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description="Benchmarks each parser stage on a synthetic dump.")
+    args.add_argument('--frames', type=int, default=100000)
+    args.add_argument('--format', choices=sorted(FORMATS), default='candump')
+    args.add_argument('--seed', type=int, default=0)
+    args.add_argument('--mix', type=json.loads, default=MIX, help="JSON {kind: weight}, kinds as in MIX")
+    args.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    args.add_argument('--processes', type=int, default=None, help="parse_parallel workers, all CPUs by default")
+    args.add_argument('--out', default=None, help="JSON results file, stdout by default")
+    args.add_argument('--compare', default=None, help="earlier JSON results to compare with")
+    args = args.parse_args(argv)
+
+    results = run(args.frames, args.format, args.mix, args.seed, not args.no_memory, processes=args.processes)
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(results, file, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    speedup = results['checks']['parallel_speedup']
+    if speedup is not None and speedup < 1:
+        print("parse_parallel is slower than parse_stream: x%.2f on %d processes"%(
+            speedup, results['checks']['processes']), file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), results)
+    return results
+
+if __name__ == "__main__":
+    main()
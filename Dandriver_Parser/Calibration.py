@@ -0,0 +1,82 @@
+# Calibration.py
+################################################################################
+#     Raw count -> engineering unit conversion, compiled from
+# SensorDefs.sensorList into dense arrays indexed by sensor ID, and applied to
+# whole ledgers or decoded batches at once with NumPy.
+#
+# A sensorList calibration is a list of polynomial coefficients, highest power
+# first (np.polyval order).  [m, b] is the usual linear m*raw + b; anything
+# longer, a thermocouple polynomial say, is evaluated as a polynomial.  IDs
+# without a calibration come through unchanged.
+
+import numpy as np
+
+import SensorDefs
+
+class Calibrations:
+    def __init__(self, sensorList=SensorDefs.sensorList, sensors=1028):
+        self.slope = np.ones(sensors)
+        self.offset = np.zeros(sensors)
+        self.polynomials = {}
+        for name, (sensor, node), coefficients in sensorList:
+            if len(coefficients) == 2:
+                self.slope[sensor], self.offset[sensor] = coefficients
+            else:
+                self.polynomials[sensor] = np.array(coefficients, dtype=np.float64)
+        self.nonlinear = np.zeros(sensors, dtype=bool)
+        self.nonlinear[list(self.polynomials)] = True
+
+    def calibrate(self, sensor_ids, raw):
+        """Converts raw values of mixed sensors, e.g. a decode_sensor_batch."""
+        sensor_ids = np.asarray(sensor_ids)
+        raw = np.asarray(raw, dtype=np.float64)
+        value = raw*self.slope[sensor_ids] + self.offset[sensor_ids]
+        if self.polynomials:
+            rows = np.flatnonzero(self.nonlinear[sensor_ids])
+            for sensor in np.unique(sensor_ids[rows]).tolist():
+                select = rows[sensor_ids[rows] == sensor]
+                value[select] = np.polyval(self.polynomials[sensor], raw[select])
+        return value
+
+    def calibrate_sensor(self, sensor, raw):
+        """Converts raw values of one sensor, e.g. a ledger's values column."""
+        raw = np.asarray(raw, dtype=np.float64)
+        if sensor in self.polynomials:
+            return np.polyval(self.polynomials[sensor], raw)
+        return raw*self.slope[sensor] + self.offset[sensor]
+
+    def value(self, sensor, raw):
+        """One raw value, without NumPy overhead."""
+        if sensor in self.polynomials:
+            result = 0.0
+            for c in self.polynomials[sensor].tolist():
+                result = result*raw + c
+            return result
+        return raw*float(self.slope[sensor]) + float(self.offset[sensor])
+
+default = Calibrations()
+
+def calibrate(sensor_ids, raw):
+    return default.calibrate(sensor_ids, raw)
+
+def calibrate_sensor(sensor, raw):
+    return default.calibrate_sensor(sensor, raw)
+
+class EngineeringView:
+    """
+    Read-only, engineering unit view of a CanReceive's Sensors.  Converts on
+    read, so it costs nothing while frames are decoded.
+    """
+    def __init__(self, receiver, calibrations=default):
+        self.receiver = receiver
+        self.calibrations = calibrations
+
+    def __getitem__(self, sensor):
+        return self.calibrations.value(sensor, self.receiver.Sensors[sensor])
+
+    def __len__(self):
+        return len(self.receiver.Sensors)
+
+    def array(self):
+        sensors = np.arange(len(self.receiver.Sensors))
+        return self.calibrations.calibrate(sensors, self.receiver.Sensors)
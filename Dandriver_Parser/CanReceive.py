@@ -3,7 +3,8 @@ import bitstring
 from bitarray.util import ba2int
 from bitarray import bitarray
 import time
-import struct
+
+import SensorDefs, Ledgers, Calibration, LiveReceive, SharedState, Schema
 
 bitarrLE = lambda x: bitarray(x, endian='little')
 #global IVANTIME, IVANTIME_ROLLOVER
@@ -23,6 +24,22 @@ def parse_hex_data(msg_data):
     data_bin = bitstring.BitArray(hex=data_list_hex).bin
     return data_bin, data_list_hex
 
+################################################################################
+######################## Integer-native frame helpers ##########################
+################################################################################
+# Used with CanReceive.parseFrame / CanReceive.translateFrame.  These work on
+# the raw int arbitration ID and the bytes payload, never on bit strings.
+
+ID_MASK = 0x7FF
+ID_SPACE = ID_MASK + 1
+
+# Bump whenever decoded ledgers or state change.  Keys the DecodeCache.
+DECODER_VERSION = 1
+
+# IDs of the packed sensor frames and the node state frames.
+SENSOR_IDS = sorted(set(range(51, 427)) | {s[1][0] for s in SensorDefs.sensorList})
+NODE_STATE_IDS = range(511, 530)
+
 class CanReceive:
     VehicleStates = [
         "Setup",
@@ -40,12 +57,18 @@ class CanReceive:
         "Fire"
         ]
     
-    def __init__(self, channel='can0', bustype='socketcan'):#bustype='socketcan'):
+    def __init__(self, channel='can0', bustype='socketcan', ledgers=None):#bustype='socketcan'):
         print("HI")
         self.loop = True
+        self.live = None
+        self.shared = None
+        self.share_interval = 0.05
+        # Optional hot-path counters, see Instrument.py.
+        self.instrument = None
         self.busargs = {'channel':channel, 'bustype':bustype}
 
         self.Sensors = [0] * 1028
+        self.SensorsEngineering = Calibration.EngineeringView(self)
         self.sensorTimestamps = [0] * 1028
         self.Valves = [0] * 64
         self.ValvesRenegadeEngine = [0] * 64
@@ -59,17 +82,86 @@ class CanReceive:
         self.AutosequenceTime = 0
         self.ThrottlePoints = {}
         self.AutosequenceTimeDupes = 0
-        self.AutosequenceLedger = []
 
         self.rocketDriverSeconds = 0.0
         self.rocketDriverMicros = 0.0
         self.sensorTimestamp = 0.0
         self.sensorRollover = 0.0
-        self.sensorLedgers = [[] for i in range(1028)]
-        self.timeLedger = []
+        # Per-node unwrapping and rocketDriver time, see ClockModel.py.
+        self.clock = None
+
+        # Columnar, growable ledgers.  Rows are appended like lists, columns
+        # read back as NumPy views (ledger.times, ledger.values).  Any other
+        # sink with the same layout can stand in, see Pipeline.py.  Long live
+        # sessions can pass a Ledgers.RetentionStore to bound memory.
+        self.ledgers = Ledgers.LedgerStore(1028) if ledgers is None else ledgers
+        self.sensorLedgers = self.ledgers.sensors
+        self.timeLedger = self.ledgers.time
+        self.AutosequenceLedger = self.ledgers.autosequence
 
         self.msgs_read = 0
 
+        # ID -> handlers dispatch tables over the 11 bit ID space, one per
+        # engine.  Each entry is a tuple, run in registration order.
+        self.messageHandlers = [()] * ID_SPACE
+        self.frameHandlers = [()] * ID_SPACE
+        self.register_default_handlers()
+
+    ############################################################################
+    ############################ Handler registry ##############################
+    ############################################################################
+
+    def register_handler(self, id_or_range, fn, engine='frame', replace=False):
+        """
+        Registers fn for an ID, or for every ID in a range/iterable of IDs.
+
+        engine='frame' handlers are called as fn(ID_A, msg_id, data) by
+        translateFrame, engine='message' handlers as
+        fn(ID_A, msg_id_bin, data_bin, data_list_hex) by translateMessage.
+        Handlers run after the ones already registered for that ID, unless
+        replace is set.
+        """
+        if engine == 'frame':
+            table = self.frameHandlers
+        elif engine == 'message':
+            table = self.messageHandlers
+        else:
+            raise ValueError("engine must be 'frame' or 'message', not %r"%engine)
+
+        ids = [id_or_range] if isinstance(id_or_range, int) else id_or_range
+        for ID_A in ids:
+            if not 0 <= ID_A < ID_SPACE:
+                raise ValueError("ID %r is outside the 11 bit ID space."%ID_A)
+            table[ID_A] = (fn,) if replace else table[ID_A] + (fn,)
+
+    def swap_handler(self, old, new, engine='frame'):
+        "Replaces old with new wherever it is registered, keeping the order."
+        table = self.frameHandlers if engine == 'frame' else self.messageHandlers
+        for ID_A, handlers in enumerate(table):
+            if old in handlers:
+                table[ID_A] = tuple(new if h == old else h for h in handlers)
+
+    def register_default_handlers(self):
+        # Clock first: 268 is also decoded as a sensor frame.
+        self.register_handler(268, self.ID_49420, 'message')
+        self.register_handler(268, self.ID_49420_frame)
+
+        self.register_handler(NODE_STATE_IDS, self.ID_Between_510_530, 'message')
+        self.register_handler(NODE_STATE_IDS, self.ID_Between_510_530_frame)
+
+        self.register_handler(SENSOR_IDS, self.ID_Between_050_427, 'message')
+        self.register_handler(SENSOR_IDS, self.ID_Between_050_427_frame)
+
+        self.register_handler(1100, self.ID_1100_Controller, 'message')
+        self.register_handler(1100, self.ID_1100_Controller_frame)
+        self.register_handler(1506, self.ID_1506_Controller, 'message')
+        self.register_handler(1506, self.ID_1506_Controller_frame)
+
+        # Valves and controllers, generated from their Schema.FAMILIES entries.
+        for family in Schema.FAMILIES:
+            self.register_handler(family.ids, getattr(self, family.name), 'message')
+            self.register_handler(family.ids, getattr(self, family.name + '_frame'))
+
     def run(self):
         # starts Canbus
         #bus_type = 'virtual'#'socketcan'
@@ -78,24 +170,63 @@ class CanReceive:
         print("initializing new can")
         print()
         
+        # Shared state is published every share_interval seconds, and when
+        # the bus goes quiet, rather than after every frame.
+        published = time.monotonic()
+        pending = False
         while self.loop:
             #yield # initial yield to init the bus. Why isn't this in init??
             ###print("waiting for message in...")
-            msg_in = bus_receive.recv(timeout=None)
+            # Wakes up now and then so stop() is seen on a quiet bus.
+            msg_in = bus_receive.recv(timeout=0.5)
+            if msg_in is None:
+                if pending:
+                    self.shared.publish()
+                    published, pending = time.monotonic(), False
+                continue
             ###print("bus mentioned")
 
             try:
-                ID_A, msg_id_bin, data_bin, data_list_hex = \
-                      self.parseMessage(msg_in)
+                ID_A, msg_id, data = self.parseFrame(msg_in)
             except Exception as e:
+                if self.instrument is not None:
+                    self.instrument.parse_error(e)
                 print(e)
                 continue
-        
+
             ###print("parsed message as:")
-            ###print(ID_A, data_list_hex)
+            ###print(ID_A, data.hex())
             ###print("")
             ###print("translating message:")
-            self.translateMessage(ID_A, msg_id_bin, data_bin, data_list_hex)
+            self.translateFrame(ID_A, msg_id, data)
+            if self.shared is not None:
+                now = time.monotonic()
+                if now - published >= self.share_interval:
+                    self.shared.publish()
+                    published, pending = now, False
+                else:
+                    pending = True
+        if pending:
+            self.shared.publish()
+        bus_receive.shutdown()
+
+    # Live ingest with receive and decode on separate threads, see
+    # LiveReceive.py.  Returns the LiveReceive for its counters.
+    def start_live(self, bus=None, **kwargs):
+        self.live = LiveReceive.LiveReceive(self, bus, **kwargs).start()
+        return self.live
+
+    # Publishes state to shared memory for other processes, see
+    # SharedState.py.  The live loops publish after every frame or batch.
+    def share_state(self, name='blt_state', interval=0.05):
+        self.share_interval = interval
+        self.shared = SharedState.StatePublisher(self, name)
+        return self.shared
+
+    def stop(self):
+        self.loop = False
+        if self.live is not None:
+            self.live.stop()
 
     def parseMessage(self, msg_in):
         # Grabs Message ID
@@ -122,107 +253,15 @@ class CanReceive:
 
         self.msgs_read += 1
 
-        if ID_A == 49420 or ID_A == 268: # C1OC:
-            self.ID_49420(ID_A, msg_id_bin, data_bin, data_list_hex)
-
-        if ID_A == 546:
-            self.ID_546(ID_A, msg_id_bin, data_bin, data_list_hex)
-        if ID_A == 552:
-            self.ID_552(ID_A, msg_id_bin, data_bin, data_list_hex)
-        if ID_A == 547:
-            self.ID_547(ID_A, msg_id_bin, data_bin, data_list_hex)
-        elif 510 < ID_A < 530:
-            self.ID_Between_510_530(ID_A, msg_id_bin, data_bin, data_list_hex)
-        elif 50 < ID_A < 427:
-            self.ID_Between_050_427(ID_A, msg_id_bin, data_bin, data_list_hex)
-            
-
-        elif ID_A > 1000:
-            self.translateControllerMessage(ID_A, msg_id_bin, data_bin, data_list_hex)
+        for handler in self.messageHandlers[ID_A]:
+            handler(ID_A, msg_id_bin, data_bin, data_list_hex)
 
     def translateControllerMessage(self, ID_A, msg_id_bin, data_bin, data_list_hex):
         " CONTROLLERS"
-        #print(ID_A)
-
-        if ID_A == 1100:
-            self.ID_1100_Controller(ID_A, msg_id_bin, data_bin, data_list_hex)
-        elif ID_A == 1506:
-            self.ID_1506_Controller(ID_A, msg_id_bin, data_bin, data_list_hex)
-        elif data_list_hex:
-            self.ID_Misc_Controller(ID_A, msg_id_bin, data_bin, data_list_hex)
+        if ID_A > 1000:
+            for handler in self.messageHandlers[ID_A]:
+                handler(ID_A, msg_id_bin, data_bin, data_list_hex)
 
-    def ID_546(self, ID_A, msg_id_bin, data_bin, data_list_hex):
-        """
-        Valves
-        
-        """
-        #print(msg_id_bin, data_bin)
-        HP1_bin = int(msg_id_bin[12:20])
-        HP1_bin = str(HP1_bin)[::-1]
-        if HP1_bin:
-            HP1 = ba2int(bitarray(HP1_bin))
-            #print(HP1)
-            #print(msg_id_bin)
-            self.ValvesRenegadeEngine[1] = HP1
-
-        HP2_bin = int(msg_id_bin[4:12])
-        HP2_bin = str(HP2_bin)[::-1]
-        HP2 = ba2int(bitarray(HP2_bin))
-
-        self.ValvesRenegadeEngine[2] = HP2
-        for i in range(3, 11):
-            HPi_bin = data_bin[(i - 3) * 8:(i - 2) * 8]
-            HPi = ba2int(bitarray(HPi_bin))
-            self.ValvesRenegadeEngine[i] = HPi
-    
-    def ID_552(self, ID_A, msg_id_bin, data_bin, data_list_hex):
-        """
-        Valves
-        
-        """
-        #print(msg_id_bin, data_bin)
-        HP1_bin = int(msg_id_bin[12:20])
-        HP1_bin = str(HP1_bin)[::-1]
-        if HP1_bin:
-            HP1 = ba2int(bitarray(HP1_bin))
-            #print(HP1)
-            #print(msg_id_bin)
-            self.Valves[1] = HP1
-
-        HP2_bin = int(msg_id_bin[4:12])
-        HP2_bin = str(HP2_bin)[::-1]
-        HP2 = ba2int(bitarray(HP2_bin))
-
-        self.Valves[2] = HP2
-        for i in range(3, 11):
-            HPi_bin = data_bin[(i - 3) * 8:(i - 2) * 8]
-            HPi = ba2int(bitarray(HPi_bin))
-            self.Valves[i] = HPi
-
-    def ID_547(self, ID_A, msg_id_bin, data_bin, data_list_hex):
-        """
-        Valves
-        
-        """
-        #print(msg_id_bin, data_bin)
-        HP1_bin = int(msg_id_bin[12:20])
-        HP1_bin = str(HP1_bin)[::-1]
-        if HP1_bin:
-            HP1 = ba2int(bitarray(HP1_bin))
-            #print(HP1)
-            #print(msg_id_bin)
-            self.ValvesRenegadeProp[1] = HP1
-
-        HP2_bin = int(msg_id_bin[4:12])
-        HP2_bin = str(HP2_bin)[::-1]
-        HP2 = ba2int(bitarray(HP2_bin))
-
-        self.ValvesRenegadeProp[2] = HP2
-        for i in range(3, 11):
-            HPi_bin = data_bin[(i - 3) * 8:(i - 2) * 8]
-            HPi = ba2int(bitarray(HPi_bin))
-            self.ValvesRenegadeProp[i] = HPi
-    
     def ID_Between_510_530(self, ID_A, msg_id_bin, data_bin, data_list_hex):
         "NODE STATES"
         "Engine Node 2"
@@ -234,8 +273,8 @@ class CanReceive:
                 self.NodeStatusRenegadeProp = CanReceive.VehicleStates[int(data_list_hex[0:2], 16)]
             if ID_A == 520: 
                 self.NodeStatusBang = CanReceive.VehicleStates[int(data_list_hex[0:2], 16)]
-            self.translateMessage(ID_A, msg_id_bin, data_bin, data_list_hex)
-        except:
+        except (IndexError, ValueError):
+            # Empty payload, or a state we don't know.
             return
 
     def ID_49420(self, ID_A, msg_id_bin, data_bin, data_list_hex):
@@ -319,7 +358,7 @@ class CanReceive:
             #print(self.AutosequenceTimeDupes, "Dupes parsed.")
             print("Autosequence Time:", self.AutosequenceTime)
             self.AutosequenceTimeDupes = 0
-            self.AutosequenceLedger.append([max(self.sensorTimestamps), self.AutosequenceTime])
+            self.AutosequenceLedger.append([self.latest_sensor_time(), self.AutosequenceTime])
 
     def ID_1506_Controller(self, ID_A, msg_id_bin, data_bin, data_list_hex):
         Time = int(data_list_hex[0:4], base=16)
@@ -335,33 +374,106 @@ class CanReceive:
         except:
             return
 
-    def ID_Misc_Controller(self, ID_A, msg_id_bin, data_bin, data_list_hex):
-        ControllerID = (round(ID_A, -2)-1000)//100
-        ControllerIndex = ID_A % 100
-        if len(data_list_hex) == 16:
-            
-            if ID_A == 1502 or ID_A == 1504:
-                value_1 = ba2int(bitarray(data_bin[0:32]), signed = True)
-                self.Controllers[ControllerID][ControllerIndex] = value_1
-                value_2 = ba2int(bitarray(data_bin[32:64]), signed = True)
-                self.Controllers[ControllerID][ControllerIndex + 1] = value_2
-            elif ControllerIndex == 14 or ControllerIndex == 15:
-                value_1 = int(data_bin[0:32],2)
-                self.Controllers[ControllerID][ControllerIndex] = value_1
-                value_2 = int(data_bin[32:64],2)
-                self.Controllers[ControllerID][ControllerIndex + 1] = value_2
-            else:
-                value_1 = int(data_bin[0:32],2)
-                value_1 = struct.unpack('f', struct.pack('I', value_1))[0]
-                self.Controllers[ControllerID][ControllerIndex] = value_1
-                value_2 = int(data_bin[32:64],2)
-                value_2 = struct.unpack('f', struct.pack('I', value_2))[0]
-                self.Controllers[ControllerID][ControllerIndex + 1] = value_2
-        else:
-            
-            value_1 = int(data_bin[0:32],2)
-            value_1 = struct.unpack('f', struct.pack('I', value_1))[0]
-            self.Controllers[ControllerID][ControllerIndex] = value_1
+    ############################################################################
+    ###################### Integer-native frame engine #########################
+    ############################################################################
+    # Mirrors parseMessage/translateMessage and the ID_* handlers, but keeps
+    # the arbitration ID as an int and the payload as bytes the whole way
+    # through.  Ledgers and state come out the same as the string path.
+
+    def parseFrame(self, msg_in):
+        msg_id = int(msg_in.arbitration_id)
+        return msg_id & ID_MASK, msg_id, bytes(msg_in.data)
 
+    def translateFrame(self, ID_A, msg_id, data):
 
+        self.msgs_read += 1
+
+        for handler in self.frameHandlers[ID_A]:
+            handler(ID_A, msg_id, data)
+
+    def ID_Between_510_530_frame(self, ID_A, msg_id, data):
+        "NODE STATES"
+        if not data or data[0] >= len(CanReceive.VehicleStates):
+            return
+        if ID_A == 514:
+            self.NodeStatusRenegadeEngine = CanReceive.VehicleStates[data[0]]
+        elif ID_A == 515:
+            self.NodeStatusRenegadeProp = CanReceive.VehicleStates[data[0]]
+        elif ID_A == 520:
+            self.NodeStatusBang = CanReceive.VehicleStates[data[0]]
+
+    def ID_49420_frame(self, ID_A, msg_id, data):
+        "Debug Clock signal.  Little endian seconds, then micros."
+        self.rocketDriverSeconds = int.from_bytes(data[:4], 'little')
+        self.rocketDriverMicros = int.from_bytes(data[4:], 'little')
+
+        self.timeLedger.append([self.msgs_read, self.rocketDriverSeconds + self.rocketDriverMicros*1e-6,
+            self.rocketDriverSeconds, self.rocketDriverMicros])
+
+    def sensor_entry(self, sensor_id, TimeStamp, value):
+        "One (ID, timestamp, value) entry of a packed sensor frame."
+        TimeStamp = TimeStamp * 10/2**18
+
+        if TimeStamp < self.sensorTimestamp:
+            self.sensorRollover = self.sensorRollover + 10.0
+        self.sensorTimestamp = TimeStamp
+
+        TimeStamp = (TimeStamp + self.sensorRollover)/8000
+
+        self.Sensors[sensor_id] = value
+        self.sensorTimestamps[sensor_id] = TimeStamp
+        self.sensorLedgers[sensor_id].append((TimeStamp, value))
+
+    def latest_sensor_time(self):
+        """
+        The latest sensor time decoded, in ledger units.  Unwrapped sensor
+        times only increase, so this is max(self.sensorTimestamps) without
+        the scan.
+        """
+        if self.clock is not None:
+            return self.clock.latest
+        return (self.sensorTimestamp + self.sensorRollover)/8000
+
+    def ID_Between_050_427_frame(self, ID_A, msg_id, data):
+        """
+        Sensors
+
+        The first entry takes its ID and timestamp from the arbitration ID.
+        The second and third entries carry a one byte ID and no timestamp.
+        """
+        n = len(data)
+        if n < 2:
+            return
+        self.sensor_entry(ID_A, msg_id >> 11, (data[0] << 8) | data[1])
+        if n > 4:
+            self.sensor_entry(data[2], 0, (data[3] << 8) | data[4])
+        if n > 7:
+            self.sensor_entry(data[5], 0, (data[6] << 8) | data[7])
+
+    def ID_1100_Controller_frame(self, ID_A, msg_id, data):
+        "AUTOSEQUENCE"
+        self.PrevAutosequenceTime = self.AutosequenceTime
+        self.AutosequenceTime = int.from_bytes(data, 'big', signed=True)/1_000_000
+
+        if self.PrevAutosequenceTime == self.AutosequenceTime:
+            self.AutosequenceTimeDupes += 1
+        else:
+            print("Autosequence Time:", self.AutosequenceTime)
+            self.AutosequenceTimeDupes = 0
+            self.AutosequenceLedger.append([self.latest_sensor_time(), self.AutosequenceTime])
+
+    def ID_1506_Controller_frame(self, ID_A, msg_id, data):
+        if not data:
+            return
+        Time = int.from_bytes(data[0:2], 'big')
+        ThrottlePoint = int.from_bytes(data[2:4], 'big')
+        if Time == 0:
+            self.ThrottlePoints = []
+        self.ThrottlePoints.append([Time, ThrottlePoint])
+        if len(data) > 6:
+            Time = int.from_bytes(data[4:6], 'big')
+            ThrottlePoint = int.from_bytes(data[6:8], 'big')
+            self.ThrottlePoints.append([Time, ThrottlePoint])
 
+Schema.install(CanReceive)
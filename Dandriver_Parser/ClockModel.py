@@ -0,0 +1,169 @@
+# ClockModel.py
+################################################################################
+#     One time base for a CanReceive's sensor, clock and autosequence times.
+#
+# CanReceive unwraps the 18 bit sensor timestamps with one global rollover
+# count, so frames from different nodes, interleaved slightly out of order,
+# can bump it when nothing wrapped.  Installed on a receiver, a ClockModel
+# takes over the packed sensor frames and unwraps each node's timestamps
+# separately (node from SensorDefs), telling a node's frames that arrive out
+# of order from rollovers (NodeClock), and keeps the latest sensor time
+# incrementally for the autosequence ledger.
+#
+# The 268 clock frames carry both a sensor timestamp and the rocketDriver
+# seconds/micros.  Each one is a (sensor time, rocketDriver time) pair, and a
+# streaming linear regression over them gives the offset and drift between the
+# clocks (the "+c" parseentry's comment misses), so any ledger's sensor times
+# can be mapped to rocketDriver time with absolute().  The fit is of the 268
+# node's clock; the other nodes are taken to count the same sensor time.
+#
+# Ledger times come out differently from the default global unwrap, so the
+# batch and parallel decoders (BatchDecode, ParallelParse), which reproduce
+# that, shouldn't be mixed with it.  ParallelParse still works on a receiver
+# with a ClockModel, replaying the sensor frames serially.
+#
+#   clock = ClockModel.ClockModel(receiver).install()
+#   ...
+#   clock.absolute(receiver.sensorLedgers[52].times)
+
+import math
+
+import numpy as np
+
+import SensorDefs
+
+NODE_FROM_SENSOR = {s[1][0]: s[1][1] for s in SensorDefs.sensorList}
+
+class StreamingFit:
+    """Least squares y = intercept + slope*x, updated one pair at a time."""
+    def __init__(self):
+        self.n = 0
+        self.mean_x = self.mean_y = 0.0
+        self.cxx = self.cxy = self.cyy = 0.0
+
+    def add(self, x, y):
+        self.n += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx/self.n
+        self.mean_y += dy/self.n
+        self.cxx += dx*(x - self.mean_x)
+        self.cxy += dx*(y - self.mean_y)
+        self.cyy += dy*(y - self.mean_y)
+
+    # Until x has spread, the clocks are assumed to run at the same rate.
+    def slope(self):
+        return self.cxy/self.cxx if self.cxx > 0 else 1.0
+
+    def intercept(self):
+        return self.mean_y - self.slope()*self.mean_x
+
+    def predict(self, x):
+        if not self.n:
+            return x*math.nan
+        return self.intercept() + self.slope()*x
+
+    def residual(self):
+        """Standard deviation of y around the fit."""
+        if self.n < 3 or self.cxx <= 0:
+            return None
+        return math.sqrt(max(self.cyy - self.cxy**2/self.cxx, 0.0)/(self.n - 2))
+
+class NodeClock:
+    """
+    One node's sensor timestamps unwrapped.  Timestamps wrap at 10, and a step
+    back of more than reorder is a rollover; smaller ones are frames arriving
+    out of order, as is a step forward of more than 10 - reorder (a late frame
+    from before the last rollover).  The default, half the wrap, takes
+    whichever reading is nearer the last timestamp.
+    """
+    __slots__ = ('last', 'rollover', 'reorder')
+
+    def __init__(self, reorder=5.0):
+        self.last = None
+        self.rollover = 0.0
+        self.reorder = reorder
+
+    def unwrap(self, timestamp):
+        if self.last is None:
+            self.last = timestamp
+        step = timestamp - self.last
+        if step < -self.reorder:
+            self.rollover += 10.0
+            self.last = timestamp
+        elif step > 10.0 - self.reorder:
+            return (timestamp + self.rollover - 10.0)/8000
+        elif step > 0:
+            self.last = timestamp
+        return (timestamp + self.rollover)/8000
+
+class ClockModel:
+    def __init__(self, receiver, reorder=5.0, nodes=NODE_FROM_SENSOR):
+        self.receiver = receiver
+        self.reorder = reorder
+        self.nodes = nodes
+        self.clocks = {}
+        self.latest = 0.0
+        self.fit = StreamingFit()
+        self._frame_time = None
+
+    def install(self):
+        receiver = self.receiver
+        receiver.swap_handler(receiver.ID_Between_050_427_frame, self.sensor_frame)
+        # After the clock handler has decoded rocketDriver time.
+        receiver.register_handler(268, self.clock_frame)
+        receiver.clock = self
+        return self
+
+    def uninstall(self):
+        receiver = self.receiver
+        receiver.swap_handler(self.sensor_frame, receiver.ID_Between_050_427_frame)
+        receiver.frameHandlers[268] = tuple(h for h in receiver.frameHandlers[268] if h != self.clock_frame)
+        receiver.clock = None
+        return self
+
+    def node_clock(self, node):
+        clock = self.clocks.get(node)
+        if clock is None:
+            clock = self.clocks[node] = NodeClock(self.reorder)
+        return clock
+
+    def entry(self, sensor_id, time, value):
+        receiver = self.receiver
+        receiver.Sensors[sensor_id] = value
+        receiver.sensorTimestamps[sensor_id] = time
+        receiver.sensorLedgers[sensor_id].append((time, value))
+
+    def sensor_frame(self, ID_A, msg_id, data):
+        """
+        Packed sensor frame, as CanReceive.ID_Between_050_427_frame.  The
+        second and third entries have no timestamp of their own, and take the
+        first entry's.
+        """
+        n = len(data)
+        if n < 2:
+            return
+        time = self.node_clock(self.nodes.get(ID_A)).unwrap((msg_id >> 11)*10/2**18)
+        if time > self.latest:
+            self.latest = time
+        self._frame_time = time
+        self.entry(ID_A, time, (data[0] << 8) | data[1])
+        if n > 4:
+            self.entry(data[2], time, (data[3] << 8) | data[4])
+        if n > 7:
+            self.entry(data[5], time, (data[6] << 8) | data[7])
+
+    def clock_frame(self, ID_A, msg_id, data):
+        if self._frame_time is None or len(data) < 2:
+            return
+        receiver = self.receiver
+        self.fit.add(self._frame_time, receiver.rocketDriverSeconds + receiver.rocketDriverMicros*1e-6)
+
+    def absolute(self, times):
+        """rocketDriver time of sensor times (a ledger's times column, say)."""
+        return self.fit.predict(np.asarray(times, dtype=np.float64))
+
+    def stats(self):
+        return {'pairs': self.fit.n, 'offset': self.fit.intercept() if self.fit.n else None,
+            'drift': self.fit.slope(), 'residual': self.fit.residual(), 'latest': self.latest,
+            'rollovers': {str(node): clock.rollover/10.0 for node, clock in self.clocks.items()}}
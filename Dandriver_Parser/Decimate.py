@@ -0,0 +1,142 @@
+# Decimate.py
+################################################################################
+#     Downsampling of (time, value) series to about a plot's pixel width,
+# keeping the spikes a plain stride would miss.
+#
+#   minmax    the min and max sample of each of n equal time buckets.  Every
+#             extreme survives, so the envelope looks exactly like the raw
+#             series at that width.
+#   lttb      Largest-Triangle-Three-Buckets: one sample per bucket, the one
+#             making the largest triangle with its neighbours.  Smoother
+#             looking lines, for the same number of points.
+#   Pyramid   min/max levels of a long series computed once, so re-drawing a
+#             zoomed window only looks at the level that fits it.
+#
+# Everything returns indices into (or samples of) the original series, never
+# averaged values, so a plotted point is always a real sample.
+
+import numpy as np
+
+def minmax_indices(times, values, n, start=None, stop=None):
+    """Indices of the min and max sample of n time buckets over start..stop."""
+    times = np.asarray(times)
+    values = np.asarray(values)
+    if len(times) <= 2*n:
+        return np.arange(len(times))
+    start = times[0] if start is None else start
+    stop = times[-1] if stop is None else stop
+    edges = np.searchsorted(times, np.linspace(start, stop, n + 1)[1:-1])
+    starts = np.unique(np.r_[0, edges])
+    starts = starts[starts < len(times)]
+
+    bucket = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(times)]))
+    low = np.minimum.reduceat(values, starts)
+    high = np.maximum.reduceat(values, starts)
+    # First sample in each bucket equal to its min, and to its max.
+    at_low = np.flatnonzero(values == low[bucket])
+    at_high = np.flatnonzero(values == high[bucket])
+    first_low = at_low[np.unique(bucket[at_low], return_index=True)[1]]
+    first_high = at_high[np.unique(bucket[at_high], return_index=True)[1]]
+    return np.unique(np.r_[0, first_low, first_high, len(times) - 1])
+
+def minmax(times, values, n, start=None, stop=None):
+    i = minmax_indices(times, values, n, start, stop)
+    return np.asarray(times)[i], np.asarray(values)[i]
+
+def lttb_indices(times, values, n):
+    """
+    Indices of n samples picked by Largest-Triangle-Three-Buckets.
+
+    Each pick depends on the one before it, so buckets are still visited in
+    order, but the triangle area is linear in a bucket's samples:
+    |(ta - ct)*v + (cv - va)*t + (ct*va - ta*cv)| for the previous pick
+    (ta, va) and the next bucket's mean (ct, cv).  A bucket is then one
+    product of three coefficients with the stacked (v, t, 1) samples, and
+    every bucket's mean is computed up front.  For a single plot; Pyramid is
+    the one for redrawing zoomed windows of a long series.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    size = len(times)
+    if n >= size or n < 3:
+        return np.arange(size)
+    # n - 2 buckets between the fixed first and last samples.
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    mean_t = np.add.reduceat(times[1:size - 1], edges[:-1] - 1)/np.diff(edges)
+    mean_v = np.add.reduceat(values[1:size - 1], edges[:-1] - 1)/np.diff(edges)
+    # The next bucket's mean, or the last sample after the last bucket.
+    next_t = np.r_[mean_t[1:], times[-1]].tolist()
+    next_v = np.r_[mean_v[1:], values[-1]].tolist()
+    samples = np.vstack((values, times, np.ones(size)))
+
+    picked = np.empty(n, dtype=np.int64)
+    picked[0], picked[-1] = 0, size - 1
+    coefficients = np.empty(3)
+    ta, va = float(times[0]), float(values[0])
+    edges = edges.tolist()
+    for b in range(n - 2):
+        ct, cv = next_t[b], next_v[b]
+        coefficients[0] = ta - ct
+        coefficients[1] = cv - va
+        coefficients[2] = ct*va - ta*cv
+        a = edges[b] + int(np.abs(coefficients @ samples[:, edges[b]:edges[b + 1]]).argmax())
+        picked[b + 1] = a
+        ta, va = float(times[a]), float(values[a])
+    return picked
+
+def lttb(times, values, n):
+    i = lttb_indices(times, values, n)
+    return np.asarray(times)[i], np.asarray(values)[i]
+
+class Pyramid:
+    """
+    Min/max envelopes of a series at factor, factor**2, ... samples per
+    point, down to about min_points points.  query() picks the finest level
+    that has at most points_per_pixel points per pixel in the window.
+    """
+    def __init__(self, times, values, factor=4, min_points=1024, points_per_pixel=4):
+        self.factor = factor
+        self.points_per_pixel = points_per_pixel
+        self.levels = [(np.asarray(times), np.asarray(values))]
+        while len(self.levels[-1][0]) > max(min_points, 2*factor):
+            t, v = self.levels[-1]
+            i = self.envelope(v, 2*factor)
+            self.levels.append((t[i], v[i]))
+
+    @staticmethod
+    def envelope(values, group):
+        """Indices of the min and max of each group of samples, in order."""
+        whole = len(values)//group*group
+        rows = values[:whole].reshape(-1, group)
+        base = np.arange(0, whole, group)
+        low = base + rows.argmin(axis=1)
+        high = base + rows.argmax(axis=1)
+        picked = np.column_stack((np.minimum(low, high), np.maximum(low, high))).ravel()
+        if whole < len(values):
+            tail = values[whole:]
+            picked = np.r_[picked, sorted({whole + int(tail.argmin()), whole + int(tail.argmax())})]
+        return picked
+
+    def query(self, start, stop, width):
+        """(times, values) for start..stop, about width pixels wide."""
+        for t, v in self.levels:
+            a = max(0, int(np.searchsorted(t, start, 'left')) - 1)
+            b = int(np.searchsorted(t, stop, 'right')) + 1
+            if b - a <= self.points_per_pixel*width:
+                break
+        t, v = t[a:b], v[a:b]
+        if not len(t):
+            return t, v
+        i = minmax_indices(t, v, width, max(start, t[0]), min(stop, t[-1]))
+        return t[i], v[i]
+
+def recent(ledger, width, seconds=None, column='values'):
+    """
+    Min/max decimated (times, values) of a live ledger, the last seconds of
+    it or all of it, for redrawing a live plot every update.
+    """
+    times, values = ledger.times, ledger.column(column)
+    if seconds is not None and len(times):
+        a = int(np.searchsorted(times, times[-1] - seconds, 'left'))
+        times, values = times[a:], values[a:]
+    return minmax(times, values, width)
@@ -0,0 +1,194 @@
+# DecodeCache.py
+################################################################################
+#     Persistent cache of decoded dumps.  After the first full parse, the
+# ledgers and final state of a CanReceive are written to a cache directory as
+# .npy files and a small JSON state file.  Later runs memory map the .npy
+# files straight back into ledgers and never touch the parser.
+#
+# Entries are keyed by a content hash of the input (and the archive member, if
+# any), CanReceive.DECODER_VERSION and a hash of SensorDefs.sensorList.
+# Content hashes are remembered per (path, size, mtime), so an unchanged file
+# isn't hashed twice.  The directory is kept under max_bytes by evicting the
+# least recently used entries.
+#
+# Entry layout:
+#   sensors.npy         (2, n) times and values of every sensor, concatenated
+#   sensor_ids.npy      sensor IDs with samples, ascending
+#   sensor_offsets.npy  where each of those sensors starts/stops in sensors.npy
+#   time.npy            (4, n) timeLedger columns
+#   autosequence.npy    (2, n) AutosequenceLedger columns
+#   state.json          last known values, see STATE
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+import CanReceive, SensorDefs, Ledgers
+
+STATE = ('Sensors', 'sensorTimestamps', 'Valves', 'ValvesRenegadeEngine', 'ValvesRenegadeProp',
+    'Controllers', 'NodeStatusBang', 'NodeStatusRenegadeEngine', 'NodeStatusRenegadeProp',
+    'AutosequenceTime', 'ThrottlePoints', 'AutosequenceTimeDupes', 'rocketDriverSeconds',
+    'rocketDriverMicros', 'sensorTimestamp', 'sensorRollover', 'msgs_read')
+
+DEFAULT_DIRECTORY = os.environ.get('BLT_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'blt_parser'))
+
+def sensordefs_version():
+    return hashlib.sha256(repr(SensorDefs.sensorList).encode()).hexdigest()[:16]
+
+def content_hash(path, chunk=1<<20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(chunk), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class DecodeCache:
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=4<<30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, 'index.json')
+        self.index = self._read_index()
+
+    ############################################################################
+    # Index: content hashes by fingerprint, and entry sizes/last use.
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {'fingerprints': {}, 'entries': {}}
+
+    def _write_index(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(self.index, file)
+        os.replace(tmp, self.index_path)
+
+    def _content_hash(self, path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        known = self.index['fingerprints'].get(path)
+        if known and known[:2] == fingerprint:
+            return known[2]
+        digest = content_hash(path)
+        self.index['fingerprints'][path] = fingerprint + [digest]
+        self._write_index()
+        return digest
+
+    def key(self, path, member=''):
+        parts = [self._content_hash(path), member, str(CanReceive.DECODER_VERSION), sensordefs_version()]
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()[:32]
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    ############################################################################
+    # Load/store
+
+    def load(self, path, member=''):
+        """Returns the cached CanReceive for path, or None."""
+        key = self.key(path, member)
+        entry = self._entry(key)
+        if key not in self.index['entries'] or not os.path.isdir(entry):
+            return None
+        def array(name):
+            return np.load(os.path.join(entry, name), mmap_mode='r')
+
+        store = Ledgers.LedgerStore(1028)
+        sensors, offsets = array('sensors.npy'), array('sensor_offsets.npy')
+        for sensor, start, stop in zip(array('sensor_ids.npy').tolist(), offsets[:-1].tolist(), offsets[1:].tolist()):
+            store.sensors[sensor] = Ledgers.Ledger.from_buffer(Ledgers.SENSOR_COLUMNS, sensors[:, start:stop])
+        store.time = Ledgers.Ledger.from_buffer(Ledgers.TIME_COLUMNS, array('time.npy'))
+        store.autosequence = Ledgers.Ledger.from_buffer(Ledgers.AUTOSEQUENCE_COLUMNS, array('autosequence.npy'))
+
+        receiver = CanReceive.CanReceive('virtual', 'virtual', ledgers=store)
+        with open(os.path.join(entry, 'state.json')) as file:
+            for name, value in json.load(file).items():
+                setattr(receiver, name, value)
+
+        self.index['entries'][key]['used'] = time.time()
+        self._write_index()
+        return receiver
+
+    def store(self, path, receiver, member=''):
+        """Writes a parsed receiver's ledgers and state to the cache."""
+        key = self.key(path, member)
+        entry = self._entry(key)
+        tmp = entry + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        ledgers = receiver.ledgers
+        ledgers.flush()
+        sensor_ids = [i for i, ledger in enumerate(ledgers.sensors) if len(ledger)]
+        offsets = np.cumsum([0] + [len(ledgers.sensors[i]) for i in sensor_ids])
+        sensors = np.concatenate([ledgers.sensors[i].rows().T for i in sensor_ids], axis=1) \
+            if sensor_ids else np.empty((2, 0))
+        np.save(os.path.join(tmp, 'sensors.npy'), sensors)
+        np.save(os.path.join(tmp, 'sensor_ids.npy'), np.array(sensor_ids, dtype=np.int32))
+        np.save(os.path.join(tmp, 'sensor_offsets.npy'), offsets.astype(np.int64))
+        np.save(os.path.join(tmp, 'time.npy'), np.ascontiguousarray(ledgers.time.rows().T))
+        np.save(os.path.join(tmp, 'autosequence.npy'), np.ascontiguousarray(ledgers.autosequence.rows().T))
+        with open(os.path.join(tmp, 'state.json'), 'w') as file:
+            json.dump({name: getattr(receiver, name) for name in STATE}, file)
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+        self.index['entries'][key] = {'bytes': size, 'used': time.time()}
+        self.evict(keep=key)
+        self._write_index()
+        return key
+
+    def cached(self, path, parse, member=''):
+        """
+        Returns the cached CanReceive for path, or calls parse() for one and
+        caches it.
+        """
+        receiver = self.load(path, member)
+        if receiver is None:
+            receiver = parse()
+            self.store(path, receiver, member)
+        return receiver
+
+    ############################################################################
+    # Invalidation and eviction
+
+    def _remove(self, key):
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+        self.index['entries'].pop(key, None)
+
+    def invalidate(self, path, member=''):
+        """Drops the entry for path, and forgets its content hash."""
+        self._remove(self.key(path, member))
+        self.index['fingerprints'].pop(os.path.realpath(path), None)
+        self._write_index()
+
+    def clear(self):
+        for key in list(self.index['entries']):
+            self._remove(key)
+        self.index = {'fingerprints': {}, 'entries': {}}
+        self._write_index()
+
+    def nbytes(self):
+        return sum(entry['bytes'] for entry in self.index['entries'].values())
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until under max_bytes."""
+        entries = sorted(self.index['entries'].items(), key=lambda item: item[1]['used'])
+        total = self.nbytes()
+        for key, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            total -= entry['bytes']
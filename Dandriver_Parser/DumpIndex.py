@@ -0,0 +1,97 @@
+# DumpIndex.py
+################################################################################
+#     Sparse byte-offset index into a raw candump/Coolterm file, for decoding
+# just a time window (a few seconds around ignition, say) instead of the
+# whole dump.
+#
+# The index is built in one pass.  The file is read in byte-range segments,
+# and at the start of each segment the index records a checkpoint: the byte
+# offset, the reconstructed sensor time (rollover included), and a snapshot
+# of the parser state (see DecodeCache.STATE).  The readers align ranges to
+# records the same way every time, so decoding from a checkpoint's offset
+# with its state restored gives exactly the frames and state a full parse
+# would have at that point.
+#
+# The index is kept in a sidecar, <dump>.idx.json, and rebuilt when the dump
+# or the decoder changes.
+
+import bisect
+import json
+import os
+
+import CanReceive, DecodeCache, Pipeline
+
+def sensor_time(receiver):
+    """Time of the last decoded sensor entry, as it appears in the ledgers."""
+    return receiver.latest_sensor_time()
+
+class DumpIndex:
+    def __init__(self, path, fmt, checkpoints=(), interval=1<<20):
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self.checkpoints = list(checkpoints)
+        self.times = [checkpoint['time'] for checkpoint in self.checkpoints]
+
+    def sidecar(self):
+        return self.path + '.idx.json'
+
+    def fingerprint(self):
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns, CanReceive.DECODER_VERSION,
+            DecodeCache.sensordefs_version(), self.fmt.__name__, self.interval]
+
+    def build(self):
+        """One pass over the dump, checkpointing every interval bytes."""
+        receiver = CanReceive.CanReceive('virtual', 'virtual', ledgers=Pipeline.SummarySink())
+        size = os.path.getsize(self.path)
+        self.checkpoints = []
+        for start in range(0, max(size, 1), self.interval):
+            # Snapshot by value: the receiver keeps mutating its lists.
+            state = json.dumps({name: getattr(receiver, name) for name in DecodeCache.STATE})
+            self.checkpoints.append({'offset': start, 'time': sensor_time(receiver),
+                'state': json.loads(state)})
+            frames = self.fmt.generate_frames(self.path, start, start + self.interval)
+            Pipeline.translate_frames(receiver, Pipeline.decode_frames(frames))
+        self.times = [checkpoint['time'] for checkpoint in self.checkpoints]
+        self.save()
+        return self
+
+    def save(self):
+        with open(self.sidecar(), 'w') as file:
+            json.dump({'fingerprint': self.fingerprint(), 'checkpoints': self.checkpoints}, file)
+
+    def query(self, sensors, t_start, t_end):
+        """
+        Decodes only the window t_start..t_end (ledger time) and returns
+        {sensor: (times, values)} for the requested sensor IDs.
+        """
+        # Last checkpoint strictly before the window, so nothing in it is missed.
+        i = max(0, bisect.bisect_left(self.times, t_start) - 1)
+        checkpoint = self.checkpoints[i]
+
+        receiver = CanReceive.CanReceive('virtual', 'virtual')
+        for name, value in checkpoint['state'].items():
+            setattr(receiver, name, value)
+
+        translate = receiver.translateFrame
+        for ID_A, msg_id, data in Pipeline.decode_frames(
+                self.fmt.generate_frames(self.path, checkpoint['offset'])):
+            translate(ID_A, msg_id, data)
+            # Sensor times never go backwards, so nothing later is in the window.
+            if sensor_time(receiver) > t_end:
+                break
+
+        return {sensor: receiver.sensorLedgers[sensor].window(t_start, t_end) for sensor in sensors}
+
+def open_index(path, fmt, interval=1<<20):
+    """Loads the sidecar index for a dump, building it if missing or stale."""
+    index = DumpIndex(path, fmt, interval=interval)
+    try:
+        with open(index.sidecar()) as file:
+            saved = json.load(file)
+        if saved['fingerprint'] == index.fingerprint():
+            return DumpIndex(path, fmt, saved['checkpoints'], interval)
+    except (OSError, ValueError, KeyError):
+        pass
+    return index.build()
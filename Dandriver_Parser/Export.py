@@ -0,0 +1,252 @@
+# Export.py
+################################################################################
+#     Columnar binary export of decoded ledgers, written a chunk at a time as
+# the dump is decoded, and read back one sensor at a time.
+#
+# Two formats:
+#   parquet  prefix_sensors.parquet, prefix_time.parquet and
+#            prefix_autosequence.parquet.  Needs pyarrow.  Each row group of
+#            the sensors file holds one sensor, so reading a sensor only
+#            reads its row groups.
+#   npz      prefix.npz, a zip of .npy chunks named <ledger>/<chunk>.npy,
+#            sensors/<id>/<chunk>.npy for sensors.  Needs only NumPy.
+#
+# Both carry SensorDefs metadata: sensor names, nodes, units and calibration,
+# plus the decoder version.  Values are stored raw, as in the ledgers.
+
+import io
+import json
+import os
+import zipfile
+
+import numpy as np
+
+import CanReceive, SensorDefs, Ledgers
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = ('parquet', 'npz')
+COLUMNS = {'sensors': Ledgers.SENSOR_COLUMNS, 'time': Ledgers.TIME_COLUMNS,
+    'autosequence': Ledgers.AUTOSEQUENCE_COLUMNS}
+
+def default_format():
+    return 'parquet' if pq is not None else 'npz'
+
+def metadata():
+    return {
+        'decoder_version': CanReceive.DECODER_VERSION,
+        'sensors': {str(sensor): {'name': name, 'node': node, 'calibration': calibration,
+                'units': SensorDefs.sensor_units_from_id[sensor]}
+            for name, (sensor, node), calibration in SensorDefs.sensorList},
+        'columns': COLUMNS,
+    }
+
+################################################################################
+#################################### Writers ###################################
+################################################################################
+
+class NpzWriter:
+    def __init__(self, prefix):
+        self.path = prefix + '.npz'
+        self.zip = zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self.chunks = {}
+
+    def write(self, ledger, sensor, columns):
+        key = ledger if sensor is None else '%s/%d'%(ledger, sensor)
+        n = self.chunks.get(key, 0)
+        self.chunks[key] = n + 1
+        with self.zip.open('%s/%06d.npy'%(key, n), 'w', force_zip64=True) as file:
+            np.lib.format.write_array(file, np.ascontiguousarray(columns))
+
+    def close(self):
+        self.zip.writestr('metadata.json', json.dumps(metadata()))
+        self.zip.close()
+
+class ParquetWriter:
+    def __init__(self, prefix):
+        if pq is None:
+            raise ImportError("Parquet export needs pyarrow, use fmt='npz'.")
+        self.prefix = prefix
+        self.writers = {}
+
+    def _writer(self, ledger, names):
+        if ledger not in self.writers:
+            fields = [pa.field(name, pa.int16() if name == 'sensor' else pa.float64()) for name in names]
+            schema = pa.schema(fields, metadata={'blt': json.dumps(metadata())})
+            self.writers[ledger] = pq.ParquetWriter('%s_%s.parquet'%(self.prefix, ledger), schema)
+        return self.writers[ledger]
+
+    def write(self, ledger, sensor, columns):
+        names = COLUMNS[ledger]
+        arrays = [pa.array(column) for column in columns]
+        if sensor is not None:
+            arrays.insert(0, pa.array(np.full(columns.shape[1], sensor, dtype=np.int16)))
+            names = ('sensor',) + tuple(names)
+        writer = self._writer(ledger, names)
+        writer.write_table(pa.Table.from_arrays(arrays, names=list(names)), row_group_size=columns.shape[1])
+
+    def close(self):
+        # Readers look for the sensors file, even when there were no samples.
+        self._writer('sensors', ('sensor',) + Ledgers.SENSOR_COLUMNS)
+        for writer in self.writers.values():
+            writer.close()
+
+WRITERS = {'parquet': ParquetWriter, 'npz': NpzWriter}
+
+################################################################################
+#################################### Sinks #####################################
+################################################################################
+
+class ChunkRows:
+    """
+    Row sink that hands the writer one (width, chunk) block at a time.  Rows
+    are staged as a Ledger stages them: a short list, copied into a NumPy
+    block that grows up to the chunk size and is reused once written.
+    """
+    def __init__(self, writer, ledger, sensor, width, chunk, stage=1024):
+        self.writer = writer
+        self.ledger = ledger
+        self.sensor = sensor
+        self.width = width
+        self.chunk = chunk
+        self._block = np.empty((width, 0))
+        self._size = 0
+        self._pending = []
+        self._stage = min(stage, chunk)*width
+
+    def append(self, row):
+        pending = self._pending
+        pending.extend(row)
+        if len(pending) >= self._stage:
+            self._copy_pending()
+
+    # One array-like per column, as Ledger.extend_columns.
+    def extend_columns(self, *columns):
+        if len(columns) != self.width:
+            raise ValueError("Expected %d columns, got %d."%(self.width, len(columns)))
+        self._copy_pending()
+        self._write(np.asarray(columns, dtype=np.float64).reshape(self.width, -1))
+
+    def _copy_pending(self):
+        if self._pending:
+            rows = np.array(self._pending, dtype=np.float64).reshape(-1, self.width)
+            self._pending = []
+            self._write(rows.T)
+
+    def _write(self, columns):
+        while columns.shape[1]:
+            size = min(self._size + columns.shape[1], self.chunk)
+            n = size - self._size
+            if size > self._block.shape[1]:
+                block = np.empty((self.width, min(max(16, 2*self._block.shape[1], size), self.chunk)))
+                block[:, :self._size] = self._block[:, :self._size]
+                self._block = block
+            self._block[:, self._size:size] = columns[:, :n]
+            self._size = size
+            columns = columns[:, n:]
+            if size == self.chunk:
+                self._hand_over()
+
+    def _hand_over(self):
+        if self._size:
+            self.writer.write(self.ledger, self.sensor, self._block[:, :self._size])
+            self._size = 0
+
+    def flush(self):
+        self._copy_pending()
+        self._hand_over()
+
+class ExportSink:
+    """
+    Streams ledger rows to a parquet or npz export, see Pipeline.py for sinks.
+    """
+    def __init__(self, prefix, fmt=None, sensors=1028, chunk=1<<16):
+        self.writer = WRITERS[fmt or default_format()](prefix)
+        width = len(Ledgers.SENSOR_COLUMNS)
+        self.sensors = [ChunkRows(self.writer, 'sensors', i, width, chunk) for i in range(sensors)]
+        self.time = ChunkRows(self.writer, 'time', None, len(Ledgers.TIME_COLUMNS), chunk)
+        self.autosequence = ChunkRows(self.writer, 'autosequence', None, len(Ledgers.AUTOSEQUENCE_COLUMNS), chunk)
+
+    def close(self):
+        for rows in self.sensors + [self.time, self.autosequence]:
+            rows.flush()
+        self.writer.close()
+
+def export_receiver(receiver, prefix, fmt=None, chunk=1<<16):
+    """Writes an already parsed receiver's ledgers."""
+    writer = WRITERS[fmt or default_format()](prefix)
+    ledgers = receiver.ledgers
+    for ledger, sensor, rows in [('sensors', i, ledger.rows()) for i, ledger in enumerate(ledgers.sensors)] \
+            + [('time', None, ledgers.time.rows()), ('autosequence', None, ledgers.autosequence.rows())]:
+        for start in range(0, len(rows), chunk):
+            writer.write(ledger, sensor, rows[start:start + chunk].T)
+    writer.close()
+
+################################################################################
+#################################### Readers ###################################
+################################################################################
+
+def detect_format(prefix):
+    if os.path.exists(prefix + '.npz'):
+        return 'npz'
+    if os.path.exists(prefix + '_sensors.parquet'):
+        return 'parquet'
+    raise FileNotFoundError("No export at %r."%prefix)
+
+def read_metadata(prefix, fmt=None):
+    if (fmt or detect_format(prefix)) == 'npz':
+        with zipfile.ZipFile(prefix + '.npz') as archive:
+            return json.loads(archive.read('metadata.json'))
+    return json.loads(pq.read_schema(prefix + '_sensors.parquet').metadata[b'blt'])
+
+def _npz_chunks(archive, key):
+    names = sorted(name for name in archive.namelist() if name.startswith(key + '/')
+        and name.count('/') == key.count('/') + 1)
+    return [np.lib.format.read_array(io.BytesIO(archive.read(name))) for name in names]
+
+def read_sensors(prefix, sensors=None, fmt=None):
+    """
+    {sensor: (times, values)} for the given sensor IDs, or every exported
+    sensor.  Only the requested sensors' chunks are read.
+    """
+    fmt = fmt or detect_format(prefix)
+    result = {}
+    if fmt == 'npz':
+        with zipfile.ZipFile(prefix + '.npz') as archive:
+            if sensors is None:
+                sensors = sorted({int(name.split('/')[1]) for name in archive.namelist()
+                    if name.startswith('sensors/')})
+            for sensor in sensors:
+                chunks = _npz_chunks(archive, 'sensors/%d'%sensor)
+                columns = np.concatenate(chunks, axis=1) if chunks else np.empty((2, 0))
+                result[sensor] = (columns[0], columns[1])
+        return result
+
+    file = pq.ParquetFile(prefix + '_sensors.parquet')
+    groups = {}
+    for i in range(file.metadata.num_row_groups):
+        statistics = file.metadata.row_group(i).column(0).statistics
+        groups.setdefault(statistics.min, []).append(i)
+    for sensor in (sorted(groups) if sensors is None else sensors):
+        table = file.read_row_groups(groups.get(sensor, []), columns=list(Ledgers.SENSOR_COLUMNS))
+        result[sensor] = tuple(table.column(name).to_numpy() for name in Ledgers.SENSOR_COLUMNS)
+    return result
+
+def read_ledger(prefix, ledger, columns=None, fmt=None):
+    """{column: array} of the 'time' or 'autosequence' ledger, optionally just some columns."""
+    names = COLUMNS[ledger]
+    columns = list(names if columns is None else columns)
+    if (fmt or detect_format(prefix)) == 'npz':
+        with zipfile.ZipFile(prefix + '.npz') as archive:
+            chunks = _npz_chunks(archive, ledger)
+        rows = np.concatenate(chunks, axis=1) if chunks else np.empty((len(names), 0))
+        return {name: rows[names.index(name)] for name in columns}
+    path = '%s_%s.parquet'%(prefix, ledger)
+    if not os.path.exists(path):
+        return {name: np.empty(0) for name in columns}
+    table = pq.read_table(path, columns=columns)
+    return {name: table.column(name).to_numpy() for name in columns}
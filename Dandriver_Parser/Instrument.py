@@ -0,0 +1,199 @@
+# Instrument.py
+################################################################################
+#     Optional hot-path instrumentation for CanReceive: frames and bytes per
+# 11 bit ID, and per handler its calls, errors (with the last exception) and
+# execution time histogram.
+#
+# enable() swaps the receiver's translateFrame and translateMessage for
+# counting versions, disable() swaps the plain methods back, so a receiver
+# that isn't instrumented pays nothing.  Loops bind translateFrame when they
+# start (Pipeline, LiveReceive), so enable before starting them.
+#
+# Histograms are HDR-style: fixed log-linear buckets, four per power of two
+# of nanoseconds, so any time lands in a bucket within about 20% of it.
+#
+#   instrument = Instrument.Instrument(receiver).enable()
+#   instrument.start_dump(10.0)        # a stats() snapshot every 10 seconds
+#   instrument.stats()
+
+import json
+import threading
+import time
+
+import CanReceive
+
+################################################################################
+################################## Histograms ##################################
+################################################################################
+
+SUB_BUCKETS = 4
+BUCKETS = 160   # up to 2**41 ns, about 36 minutes
+
+def bucket_of(ns):
+    if ns < 2*SUB_BUCKETS:
+        return ns if ns > 0 else 0
+    bits = ns.bit_length()
+    return min((bits - 2)*SUB_BUCKETS + ((ns >> (bits - 3)) & (SUB_BUCKETS - 1)), BUCKETS - 1)
+
+def bucket_floor(index):
+    """Smallest ns in a bucket."""
+    if index < 2*SUB_BUCKETS:
+        return index
+    bits = index//SUB_BUCKETS + 2
+    return (SUB_BUCKETS + index % SUB_BUCKETS) << (bits - 3)
+
+def histogram_percentile(counts, total, percent):
+    """Bucket floor at or below which percent of the samples fall."""
+    if not total:
+        return None
+    rank = percent/100*total
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if count and seen >= rank:
+            return bucket_floor(index)
+    return bucket_floor(len(counts) - 1)
+
+class HandlerStats:
+    __slots__ = ('name', 'calls', 'errors', 'last_error', 'total_ns', 'max_ns', 'histogram')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.last_error = None
+        self.total_ns = 0
+        self.max_ns = 0
+        self.histogram = [0]*BUCKETS
+
+    def report(self):
+        calls = self.calls
+        return {'calls': calls, 'errors': self.errors,
+            'last_error': None if self.last_error is None else repr(self.last_error),
+            'total_ns': self.total_ns, 'mean_ns': self.total_ns/calls if calls else None,
+            'p50_ns': histogram_percentile(self.histogram, calls, 50),
+            'p99_ns': histogram_percentile(self.histogram, calls, 99),
+            'max_ns': self.max_ns,
+            'histogram': {bucket_floor(i): n for i, n in enumerate(self.histogram) if n}}
+
+################################################################################
+################################## Instrument ##################################
+################################################################################
+
+class Instrument:
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.frames = [0]*CanReceive.ID_SPACE
+        self.bytes = [0]*CanReceive.ID_SPACE
+        self.handlers = {}
+        self.parse_errors = 0
+        self.last_parse_error = None
+        self.started = time.time()
+        self._dump = None
+
+    def _stats_for(self, handler):
+        stats = self.handlers.get(handler)
+        if stats is None:
+            stats = self.handlers[handler] = HandlerStats(getattr(handler, '__name__', repr(handler)))
+        return stats
+
+    def _translator(self, table):
+        receiver = self.receiver
+        frames, nbytes, handlers = self.frames, self.bytes, self.handlers
+        stats_for, bucket = self._stats_for, bucket_of
+        clock = time.perf_counter_ns
+
+        def translate(ID_A, msg_id, data, *rest):
+            receiver.msgs_read += 1
+            frames[ID_A] += 1
+            # The message engine passes data_bin and data_list_hex after
+            # msg_id_bin: count the hex payload's bytes.
+            nbytes[ID_A] += len(rest[-1])//2 if rest else len(data)
+            for handler in table[ID_A]:
+                stats = handlers.get(handler) or stats_for(handler)
+                t0 = clock()
+                try:
+                    handler(ID_A, msg_id, data, *rest)
+                except Exception as e:
+                    stats.errors += 1
+                    stats.last_error = e
+                    raise
+                finally:
+                    ns = clock() - t0
+                    stats.calls += 1
+                    stats.total_ns += ns
+                    if ns > stats.max_ns:
+                        stats.max_ns = ns
+                    stats.histogram[bucket(ns)] += 1
+        return translate
+
+    def enable(self):
+        receiver = self.receiver
+        receiver.translateFrame = self._translator(receiver.frameHandlers)
+        receiver.translateMessage = self._translator(receiver.messageHandlers)
+        receiver.instrument = self
+        return self
+
+    def disable(self):
+        receiver = self.receiver
+        for name in ('translateFrame', 'translateMessage'):
+            receiver.__dict__.pop(name, None)
+        receiver.instrument = None
+        self.stop_dump()
+        return self
+
+    def parse_error(self, e):
+        """Frames that couldn't be parsed at all, before any handler."""
+        self.parse_errors += 1
+        self.last_parse_error = e
+
+    def reset(self):
+        self.frames[:] = [0]*CanReceive.ID_SPACE
+        self.bytes[:] = [0]*CanReceive.ID_SPACE
+        self.handlers.clear()
+        self.parse_errors = 0
+        self.last_parse_error = None
+        self.started = time.time()
+
+    def stats(self):
+        """Snapshot of every counter, JSON serializable."""
+        handlers = {}
+        for stats in sorted(self.handlers.values(), key=lambda s: -s.total_ns):
+            report = stats.report()
+            if stats.name in handlers:
+                report['name'] = stats.name
+                handlers[stats.name + '#%d'%len(handlers)] = report
+            else:
+                handlers[stats.name] = report
+        return {
+            'time': time.time(), 'seconds': time.time() - self.started,
+            'msgs_read': self.receiver.msgs_read,
+            'frames': {i: n for i, n in enumerate(self.frames) if n},
+            'bytes': {i: n for i, n in enumerate(self.bytes) if n},
+            'parse_errors': self.parse_errors,
+            'last_parse_error': None if self.last_parse_error is None else repr(self.last_parse_error),
+            'handlers': handlers,
+        }
+
+    ############################################################################
+    # Periodic dump
+
+    def start_dump(self, interval=10.0, callback=None):
+        """Calls callback(stats()) every interval seconds, printing JSON by default."""
+        self.stop_dump()
+        callback = callback or (lambda stats: print(json.dumps(stats)))
+        stop = threading.Event()
+        def dump():
+            while not stop.wait(interval):
+                callback(self.stats())
+        thread = threading.Thread(target=dump, name='instrument-dump', daemon=True)
+        self._dump = (stop, thread)
+        thread.start()
+        return self
+
+    def stop_dump(self):
+        if self._dump is not None:
+            stop, thread = self._dump
+            stop.set()
+            thread.join()
+            self._dump = None
@@ -0,0 +1,352 @@
+# Ledgers.py
+################################################################################
+#     Columnar ledgers for CanReceive.  Each ledger keeps its columns in one
+# float64 NumPy buffer that grows by doubling, and hands the columns out as
+# zero-copy views (ledger.times, ledger.values, ...).
+#
+# Rows are appended one at a time on the hot path, so they are staged in a
+# short Python list and moved into the buffer a chunk at a time.  Views
+# returned by a ledger are valid until the buffer next grows.
+
+import os
+
+import numpy as np
+
+SENSOR_COLUMNS = ('times', 'values')
+TIME_COLUMNS = ('msgs_read', 'time', 'seconds', 'micros')
+AUTOSEQUENCE_COLUMNS = ('times', 'values')
+
+class Ledger:
+    def __init__(self, columns=SENSOR_COLUMNS, chunk=1024):
+        self.columns = tuple(columns)
+        self.width = len(self.columns)
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        self._buffer = np.empty((self.width, 0))
+        self._size = 0
+        self._pending = []
+        self._chunk = chunk*self.width
+
+    # Hot path: one row, as a list or tuple in column order.
+    def append(self, row):
+        pending = self._pending
+        pending.extend(row)
+        if len(pending) >= self._chunk:
+            self.flush()
+
+    # Rows as an (n, width) array-like.
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, self.width)
+        self.extend_columns(*rows.T)
+
+    # One array-like per column, all the same length.
+    def extend_columns(self, *columns):
+        if len(columns) != self.width:
+            raise ValueError("Expected %d columns, got %d."%(self.width, len(columns)))
+        self.flush()
+        self._write(np.asarray(columns, dtype=np.float64).reshape(self.width, -1))
+
+    def flush(self):
+        if self._pending:
+            rows = np.array(self._pending, dtype=np.float64).reshape(-1, self.width)
+            self._pending = []
+            self._write(rows.T)
+
+    def _write(self, columns):
+        n = columns.shape[1]
+        size = self._size + n
+        if size > self._buffer.shape[1]:
+            self._grow(size)
+        self._buffer[:, self._size:size] = columns
+        self._size = size
+
+    def _grow(self, size):
+        capacity = max(16, 2*self._buffer.shape[1], size)
+        buffer = np.empty((self.width, capacity))
+        buffer[:, :self._size] = self._buffer[:, :self._size]
+        self._buffer = buffer
+
+    def column(self, name):
+        self.flush()
+        return self._buffer[self._index[name], :self._size]
+
+    def __getattr__(self, name):
+        index = self.__dict__.get('_index')
+        if index is None or name not in index:
+            raise AttributeError(name)
+        return self.column(name)
+
+    # Columns of the rows with start <= column[0] <= stop, as views.  The first
+    # column has to be sorted, which sensor times are.
+    def window(self, start, stop):
+        key = self.column(self.columns[0])
+        a = np.searchsorted(key, start, 'left')
+        b = np.searchsorted(key, stop, 'right')
+        return tuple(self._buffer[i, a:b] for i in range(self.width))
+
+    # (n, width) view, the shape np.array(list_of_rows) used to give.
+    def rows(self):
+        self.flush()
+        return self._buffer[:, :self._size].T
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self.rows()
+        if dtype is not None:
+            rows = rows.astype(dtype)
+        return rows.copy() if copy else rows
+
+    def __len__(self):
+        return self._size + len(self._pending)//self.width
+
+    def __getitem__(self, index):
+        return self.rows()[index]
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    # Wraps an existing (width, n) array, e.g. a memory mapped one, without
+    # copying it.  The first append moves it into a fresh buffer.
+    @staticmethod
+    def from_buffer(columns, buffer):
+        ledger = Ledger(columns)
+        if buffer.shape[0] != ledger.width:
+            raise ValueError("Expected %d columns, got %d."%(ledger.width, buffer.shape[0]))
+        ledger._buffer = buffer
+        ledger._size = buffer.shape[1]
+        return ledger
+
+    def clear(self):
+        self._buffer = np.empty((self.width, 0))
+        self._size = 0
+        self._pending = []
+
+    def nbytes(self):
+        return self._buffer.nbytes
+
+# Holds every ledger a CanReceive writes to.
+class LedgerStore:
+    def __init__(self, sensors=1028):
+        self.sensors = [Ledger(SENSOR_COLUMNS) for i in range(sensors)]
+        self.time = Ledger(TIME_COLUMNS)
+        self.autosequence = Ledger(AUTOSEQUENCE_COLUMNS)
+
+    def ledgers(self):
+        return self.sensors + [self.time, self.autosequence]
+
+    def flush(self):
+        for ledger in self.ledgers():
+            ledger.flush()
+
+    # Sink interface, see Pipeline.py.
+    def close(self):
+        self.flush()
+
+    def nbytes(self):
+        return sum(ledger.nbytes() for ledger in self.ledgers())
+
+################################################################################
+#     Bounded retention, for live sessions that would otherwise grow the
+# ledgers forever.  A RingLedger keeps only the last policy.seconds (and at
+# most policy.capacity rows) at full rate.  Rows that age out are folded into
+# tiers of min/max/mean buckets, each coarser than the last, and whatever ages
+# out of the last tier is appended to a spill file or dropped.  Memory is
+# bounded by the policy, however long the session runs.
+#
+# Reading a RingLedger gives the full-rate rows still held, like a Ledger.
+# Tiers are read through ledger.tiers[i].summary().
+
+class RetentionPolicy:
+    """
+    seconds: full-rate history to keep, None for no time limit.
+    capacity: most full-rate rows kept per ledger.
+    tiers: (bucket seconds, buckets kept) pairs, finest first.
+    spill: directory to append what leaves the last tier to, None to drop it.
+    """
+    def __init__(self, seconds=60.0, capacity=1<<16, tiers=((1.0, 3600), (60.0, 1440)), spill=None):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.tiers = tuple(tiers)
+        self.spill = spill
+
+class Window:
+    """
+    The last capacity columns of a stream.  The buffer is up to twice that,
+    so dropping the oldest columns is just moving the start, and the live
+    columns are moved back to the front once per capacity appends.
+    """
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self.buffer = np.empty((width, 0))
+        self.start = self.stop = 0
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def view(self):
+        return self.buffer[:, self.start:self.stop]
+
+    def drop(self, n):
+        dropped = self.buffer[:, self.start:self.start + n].copy()
+        self.start += n
+        return dropped
+
+    def push(self, columns):
+        """Appends columns, returning those that no longer fit, oldest first."""
+        n = columns.shape[1]
+        evicted = []
+        over = len(self) + n - self.capacity
+        if over > 0:
+            if len(self):
+                evicted.append(self.drop(min(over, len(self))))
+            if n > self.capacity:
+                evicted.append(columns[:, :n - self.capacity])
+                columns = columns[:, n - self.capacity:]
+                n = self.capacity
+        if self.stop + n > self.buffer.shape[1]:
+            live = len(self)
+            size = min(max(16, 2*self.buffer.shape[1], live + n), 2*self.capacity)
+            buffer = self.buffer if size <= self.buffer.shape[1] else np.empty((self.width, size))
+            buffer[:, :live] = self.buffer[:, self.start:self.stop]
+            self.buffer, self.start, self.stop = buffer, 0, live
+        self.buffer[:, self.stop:self.stop + n] = columns
+        self.stop += n
+        return np.concatenate(evicted, axis=1) if evicted else None
+
+    def clear(self):
+        self.buffer = np.empty((self.width, 0))
+        self.start = self.stop = 0
+
+# Tier records are columns of (bucket start, count, mins..., maxes..., sums...),
+# one min/max/sum per value column of the ledger.
+def row_records(rows, key, values):
+    records = np.empty((2 + 3*len(values), rows.shape[1]))
+    records[0] = rows[key]
+    records[1] = 1
+    m = len(values)
+    records[2:2 + m] = records[2 + m:2 + 2*m] = records[2 + 2*m:] = rows[values]
+    return records
+
+class Tier:
+    """Min/max/mean buckets of bucket seconds, the last capacity of them."""
+    def __init__(self, bucket, capacity, values):
+        self.bucket = bucket
+        self.values = values
+        self.window = Window(2 + 3*values, capacity)
+
+    def add(self, records):
+        """Folds records in, returning the buckets that no longer fit."""
+        m = self.values
+        ids = np.floor(records[0]/self.bucket)
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        merged = np.empty((self.window.width, len(starts)))
+        merged[0] = ids[starts]*self.bucket
+        merged[1] = np.add.reduceat(records[1], starts)
+        merged[2:2 + m] = np.minimum.reduceat(records[2:2 + m], starts, axis=1)
+        merged[2 + m:2 + 2*m] = np.maximum.reduceat(records[2 + m:2 + 2*m], starts, axis=1)
+        merged[2 + 2*m:] = np.add.reduceat(records[2 + 2*m:], starts, axis=1)
+
+        # The first bucket may continue the newest one held.
+        window = self.window
+        if len(window) and window.buffer[0, window.stop - 1] == merged[0, 0]:
+            last = window.buffer[:, window.stop - 1]
+            last[1] += merged[1, 0]
+            last[2:2 + m] = np.minimum(last[2:2 + m], merged[2:2 + m, 0])
+            last[2 + m:2 + 2*m] = np.maximum(last[2 + m:2 + 2*m], merged[2 + m:2 + 2*m, 0])
+            last[2 + 2*m:] += merged[2 + 2*m:, 0]
+            merged = merged[:, 1:]
+        return window.push(merged) if merged.shape[1] else None
+
+    def summary(self, index=0):
+        """(bucket starts, min, max, mean) of the index'th value column."""
+        records = self.window.view()
+        m = self.values
+        return (records[0], records[2 + index], records[2 + m + index],
+            records[2 + 2*m + index]/records[1])
+
+    def __len__(self):
+        return len(self.window)
+
+    def nbytes(self):
+        return self.window.buffer.nbytes
+
+def read_spill(path, width):
+    """Rows appended to a spill file, as an (n, width) array."""
+    return np.fromfile(path, dtype='<f8').reshape(-1, width)
+
+class RingLedger(Ledger):
+    """
+    Ledger with bounded retention, see RetentionPolicy.  key is the column
+    that ages rows out, the first one by default.  spill is this ledger's
+    spill file: tier records, or rows when there are no tiers.
+    """
+    def __init__(self, columns=SENSOR_COLUMNS, policy=None, key=None, spill=None, chunk=1024):
+        super().__init__(columns, chunk)
+        self.policy = RetentionPolicy() if policy is None else policy
+        self.key = self._index[key or self.columns[0]]
+        self._values = [i for i in range(self.width) if i != self.key]
+        self._window = Window(self.width, self.policy.capacity)
+        self.tiers = [Tier(bucket, capacity, len(self._values)) for bucket, capacity in self.policy.tiers]
+        self.spill = spill
+        self.evicted = 0
+
+    def _write(self, columns):
+        self._retire(self._window.push(columns))
+        if self.policy.seconds is not None and len(self._window):
+            key = self._window.view()[self.key]
+            n = int(np.searchsorted(key, key[-1] - self.policy.seconds, 'left'))
+            if n:
+                self._retire(self._window.drop(n))
+
+    def _retire(self, rows):
+        if rows is None:
+            return
+        self.evicted += rows.shape[1]
+        records = rows
+        if self.tiers:
+            records = row_records(rows, self.key, self._values)
+            for tier in self.tiers:
+                records = tier.add(records)
+                if records is None:
+                    return
+        if self.spill is not None:
+            with open(self.spill, 'ab') as file:
+                file.write(np.ascontiguousarray(records.T, dtype='<f8').tobytes())
+
+    def column(self, name):
+        self.flush()
+        return self._window.view()[self._index[name]]
+
+    def window(self, start, stop):
+        key = self.column(self.columns[0])
+        a = np.searchsorted(key, start, 'left')
+        b = np.searchsorted(key, stop, 'right')
+        return tuple(self._window.view()[i, a:b] for i in range(self.width))
+
+    def rows(self):
+        self.flush()
+        return self._window.view().T
+
+    def __len__(self):
+        return len(self._window) + len(self._pending)//self.width
+
+    def clear(self):
+        self._window.clear()
+        self._pending = []
+        for tier in self.tiers:
+            tier.window.clear()
+
+    def nbytes(self):
+        return self._window.buffer.nbytes + sum(tier.nbytes() for tier in self.tiers)
+
+# LedgerStore with every ledger bounded by one RetentionPolicy.
+class RetentionStore(LedgerStore):
+    def __init__(self, policy=None, sensors=1028):
+        self.policy = RetentionPolicy() if policy is None else policy
+        spill = self.policy.spill
+        if spill is not None:
+            os.makedirs(spill, exist_ok=True)
+        def path(name):
+            return None if spill is None else os.path.join(spill, name + '.f8')
+        self.sensors = [RingLedger(SENSOR_COLUMNS, self.policy, spill=path('sensor_%d'%i)) for i in range(sensors)]
+        self.time = RingLedger(TIME_COLUMNS, self.policy, key='time', spill=path('time'))
+        self.autosequence = RingLedger(AUTOSEQUENCE_COLUMNS, self.policy, spill=path('autosequence'))
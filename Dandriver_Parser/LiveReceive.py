@@ -0,0 +1,228 @@
+# LiveReceive.py
+################################################################################
+#     Live ingest for CanReceive with receiving and decoding decoupled.  A
+# receive thread does nothing but drain the bus into a bounded ring, so the
+# socket buffer never backs up while decoding catches up with a burst.  A
+# decode thread takes frames off the ring a batch at a time: the packed sensor
+# frames of a batch are decoded together by BatchDecode, and the rest are
+# dispatched one by one in order, each seeing the sensor time of the entries
+# before it, so state comes out as translating every frame would leave it.
+#
+# When the ring is full new frames are dropped and counted, so the frames that
+# are decoded are always a gap-free prefix plus whatever fits after a gap.
+#
+#   live = LiveReceive.LiveReceive(receiver).start()
+#   ...
+#   live.stop()
+#   live.counters()
+
+import threading
+import time
+
+import can
+import numpy as np
+
+import CanReceive
+
+class FrameRing:
+    """Bounded, thread safe FIFO of (arbitration_id, data, timestamp) frames."""
+    def __init__(self, capacity=1<<16):
+        self.capacity = capacity
+        self._buffer = [None]*capacity
+        self._head = 0      # frames taken
+        self._tail = 0      # frames put
+        self._ready = threading.Condition(threading.Lock())
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    def put(self, frame):
+        with self._ready:
+            queued = self._tail - self._head
+            if queued == self.capacity:
+                self.dropped += 1
+                return False
+            self._buffer[self._tail % self.capacity] = frame
+            self._tail += 1
+            if queued + 1 > self.high_water:
+                self.high_water = queued + 1
+            if queued == 0:
+                self._ready.notify()
+            return True
+
+    def take(self, n, timeout=None):
+        """Up to n frames, waiting up to timeout for the first one."""
+        with self._ready:
+            if self._tail == self._head:
+                self._ready.wait(timeout)
+            count = min(n, self._tail - self._head)
+            start = self._head % self.capacity
+            stop = start + count
+            if stop <= self.capacity:
+                frames = self._buffer[start:stop]
+            else:
+                frames = self._buffer[start:] + self._buffer[:stop - self.capacity]
+            self._head += count
+            return frames
+
+    def wake(self):
+        with self._ready:
+            self._ready.notify_all()
+
+class LiveReceive:
+    """
+    receiver: the CanReceive to decode into.
+    bus: an open python-can bus, or None to open one from receiver.busargs
+         (closed again by stop()).
+    track_latency: keep, in latencies, each frame's time from its message
+         timestamp to decoded.  python-can timestamps are time.time() based.
+    """
+    def __init__(self, receiver, bus=None, capacity=1<<16, batch=1024, poll=0.1, track_latency=False):
+        self.receiver = receiver
+        self.bus = bus
+        self._own_bus = bus is None
+        self.ring = FrameRing(capacity)
+        self.batch = batch
+        self.poll = poll
+
+        self.received = 0
+        self.decoded = 0
+        self.errors = 0
+        self.last_error = None
+        self.receive_error = None
+        self.latencies = [] if track_latency else None
+
+        self._stopping = threading.Event()
+        self._receive_thread = None
+        self._decode_thread = None
+
+    def start(self):
+        if self.bus is None:
+            self.bus = can.interface.Bus(**self.receiver.busargs)
+        self._stopping.clear()
+        self.receive_error = None
+        self._receive_thread = threading.Thread(target=self._receive, name='can-receive', daemon=True)
+        self._decode_thread = threading.Thread(target=self._decode, name='can-decode', daemon=True)
+        self._decode_thread.start()
+        self._receive_thread.start()
+        return self
+
+    def _receive(self):
+        recv, put = self.bus.recv, self.ring.put
+        while not self._stopping.is_set():
+            try:
+                msg = recv(timeout=self.poll)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = self.receive_error = e
+                self._stopping.set()
+                return
+            if msg is None:
+                continue
+            self.received += 1
+            put((msg.arbitration_id, bytes(msg.data), msg.timestamp))
+
+    def _decode(self):
+        # CanReceive imports this module, and BatchDecode needs it loaded.
+        import BatchDecode
+        take = self.ring.take
+        latencies = self.latencies
+        clock = time.time
+        while True:
+            frames = take(self.batch, self.poll)
+            if not frames:
+                # Drained, and the receive thread won't add any more.
+                if self._stopping.is_set() and not self._receive_thread.is_alive() and not len(self.ring):
+                    return
+                continue
+            self._decode_batch(BatchDecode, frames)
+            if latencies is not None:
+                now = clock()
+                latencies.extend(now - timestamp for msg_id, data, timestamp in frames)
+            self.decoded += len(frames)
+            if self.receiver.shared is not None:
+                self.receiver.shared.publish()
+
+    def _decode_batch(self, BatchDecode, frames):
+        receiver = self.receiver
+        handlers = receiver.frameHandlers
+        sensor_fn = receiver.ID_Between_050_427_frame
+        n = len(frames)
+        ids = np.fromiter((frame[0] for frame in frames), np.int64, n)
+        lengths = np.fromiter((len(frame[1]) for frame in frames), np.int64, n)
+        ID_A = ids & CanReceive.ID_MASK
+
+        # Which frames the batch decoder takes, by the handlers registered now.
+        unique, inverse = np.unique(ID_A, return_inverse=True)
+        unique = unique.tolist()
+        batched = np.array([sensor_fn in handlers[i] for i in unique], dtype=bool)[inverse]
+        event = np.array([any(h != sensor_fn for h in handlers[i]) for i in unique], dtype=bool)[inverse]
+
+        rows = np.flatnonzero(batched)
+        payloads = np.frombuffer(b''.join(frames[i][1][:8].ljust(8, b'\0') for i in rows.tolist()),
+            dtype=np.uint8).reshape(-1, 8)
+        frame, sensor_id, raw_timestamp, value = BatchDecode.sensor_entries(ids[rows], payloads, lengths[rows])
+        frame = rows[frame]
+        sensor_timestamp, sensor_rollover = receiver.sensorTimestamp, receiver.sensorRollover
+        t, rollover = BatchDecode.unwrap_columns(raw_timestamp, receiver)
+        end_timestamp, end_rollover = receiver.sensorTimestamp, receiver.sensorRollover
+
+        events = np.flatnonzero(event)
+        before = np.searchsorted(frame, events, 'left').tolist()
+        msgs_read = receiver.msgs_read
+        for f, entries in zip(events.tolist(), before):
+            if entries:
+                receiver.sensorTimestamp = float(t[entries - 1])
+                receiver.sensorRollover = float(rollover[entries - 1])
+            else:
+                receiver.sensorTimestamp, receiver.sensorRollover = sensor_timestamp, sensor_rollover
+            receiver.msgs_read = msgs_read + f + 1
+            msg_id, data, timestamp = frames[f]
+            frame_id = msg_id & CanReceive.ID_MASK
+            for handler in handlers[frame_id]:
+                if handler != sensor_fn:
+                    try:
+                        handler(frame_id, msg_id, data)
+                    except Exception as e:
+                        self.errors += 1
+                        self.last_error = e
+
+        BatchDecode.apply_sensor_batch(receiver, sensor_id, (t + rollover)/8000, value)
+        receiver.sensorTimestamp, receiver.sensorRollover = end_timestamp, end_rollover
+        receiver.msgs_read = msgs_read + n
+
+    def stop(self, timeout=None):
+        """
+        Stops receiving, decodes what is already queued, and closes an owned
+        bus.  Raises the error that stopped receiving early, if one did.
+        """
+        self._stopping.set()
+        if self._receive_thread is not None:
+            self._receive_thread.join(timeout)
+        self.ring.wake()
+        if self._decode_thread is not None:
+            self._decode_thread.join(timeout)
+        if self._own_bus and self.bus is not None:
+            self.bus.shutdown()
+            self.bus = None
+        if self.receive_error is not None:
+            error, self.receive_error = self.receive_error, None
+            raise error
+
+    def running(self):
+        return self._receive_thread is not None and self._receive_thread.is_alive()
+
+    def wait_idle(self, timeout=None):
+        """Waits until every frame received so far is decoded.  For tests."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.decoded + self.ring.dropped < self.received:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def counters(self):
+        return {'received': self.received, 'decoded': self.decoded, 'dropped': self.ring.dropped,
+            'queued': len(self.ring), 'high_water': self.ring.high_water, 'errors': self.errors}
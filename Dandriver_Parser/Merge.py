@@ -0,0 +1,130 @@
+# Merge.py
+################################################################################
+#     Merges per-sensor ledgers into one time-aligned wide table: a time column
+# and one column per sensor.  Three ways to line the sensors up:
+#
+#   union      every timestamp of every sensor, each sensor forward filled
+#              with its last value at or before that time.
+#   asof       the timestamps of one reference sensor, every other sensor's
+#              last value at or before each of them (optionally within a
+#              tolerance).
+#   resample   a fixed-rate time grid, each sensor linearly interpolated.
+#
+# Every mode is a generator of (times, table) chunks, table being (n, sensors),
+# so a long run is merged and written a chunk at a time.  Before a sensor's
+# first sample, and outside its range when resampling, its column is NaN.
+
+import csv
+
+import numpy as np
+
+import SensorDefs, Calibration
+
+def sensor_columns(ledgers, sensors, calibrated=False):
+    columns = []
+    for sensor in sensors:
+        ledger = ledgers[sensor]
+        values = ledger.values
+        if calibrated:
+            values = Calibration.calibrate_sensor(sensor, values)
+        columns.append((ledger.times, values))
+    return columns
+
+# Last value at or before each of times, NaN before the first sample.
+def last_at_or_before(sensor_times, sensor_values, times, tolerance=None):
+    if not len(sensor_times):
+        return np.full(len(times), np.nan)
+    i = np.searchsorted(sensor_times, times, 'right') - 1
+    found = i >= 0
+    if tolerance is not None:
+        found &= times - sensor_times[np.maximum(i, 0)] <= tolerance
+    return np.where(found, sensor_values[np.maximum(i, 0)], np.nan)
+
+# np.interp needs strictly increasing times: of samples sharing a time, the
+# last one, as the other modes take it.
+def last_per_time(times, values):
+    keep = np.append(times[1:] != times[:-1], True) if len(times) else np.empty(0, dtype=bool)
+    return times[keep], values[keep]
+
+def union(ledgers, sensors, chunk=1<<16, calibrated=False):
+    """
+    Every timestamp of every sensor, each sensor forward filled.
+
+    A k-way merge done a block at a time: each step takes, from every sensor,
+    the samples up to the earliest time any sensor reaches in its next chunk
+    samples, so no sample after the block can belong in it.
+    """
+    columns = sensor_columns(ledgers, sensors, calibrated)
+    cursors = [0]*len(columns)
+    last = np.full(len(columns), np.nan)
+    while True:
+        ends = [times[min(cursor + chunk, len(times)) - 1]
+            for (times, values), cursor in zip(columns, cursors) if cursor < len(times)]
+        if not ends:
+            return
+        bound = min(ends)
+
+        stops = [int(np.searchsorted(times, bound, 'right')) for times, values in columns]
+        times = np.unique(np.concatenate([t[a:b] for (t, v), a, b in zip(columns, cursors, stops)]))
+        table = np.empty((len(times), len(columns)))
+        for k, ((t, v), a, b) in enumerate(zip(columns, cursors, stops)):
+            i = np.searchsorted(t[a:b], times, 'right') - 1
+            table[:, k] = np.where(i >= 0, v[a:b][np.maximum(i, 0)], last[k]) if b > a else last[k]
+            if b > a:
+                last[k] = v[b - 1]
+        cursors = stops
+        yield times, table
+
+def asof(ledgers, reference, sensors, tolerance=None, chunk=1<<16, calibrated=False):
+    """
+    Rows at the reference sensor's timestamps.  The reference sensor is the
+    first column, followed by the last value of each of sensors at or before
+    each row (NaN if older than tolerance seconds).
+    """
+    ref_times, ref_values = sensor_columns(ledgers, [reference], calibrated)[0]
+    columns = sensor_columns(ledgers, sensors, calibrated)
+    for start in range(0, len(ref_times), chunk):
+        times = ref_times[start:start + chunk]
+        table = np.empty((len(times), 1 + len(columns)))
+        table[:, 0] = ref_values[start:start + chunk]
+        for k, (t, v) in enumerate(columns, 1):
+            # Only the stretch of the sensor that can match this chunk.
+            a = max(0, int(np.searchsorted(t, times[0], 'right')) - 1)
+            b = int(np.searchsorted(t, times[-1], 'right'))
+            table[:, k] = last_at_or_before(t[a:b], v[a:b], times, tolerance)
+        yield times, table
+
+def resample(ledgers, sensors, rate, start=None, stop=None, chunk=1<<16, calibrated=False):
+    """
+    A grid of rate samples per second from start to stop (default: the span
+    of all the sensors), each sensor linearly interpolated onto it.
+    """
+    columns = [last_per_time(t, v) for t, v in sensor_columns(ledgers, sensors, calibrated)]
+    spans = [(t[0], t[-1]) for t, v in columns if len(t)]
+    if not spans:
+        return
+    start = min(s[0] for s in spans) if start is None else start
+    stop = max(s[1] for s in spans) if stop is None else stop
+    samples = int(np.floor((stop - start)*rate)) + 1
+    for first in range(0, samples, chunk):
+        times = start + np.arange(first, min(first + chunk, samples))/rate
+        table = np.full((len(times), len(columns)), np.nan)
+        for k, (t, v) in enumerate(columns):
+            if not len(t):
+                continue
+            # The samples either side of this chunk are enough to interpolate it.
+            a = max(0, int(np.searchsorted(t, times[0], 'right')) - 1)
+            b = int(np.searchsorted(t, times[-1], 'left')) + 1
+            table[:, k] = np.interp(times, t[a:b], v[a:b], left=np.nan, right=np.nan)
+        yield times, table
+
+def column_names(sensors):
+    return [SensorDefs.sensor_name_from_id.get(sensor, str(sensor)) for sensor in sensors]
+
+def write_csv(path, chunks, names):
+    """Writes (times, table) chunks from any of the modes as one CSV."""
+    with open(path, 'w', newline='', buffering=1<<20) as file:
+        writer = csv.writer(file)
+        writer.writerow(['Time'] + list(names))
+        for times, table in chunks:
+            writer.writerows(np.column_stack((times, table)).tolist())
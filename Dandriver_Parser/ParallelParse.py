@@ -0,0 +1,132 @@
+# ParallelParse.py
+################################################################################
+#     Shard-parallel offline parsing.  The dump is split into byte ranges,
+# each worker decodes its whole range into columnar arrays, and the parent
+# stitches the shards back together in order:
+#
+#   - Sensor timestamps are unwrapped per shard as if no rollover had happened
+#     before it.  A prefix scan over the shards then adds the rollovers of
+#     every earlier shard, plus one at a boundary that wraps.
+#   - Everything that isn't a packed sensor entry (clock, valves, node states,
+#     controllers) comes back as a short list of frames.  The parent replays
+#     those in frame order through the receiver's handlers, each seeing the
+#     sensor time of the entries before it (searchsorted, for the autosequence
+#     ledger), then appends the shard's sensor entries in one go, so ledgers
+#     and last-known states come out as a serial parse leaves them.
+
+import multiprocessing
+import os
+
+import numpy as np
+
+import CanReceive, BatchDecode
+import blt_parser_rd2_hrc as parser
+
+FORMATS = {'Candump': parser.Candump, 'Coolterm': parser.Coolterm}
+
+def split_shards(path, shards):
+    """Even byte ranges over a file.  The readers align them to records."""
+    size = os.path.getsize(path)
+    cuts = [size*i//shards for i in range(shards + 1)]
+    return [(start, stop) for start, stop in zip(cuts, cuts[1:]) if start < stop]
+
+# Which IDs go to the batch sensor decoder, and which have other handlers.
+def handler_masks(receiver):
+    sensor_fn = receiver.ID_Between_050_427_frame
+    sensor = np.array([sensor_fn in handlers for handlers in receiver.frameHandlers])
+    event = np.array([any(h != sensor_fn for h in handlers) for handlers in receiver.frameHandlers])
+    return sensor, event
+
+def decode_shard(args):
+    """Worker: decodes one byte range of a dump into columnar arrays."""
+    path, fmt_name, start, stop, sensor_lookup, event_lookup = args
+    fmt = FORMATS[fmt_name]
+
+    blocks = list(fmt.generate_frame_blocks(path, start=start, stop=stop))
+    if blocks:
+        ids = np.concatenate([b[0] for b in blocks])
+        dlc = np.concatenate([b[1] for b in blocks])
+        payloads = np.concatenate([b[2] for b in blocks])
+    else:
+        ids, dlc, payloads = np.empty(0, np.uint32), np.empty(0, np.uint8), np.empty((0, 8), np.uint8)
+    ID_A = ids & CanReceive.ID_MASK
+
+    sensor_rows = np.flatnonzero(sensor_lookup[ID_A])
+    frame, sensor_id, raw_timestamp, value = BatchDecode.sensor_entries(
+        ids[sensor_rows], payloads[sensor_rows], dlc[sensor_rows])
+    frame = sensor_rows[frame]
+
+    # Local unwrap: rollovers counted from the start of this shard only.
+    t = raw_timestamp * 10 / 2**18
+    rollovers = np.zeros(len(t), dtype=np.int64)
+    rollovers[1:] = np.cumsum(t[1:] < t[:-1])
+
+    event_rows = np.flatnonzero(event_lookup[ID_A])
+    return {
+        'frames': len(ids),
+        'frame': frame, 'sensor_id': sensor_id, 't': t, 'rollovers': rollovers, 'value': value,
+        'event_frame': event_rows, 'event_id': ids[event_rows],
+        'event_dlc': dlc[event_rows], 'event_payload': payloads[event_rows],
+    }
+
+def parse_parallel(path, fmt, receiver=None, processes=None, shards=None):
+    """
+    Parses a Candump or Coolterm file on every core into a CanReceive.
+
+    fmt is the reader class (parser.Candump or parser.Coolterm).
+    Gives the same ledgers and state as translating every frame in order.
+    """
+    if receiver is None:
+        receiver = CanReceive.CanReceive('virtual', 'virtual')
+    processes = processes or multiprocessing.cpu_count()
+    shards = shards or 4*processes
+
+    sensor_lookup, event_lookup = handler_masks(receiver)
+    sensor_fn = receiver.ID_Between_050_427_frame
+    args = [(path, fmt.__name__, start, stop, sensor_lookup, event_lookup)
+        for start, stop in split_shards(path, shards)]
+
+    with multiprocessing.Pool(processes) as pool:
+        for shard in pool.imap(decode_shard, args):
+            stitch_shard(receiver, shard, sensor_fn)
+    return receiver
+
+def stitch_shard(receiver, shard, sensor_fn):
+    """Applies one decoded shard to the receiver, continuing its state."""
+    t = shard['t']
+    sensor_timestamp, sensor_rollover = receiver.sensorTimestamp, receiver.sensorRollover
+    if len(t):
+        # Prefix scan: this shard's rollovers start where the last one ended.
+        wrapped = int(t[0] < sensor_timestamp)
+        rollover = sensor_rollover + 10.0*(wrapped + shard['rollovers'])
+        times = (t + rollover)/8000
+    else:
+        times = rollover = t
+
+    # The sensor time each event frame sees: that of the last entry before
+    # it, for handlers reading latest_sensor_time (the autosequence ledger).
+    event_frame = shard['event_frame']
+    before = np.searchsorted(shard['frame'], event_frame, 'left')
+    event_timestamp = np.where(before > 0, t[before - 1] if len(t) else 0.0, sensor_timestamp).tolist()
+    event_rollover = np.where(before > 0, rollover[before - 1] if len(t) else 0.0, sensor_rollover).tolist()
+
+    frames_before = receiver.msgs_read
+    for f, msg_id, dlc, payload, timestamp, wraps in zip(event_frame.tolist(), shard['event_id'].tolist(),
+            shard['event_dlc'].tolist(), shard['event_payload'], event_timestamp, event_rollover):
+        receiver.sensorTimestamp = timestamp
+        receiver.sensorRollover = wraps
+        ID_A = msg_id & CanReceive.ID_MASK
+        data = payload[:dlc].tobytes()
+        receiver.msgs_read = frames_before + f + 1
+        for handler in receiver.frameHandlers[ID_A]:
+            if handler != sensor_fn:
+                handler(ID_A, msg_id, data)
+
+    # Every sensor entry of the shard at once, one extend per sensor.
+    BatchDecode.apply_sensor_batch(receiver, shard['sensor_id'], times, shard['value'])
+    if len(t):
+        receiver.sensorTimestamp = float(t[-1])
+        receiver.sensorRollover = float(rollover[-1])
+    else:
+        receiver.sensorTimestamp, receiver.sensorRollover = sensor_timestamp, sensor_rollover
+    receiver.msgs_read = frames_before + shard['frames']
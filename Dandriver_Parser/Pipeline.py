@@ -0,0 +1,173 @@
+# Pipeline.py
+################################################################################
+#     Single pass streaming parse:  read -> frame decode -> translate -> sink.
+# Every stage is a generator, so nothing holds more than the frame in flight.
+# Progress comes from the bytes the reader has consumed, not a line count.
+#
+# A sink is whatever CanReceive writes its ledgers to: the in-memory
+# Ledgers.LedgerStore, a CsvSink that streams samples to disk, or a
+# SummarySink that only keeps running statistics.  A sink has .sensors (one
+# row sink per sensor ID), .time, .autosequence and close().
+
+import csv
+import io
+import os
+
+import CanReceive, Ledgers
+
+################################################################################
+################################### Stages #####################################
+################################################################################
+
+class Progress:
+    """Prints every step percent of total bytes consumed."""
+    def __init__(self, total, step=5):
+        self.total = total
+        self.step = step
+        self.pct = 0
+
+    def __call__(self, pos):
+        pct = int(100*pos/self.total)
+        while pct >= self.pct + self.step:
+            self.pct += self.step
+            print("%i%%"%self.pct)
+
+# The readers want bytes.  Text streams are read through their buffer.  Plain
+# files on disk are read through their path, so they can be memory mapped;
+# zip members and compressed streams are read as they decompress.
+def binary_source(source):
+    if isinstance(source, (str, bytes, os.PathLike)):
+        return source
+    if isinstance(source, io.TextIOBase):
+        if isinstance(source, io.StringIO):
+            return io.BytesIO(source.getvalue().encode())
+        if not hasattr(source, 'buffer'):
+            raise TypeError("Can't read %r as bytes."%source)
+        source = source.buffer
+    if isinstance(source, io.BufferedReader) and isinstance(source.raw, io.FileIO) \
+            and isinstance(source.name, str) and source.tell() == 0:
+        return source.name
+    return source
+
+# Size in bytes as the readers will see them.  Unknown (None) for compressed
+# streams, where the file size isn't the decompressed size.
+def source_size(source):
+    if isinstance(source, (str, bytes, os.PathLike)):
+        return os.path.getsize(source)
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer().nbytes
+    if isinstance(source, io.BufferedReader) and isinstance(source.raw, io.FileIO):
+        return os.fstat(source.fileno()).st_size
+    return None
+
+def read_frames(source, fmt, progress=None):
+    return fmt.generate_frames(source, progress=progress)
+
+def decode_frames(frames):
+    ID_MASK = CanReceive.ID_MASK
+    for arbitration_id, dlc, payload in frames:
+        yield arbitration_id & ID_MASK, arbitration_id, payload
+
+def translate_frames(receiver, decoded):
+    translate = receiver.translateFrame
+    for ID_A, msg_id, data in decoded:
+        translate(ID_A, msg_id, data)
+    return receiver
+
+def parse_stream(source, fmt, sink=None, receiver=None, progress=True):
+    """
+    Parses a dump in one pass with bounded memory.
+
+    source: path, or an opened file.
+    fmt: the reader class, blt_parser_rd2_hrc.Candump or .Coolterm.
+    sink: where ledgers go when no receiver is given.  Defaults to an
+          in-memory Ledgers.LedgerStore.
+    """
+    if receiver is None:
+        receiver = CanReceive.CanReceive('virtual', 'virtual', ledgers=sink)
+    source = binary_source(source)
+    size = source_size(source)
+    report = Progress(size) if progress and size else None
+
+    translate_frames(receiver, decode_frames(read_frames(source, fmt, report)))
+    receiver.ledgers.close()
+    return receiver
+
+################################################################################
+#################################### Sinks #####################################
+################################################################################
+
+class CsvRows:
+    def __init__(self, writer):
+        self.append = writer.writerow
+
+class CsvSensorRows:
+    def __init__(self, writer, sensor):
+        self.writerow = writer.writerow
+        self.sensor = sensor
+
+    def append(self, row):
+        self.writerow((row[0], self.sensor, row[1]))
+
+class CsvSink:
+    """
+    Streams ledger rows to prefix_sensors.csv, prefix_time.csv and
+    prefix_autosequence.csv through buffered writers.
+    """
+    def __init__(self, prefix, sensors=1028, buffering=1<<20):
+        self.files = []
+        def writer(suffix, header):
+            file = open(prefix + suffix, 'w', newline='', buffering=buffering)
+            self.files.append(file)
+            w = csv.writer(file)
+            w.writerow(header)
+            return w
+
+        sensor_writer = writer('_sensors.csv', ('Time', 'Sensor', 'Value'))
+        self.sensors = [CsvSensorRows(sensor_writer, i) for i in range(sensors)]
+        self.time = CsvRows(writer('_time.csv', Ledgers.TIME_COLUMNS))
+        self.autosequence = CsvRows(writer('_autosequence.csv', ('Time', 'Autosequence')))
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+class Summary:
+    """Running count/min/max/mean of the last column, and the first column's range."""
+    __slots__ = ('count', 'min', 'max', 'total', 'first', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.min, self.max, self.total = float('inf'), float('-inf'), 0.0
+        self.first = self.last = None
+
+    def append(self, row):
+        value = row[-1]
+        if self.count == 0:
+            self.first = row[0]
+        self.count += 1
+        self.last = row[0]
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def report(self):
+        return {'count': self.count, 'min': self.min, 'max': self.max,
+            'mean': self.total/self.count if self.count else None,
+            'first': self.first, 'last': self.last}
+
+class SummarySink:
+    """Keeps only per-sensor running statistics."""
+    def __init__(self, sensors=1028):
+        self.sensors = [Summary() for i in range(sensors)]
+        self.time = Summary()
+        self.autosequence = Summary()
+
+    def report(self):
+        return {'sensors': {i: s.report() for i, s in enumerate(self.sensors) if s.count},
+            'time': self.time.report(), 'autosequence': self.autosequence.report()}
+
+    def close(self):
+        pass
@@ -0,0 +1,170 @@
+# Replay.py
+################################################################################
+#     Replays a recorded candump or Coolterm dump onto a python-can bus
+# (virtual, or socketcan on a vcan interface), for load testing the live
+# decoder without the stand.
+#
+# Frames are paced by the time they were recorded at, reconstructed from the
+# sensor timestamps the way CanReceive does (the dumps carry no capture
+# times), sped up by speed, or sent as fast as possible with speed=None.
+# Bursts send a number of frames back to back, unpaced, at given replay
+# times.
+#
+# replay() runs a LiveReceive on the same channel while sending, and reports
+# frames sent, received, decoded, dropped (lost on the bus or the ring) and
+# late (decoded more than deadline seconds after sending), with decode
+# latency percentiles.
+#
+#   python Replay.py dump.txt --speed 10 --burst 5:20000
+
+import argparse
+import json
+import time
+
+import numpy as np
+import can
+
+import CanReceive
+import blt_parser_rd2_hrc as parser
+
+FORMATS = {'candump': parser.Candump, 'coolterm': parser.Coolterm}
+
+def frame_times(frames, receiver=None):
+    """
+    Recorded time of each (arbitration_id, dlc, payload) frame, in seconds
+    from the first: the sensor time reached so far, rollovers included.
+    """
+    receiver = CanReceive.CanReceive('virtual', 'virtual') if receiver is None else receiver
+    sensor_fn = receiver.ID_Between_050_427_frame
+    is_sensor = [sensor_fn in handlers for handlers in receiver.frameHandlers]
+    times = np.empty(len(frames))
+    timestamp = rollover = 0.0
+    for i, (arbitration_id, dlc, payload) in enumerate(frames):
+        if is_sensor[arbitration_id & CanReceive.ID_MASK] and len(payload) >= 2:
+            t = (arbitration_id >> 11)*10/2**18
+            if t < timestamp:
+                rollover += 10.0
+            timestamp = t
+        times[i] = (timestamp + rollover)/8000
+    return times - times[0] if len(times) else times
+
+class Replayer:
+    """
+    speed: 1.0 for recorded pacing, 10.0 for ten times that, None for as
+           fast as the bus takes them.
+    bursts: (replay seconds, frames) pairs.  From that time on, that many
+           frames are sent unpaced, and pacing resumes after them.
+    clock, sleep: the time source paced by, time.perf_counter and time.sleep
+           unless testing.
+    """
+    def __init__(self, frames, times, speed=1.0, bursts=(), clock=time.perf_counter, sleep=time.sleep):
+        self.frames = frames
+        self.times = times
+        self.speed = speed
+        self.bursts = sorted(bursts)
+        self.clock = clock
+        self.sleep = sleep
+        self.sent = 0
+        self.send_errors = 0
+        self.max_lag = 0.0
+
+    @staticmethod
+    def from_file(path, fmt=parser.Candump, speed=1.0, bursts=()):
+        frames = list(fmt.generate_frames(path))
+        return Replayer(frames, frame_times(frames), speed, bursts)
+
+    def send(self, bus):
+        """Sends every frame onto bus, paced.  Returns the seconds taken."""
+        bursts = list(self.bursts)
+        burst_left = 0
+        # Time skipped by bursts, so the frames after them aren't rushed.
+        shift = 0.0
+        clock = self.clock
+        start = clock()
+        for (arbitration_id, dlc, payload), t in zip(self.frames, self.times.tolist()):
+            now = clock() - start
+            if bursts and now >= bursts[0][0]:
+                burst_left += bursts.pop(0)[1]
+                shift = None
+            if burst_left:
+                burst_left -= 1
+            elif self.speed is not None:
+                if shift is None:
+                    # Pick up the recorded pacing from here.
+                    shift = now - t/self.speed
+                target = t/self.speed + shift
+                if target > now:
+                    self.sleep(target - now)
+                else:
+                    self.max_lag = max(self.max_lag, now - target)
+            msg = can.Message(arbitration_id=arbitration_id, data=payload,
+                is_extended_id=arbitration_id > 0x7FF)
+            try:
+                bus.send(msg)
+                self.sent += 1
+            except can.CanError:
+                self.send_errors += 1
+        return clock() - start
+
+def percentiles(values, points=(50, 90, 99, 99.9)):
+    if not len(values):
+        return {}
+    values = np.asarray(values)
+    report = {'p%g'%p: float(np.percentile(values, p)) for p in points}
+    report['max'] = float(values.max())
+    report['mean'] = float(values.mean())
+    return report
+
+def replay(path, fmt=parser.Candump, speed=1.0, bursts=(), channel='replay', interface='virtual',
+        receiver=None, deadline=0.1, settle=5.0, **live_args):
+    """
+    Replays path onto channel with a LiveReceive decoding it, and reports
+    throughput, losses and latency.  live_args go to LiveReceive.
+    """
+    replayer = Replayer.from_file(path, fmt, speed, bursts)
+    receiver = CanReceive.CanReceive(channel, interface) if receiver is None else receiver
+    live = receiver.start_live(track_latency=True, **live_args)
+    sender = can.interface.Bus(channel=channel, interface=interface)
+    try:
+        seconds = replayer.send(sender)
+        # Give the decoder a moment to finish what made it through.
+        deadline_at = time.perf_counter() + settle
+        while live.decoded + live.ring.dropped < replayer.sent and time.perf_counter() < deadline_at:
+            time.sleep(0.01)
+    finally:
+        receiver.stop()
+        sender.shutdown()
+
+    counters = live.counters()
+    latencies = np.asarray(live.latencies)
+    return {
+        'frames': len(replayer.frames), 'sent': replayer.sent, 'send_errors': replayer.send_errors,
+        'seconds': seconds, 'recorded_seconds': float(replayer.times[-1]) if len(replayer.times) else 0.0,
+        'frames_per_sec': replayer.sent/seconds if seconds else None,
+        'max_send_lag': replayer.max_lag,
+        'received': counters['received'], 'decoded': counters['decoded'],
+        'dropped': replayer.sent - counters['received'] + counters['dropped'],
+        'late': int((latencies > deadline).sum()), 'deadline': deadline,
+        'high_water': counters['high_water'], 'errors': counters['errors'],
+        'latency': percentiles(latencies),
+    }
+
+def main(argv=None):
+    args = argparse.ArgumentParser(description="Replays a dump onto a CAN bus and reports decode latency.")
+    args.add_argument('path')
+    args.add_argument('--format', choices=sorted(FORMATS), default='candump')
+    args.add_argument('--speed', type=float, default=1.0, help="pacing multiplier, 0 for max speed")
+    args.add_argument('--burst', action='append', default=[], help="seconds:frames, repeatable")
+    args.add_argument('--channel', default='replay')
+    args.add_argument('--interface', default='virtual')
+    args.add_argument('--deadline', type=float, default=0.1)
+    args = args.parse_args(argv)
+
+    bursts = [(float(at), int(n)) for at, n in (burst.split(':') for burst in args.burst)]
+    report = replay(args.path, FORMATS[args.format], args.speed or None, bursts,
+        args.channel, args.interface, deadline=args.deadline)
+    print(json.dumps(report, indent=1))
+    return report
+
+if __name__ == "__main__":
+    main()
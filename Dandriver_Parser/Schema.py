@@ -0,0 +1,207 @@
+# Schema.py
+################################################################################
+#     Declarative message families, compiled into decode handlers at load.
+#
+# A Family describes one kind of frame: the IDs it arrives on, the receiver
+# array it lands in, fields packed into the arbitration ID, and payload
+# layouts (struct codes, endianness, scale) by payload length.
+# compile_family() generates the source of a frame handler specialized to it,
+# with one precompiled struct.Struct per layout, shifts and masks for the ID
+# fields and constant indices wherever they don't depend on the ID, and exec's
+# it once.
+#
+# install() puts the compiled handlers on CanReceive under their family names
+# (ID_546_frame, and ID_546 for the message engine, which converts the bit
+# strings and calls the frame handler), so a new board is a FAMILIES entry:
+#
+#   Family('ID_560', ids=(560,), target='ValvesNewBoard', event='valves',
+#       id_fields=(IdField(12, 8, 0),), index=1,
+#       layouts=(Layout((Field('H'), Field('h', scale=0.1)), lengths=(4,)),))
+#
+# The receiver has to have the target array, and AsyncReceive publishes the
+# family's event kind ('valves' or 'controller') for it.
+
+import collections
+import struct
+
+################################################################################
+################################# Declarations #################################
+################################################################################
+
+# target[index] = table[(msg_id >> shift) & (2**bits - 1)], or the field
+# itself without a table.
+IdField = collections.namedtuple('IdField', ('shift', 'bits', 'index', 'table'), defaults=(None,))
+
+# One payload field: a struct code ('B', 'h', 'I', 'f', ...), stored at
+# target[base + index], times scale.  index defaults to the field's position.
+Field = collections.namedtuple('Field', ('code', 'index', 'scale'), defaults=(None, None))
+
+# Consecutive fields, for payloads of the given lengths (None: any other).
+# pad zero pads short payloads on the left, as int.from_bytes reads them, and
+# drops what is past the fields; otherwise the payload must be exactly the
+# fields' size.
+Layout = collections.namedtuple('Layout', ('fields', 'endian', 'lengths', 'pad'), defaults=('>', None, False))
+
+# Payload bytes copied as they are into target[index:], at most size of them.
+Raw = collections.namedtuple('Raw', ('index', 'size', 'lengths'), defaults=(None,))
+
+# target: receiver attribute decoded into.  row: for 2-D targets, a function
+#         of the ID picking the row.
+# index: base index of the payload fields, an int or a function of the ID.
+# min_length: shorter payloads are ignored.
+Family = collections.namedtuple('Family',
+    ('name', 'ids', 'target', 'event', 'id_fields', 'layouts', 'row', 'index', 'min_length'),
+    defaults=((), (), None, 0, 0))
+
+# The valve handlers render an 8 bit ID field as binary, drop its leading
+# zeros and read what is left backwards.  Precomputed for every field value.
+def reverse_significant_bits(value):
+    return int(bin(value)[:1:-1], base=2) if value else 0
+
+REVERSED_FIELD = [reverse_significant_bits(i) for i in range(256)]
+
+################################################################################
+############################### Message families ###############################
+################################################################################
+
+def valves(name, ID_A, target):
+    return Family(name, (ID_A,), target, 'valves',
+        id_fields=(IdField(12, 8, 1, REVERSED_FIELD), IdField(20, 8, 2, REVERSED_FIELD)),
+        layouts=(Raw(3, 8),))
+
+def controller_row(ID_A):
+    return (round(ID_A, -2)-1000)//100
+
+def controller_index(ID_A):
+    return ID_A % 100
+
+def controllers(name, ids, code):
+    """
+    Two 32 bit values in 8 byte payloads; otherwise a float from the first
+    (up to) 32 payload bits.
+    """
+    return Family(name, tuple(ids), 'Controllers', 'controller',
+        layouts=(Layout((Field(code), Field(code)), lengths=(8,)), Layout((Field('f'),), pad=True)),
+        row=controller_row, index=controller_index, min_length=1)
+
+CONTROLLER_IDS = [i for i in range(1001, 2048) if i not in (1100, 1506)]
+CONTROLLER_I32_IDS = [1502, 1504]
+CONTROLLER_U32_IDS = [i for i in CONTROLLER_IDS if i not in CONTROLLER_I32_IDS and controller_index(i) in (14, 15)]
+
+FAMILIES = [
+    valves('ID_546', 546, 'ValvesRenegadeEngine'),
+    valves('ID_552', 552, 'Valves'),
+    valves('ID_547', 547, 'ValvesRenegadeProp'),
+    controllers('ID_Misc_Controller_I32', CONTROLLER_I32_IDS, 'i'),
+    controllers('ID_Misc_Controller_U32', CONTROLLER_U32_IDS, 'I'),
+    controllers('ID_Misc_Controller',
+        [i for i in CONTROLLER_IDS if i not in CONTROLLER_I32_IDS + CONTROLLER_U32_IDS], 'f'),
+]
+
+################################################################################
+################################### Compiler ###################################
+################################################################################
+
+def _per_id(family, value, name, namespace):
+    """Source for value: a literal, or a lookup by ID when it varies."""
+    if not callable(value):
+        return repr(value)
+    values = {ID_A: value(ID_A) for ID_A in family.ids}
+    if len(set(values.values())) == 1:
+        return repr(next(iter(values.values())))
+    namespace[name] = values
+    return '%s[ID_A]'%name
+
+def _slot(base, index):
+    if base.isdigit():
+        return str(int(base) + index)
+    return '%s + %d'%(base, index) if index else base
+
+def _layout_source(layout, number, base, namespace):
+    if isinstance(layout, Raw):
+        return ['data = data[:%d]'%layout.size,
+            'target[%s:%s + len(data)] = data'%(_slot(base, layout.index), _slot(base, layout.index))]
+
+    codes = ''.join(field.code for field in layout.fields)
+    unpack = namespace['S%d'%number] = struct.Struct(layout.endian + codes)
+    payload = 'data'
+    if layout.pad:
+        payload = 'data[:%d].rjust(%d, ZERO)'%(unpack.size, unpack.size)
+    elif layout.lengths is None:
+        raise ValueError("Unpadded layouts need their payload lengths.")
+    elif any(length != unpack.size for length in layout.lengths):
+        raise ValueError("Layout %r is %d bytes, not %r."%(codes, unpack.size, layout.lengths))
+
+    slots = ['target[%s]'%_slot(base, position if field.index is None else field.index)
+        for position, field in enumerate(layout.fields)]
+    if all(field.scale is None for field in layout.fields):
+        # Unpacked straight into the target, as one tuple assignment.
+        return ['%s%s = S%d.unpack(%s)'%(', '.join(slots), ',' if len(slots) == 1 else '', number, payload)]
+    names = ['v%d'%i for i in range(len(slots))]
+    lines = ['%s, = S%d.unpack(%s)'%(', '.join(names), number, payload)]
+    for slot, field, value in zip(slots, layout.fields, names):
+        lines.append('%s = %s*%r'%(slot, value, field.scale) if field.scale is not None else '%s = %s'%(slot, value))
+    return lines
+
+def source(family, namespace):
+    """Source of family's frame handler; constants it uses go in namespace."""
+    branches = [layout for layout in family.layouts if layout.lengths is not None]
+    fallback = [layout for layout in family.layouts if layout.lengths is None]
+    if len(fallback) > 1:
+        raise ValueError("Only one layout can take any other payload length.")
+
+    lines = ['def %s_frame(self, ID_A, msg_id, data):'%family.name]
+    if branches or family.min_length:
+        lines.append('    n = len(data)')
+    if family.min_length:
+        lines += ['    if n < %d:'%family.min_length, '        return']
+    row = '' if family.row is None else '[%s]'%_per_id(family, family.row, 'ROW', namespace)
+    lines.append('    target = self.%s%s'%(family.target, row))
+
+    for k, field in enumerate(family.id_fields):
+        value = '(msg_id >> %d) & %d'%(field.shift, (1 << field.bits) - 1)
+        if field.table is not None:
+            namespace['T%d'%k] = field.table
+            value = 'T%d[%s]'%(k, value)
+        lines.append('    target[%d] = %s'%(field.index, value))
+
+    base = _per_id(family, family.index, 'INDEX', namespace)
+    if not base.isdigit():
+        lines.append('    i = %s'%base)
+        base = 'i'
+
+    if not branches:
+        lines += ['    ' + line for line in _layout_source(fallback[0], 0, base, namespace)] if fallback else []
+        return '\n'.join(lines) + '\n'
+
+    for number, layout in enumerate(branches + fallback):
+        if layout.lengths is None:
+            lines.append('    else:')
+        else:
+            lengths = ' or '.join('n == %d'%length for length in layout.lengths)
+            lines.append('    %s %s:'%('if' if number == 0 else 'elif', lengths))
+        lines += ['        ' + line for line in _layout_source(layout, number, base, namespace)]
+    return '\n'.join(lines) + '\n'
+
+def compile_family(family):
+    """(frame handler, message handler) functions for family, unbound."""
+    namespace = {'ZERO': b'\0'}
+    code = source(family, namespace)
+    exec(code, namespace)
+    frame = namespace[family.name + '_frame']
+    frame.source = code
+    frame.__doc__ = "Decodes into %s, generated from Schema.FAMILIES."%family.target
+
+    # The message engine's bit strings, back to the int ID and payload bytes.
+    def message(self, ID_A, msg_id_bin, data_bin, data_list_hex):
+        frame(self, ID_A, int(msg_id_bin, 2), bytes.fromhex(data_list_hex))
+    message.__name__ = message.__qualname__ = family.name
+    message.__doc__ = frame.__doc__
+    return frame, message
+
+def install(cls, families=FAMILIES):
+    """Adds the families' handlers to cls as methods, by name."""
+    for family in families:
+        frame, message = compile_family(family)
+        setattr(cls, frame.__name__, frame)
+        setattr(cls, message.__name__, message)
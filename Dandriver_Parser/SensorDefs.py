@@ -1,4 +1,8 @@
 
+# [name, [sensor ID, node], calibration]
+# calibration: polynomial coefficients, highest power first.  [m, b] is
+# m*raw + b; longer lists (thermocouples, say) are evaluated as polynomials.
+# See Calibration.py.
 sensorList = [
 
 # Node 2
@@ -71,3 +75,6 @@ sensor_name_from_id = {s[1][0]:s[0] for s in sensorList}
 
 sensor_index_from_name = {s[0]:i    for i,s in enumerate(sensorList)}
 sensor_index_from_id =   {s[1][0]:i for i,s in enumerate(sensorList)}
+
+# Units of calibrated values.  Only the pressure transducers' are known.
+sensor_units_from_id = {s[1][0]:('PSI' if 'PT' in s[0] else '') for s in sensorList}
@@ -0,0 +1,198 @@
+# SharedState.py
+################################################################################
+#     Live vehicle state in shared memory.  One process decodes the bus and
+# publishes its CanReceive's state into a multiprocessing.shared_memory block;
+# any number of local processes map that block as NumPy views, with no copies
+# and no decoding of their own.
+#
+# The block is a fixed layout (LAYOUT) of float64 arrays after a small header.
+# Writes are guarded by a seqlock: the publisher bumps the sequence number to
+# odd before writing and back to even after, and a reader retries any read
+# that saw an odd or changed sequence number.
+#
+# The header records the publisher's process.  A block left behind under the
+# name by a publisher that died (POSIX keeps them until unlinked) is unlinked
+# and created afresh; one whose publisher is still running is an error.
+#
+#   # decoding process
+#   receiver.share_state('blt_state')
+#   # any other process
+#   state = SharedState.StateReader('blt_state')
+#   state.snapshot(['Sensors'])['Sensors'][52]
+
+import os
+import time
+import zlib
+
+import numpy as np
+from multiprocessing import shared_memory
+
+import SensorDefs, Calibration
+
+DEFINED_SENSORS = [s[1][0] for s in SensorDefs.sensorList]
+
+# (name, shape).  NodeStates holds indices into CanReceive.VehicleStates, in
+# NODE_STATES order.  Engineering holds the calibrated values of the
+# SensorDefs sensors, in sensorList order.
+LAYOUT = (
+    ('Sensors', (1028,)),
+    ('sensorTimestamps', (1028,)),
+    ('Valves', (64,)),
+    ('ValvesRenegadeEngine', (64,)),
+    ('ValvesRenegadeProp', (64,)),
+    ('Controllers', (12, 50)),
+    ('NodeStates', (3,)),
+    ('AutosequenceTime', (1,)),
+    ('Engineering', (len(DEFINED_SENSORS),)),
+)
+NODE_STATES = ('NodeStatusBang', 'NodeStatusRenegadeEngine', 'NodeStatusRenegadeProp')
+
+# Header: sequence, layout ID, publishes, msgs_read, publisher pid.
+HEADER = 5
+LAYOUT_ID = zlib.crc32(repr((HEADER, LAYOUT, DEFINED_SENSORS)).encode())
+
+def layout_size():
+    return 8*(HEADER + sum(int(np.prod(shape)) for name, shape in LAYOUT))
+
+def map_block(buffer):
+    """(header, {name: array}) views over a block's buffer."""
+    header = np.ndarray((HEADER,), dtype=np.uint64, buffer=buffer)
+    arrays = {}
+    offset = 8*HEADER
+    for name, shape in LAYOUT:
+        arrays[name] = np.ndarray(shape, dtype=np.float64, buffer=buffer, offset=offset)
+        offset += 8*int(np.prod(shape))
+    return header, arrays
+
+def attach(name):
+    # Attaching must not hand the block to this process's resource tracker,
+    # or it is unlinked when the reader exits.
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, 'shared_memory')
+        except Exception:
+            pass
+        return block
+
+def process_alive(pid):
+    # Windows frees a block with its last handle, so any found is in use (and
+    # os.kill would terminate the process there).
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def create_block(name):
+    """A new block, replacing a stale one of this layout left under name."""
+    try:
+        return shared_memory.SharedMemory(name, create=True, size=layout_size())
+    except FileExistsError:
+        if name is None:
+            raise
+    # Attached tracked, so unlink() also drops it from the resource tracker.
+    old = shared_memory.SharedMemory(name)
+    header = np.ndarray((HEADER,), dtype=np.uint64, buffer=old.buf) if old.size >= 8*HEADER else None
+    stale = header is not None and int(header[1]) == LAYOUT_ID and not process_alive(int(header[4]))
+    owner = int(header[4]) if header is not None else None
+    del header
+    if not stale:
+        old.close()
+        raise FileExistsError("Shared state %r already exists, publisher pid %s."%(name, owner))
+    old.close()
+    old.unlink()
+    return shared_memory.SharedMemory(name, create=True, size=layout_size())
+
+class StatePublisher:
+    """Owns the block, and copies a receiver's state into it on publish()."""
+    def __init__(self, receiver, name=None):
+        self.receiver = receiver
+        self.block = create_block(name)
+        self.name = self.block.name
+        self.header, self.arrays = map_block(self.block.buf)
+        self.header[:] = 0
+        self.header[1] = LAYOUT_ID
+        self.header[4] = os.getpid()
+        self._states = {state: i for i, state in enumerate(receiver.VehicleStates)}
+        self._defined = np.array(DEFINED_SENSORS)
+
+    def publish(self):
+        receiver, arrays, header = self.receiver, self.arrays, self.header
+        header[0] += 1
+        arrays['Sensors'][:] = receiver.Sensors
+        arrays['sensorTimestamps'][:] = receiver.sensorTimestamps
+        arrays['Valves'][:] = receiver.Valves
+        arrays['ValvesRenegadeEngine'][:] = receiver.ValvesRenegadeEngine
+        arrays['ValvesRenegadeProp'][:] = receiver.ValvesRenegadeProp
+        arrays['Controllers'][:] = receiver.Controllers
+        arrays['NodeStates'][:] = [self._states.get(getattr(receiver, state), -1) for state in NODE_STATES]
+        arrays['AutosequenceTime'][0] = receiver.AutosequenceTime
+        arrays['Engineering'][:] = Calibration.calibrate(self._defined, arrays['Sensors'][self._defined])
+        header[2] += 1
+        header[3] = receiver.msgs_read
+        header[0] += 1
+
+    def close(self):
+        self.header = self.arrays = None
+        self.block.close()
+        self.block.unlink()
+
+class StateReader:
+    """
+    Maps a published block.  arrays are live views: cheap, but a read that
+    races a publish can mix old and new values.  snapshot() and read() give
+    consistent reads.
+    """
+    def __init__(self, name='blt_state'):
+        self.block = attach(name)
+        self.header, self.arrays = map_block(self.block.buf)
+        if int(self.header[1]) != LAYOUT_ID:
+            self.close()
+            raise ValueError("Shared state %r has a different layout, SensorDefs out of date?"%name)
+
+    def sequence(self):
+        return int(self.header[0])
+
+    def publishes(self):
+        return int(self.header[2])
+
+    def msgs_read(self):
+        return int(self.header[3])
+
+    def read(self, fn, retries=1000):
+        """
+        fn(arrays) under the seqlock, retried until no publish overlapped it.
+        fn must copy whatever it keeps.
+        """
+        header = self.header
+        for attempt in range(retries):
+            before = int(header[0])
+            if before & 1:
+                time.sleep(0)
+                continue
+            result = fn(self.arrays)
+            if int(header[0]) == before:
+                return result
+        raise TimeoutError("Shared state kept changing while being read.")
+
+    def snapshot(self, names=None, retries=1000):
+        """Consistent copies of the named arrays (all of them by default)."""
+        names = [name for name, shape in LAYOUT] if names is None else names
+        return self.read(lambda arrays: {name: arrays[name].copy() for name in names}, retries)
+
+    def node_states(self, states):
+        """{node: state name} given CanReceive.VehicleStates."""
+        codes = self.snapshot(['NodeStates'])['NodeStates']
+        return {node: states[int(code)] if code >= 0 else None for node, code in zip(NODE_STATES, codes)}
+
+    def close(self):
+        self.header = self.arrays = None
+        self.block.close()
@@ -11,12 +11,17 @@ import time
 import humanize
 
 import numpy as np
-import multiprocessing
 import zipfile
+import gzip
+import bz2
+import lzma
 import io
+import os
+import mmap
+import binascii
 
 import bitstring
-import CanReceive, SensorDefs
+import CanReceive, SensorDefs, Pipeline, Calibration, Merge, Export, Decimate
 
 import csv
 import re
@@ -44,6 +49,123 @@ class CanReader:
     def prep_format(line):
         raise NotImplementedError()
 
+    # Bytes-level reader.  Yields (arbitration_id: int, dlc: int,
+    # payload: bytes) straight from the file, without per-line str objects.
+    def generate_frames(source, start=0, stop=None, progress=None):
+        raise NotImplementedError()
+
+# Memory maps a path, or passes an already opened binary file through.
+# Yields (buffer, size).  Empty files can't be mapped, and give (b'', 0).
+class mapped_source:
+    def __init__(self, source):
+        self.source = source
+        self.file, self.map = None, None
+
+    def __enter__(self):
+        if not isinstance(self.source, (str, bytes, os.PathLike)):
+            return None, None
+        self.file = open(self.source, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            return b'', 0
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map, size
+
+    def __exit__(self, *exceptionArgs):
+        if self.map is not None:
+            self.map.close()
+        if self.file is not None:
+            self.file.close()
+
+# Splits a buffer into lines, from the first line starting at or after start
+# to the last line starting before stop.
+# progress, if given, is called with the byte position every PROGRESS_BYTES.
+PROGRESS_BYTES = 1<<20
+
+def generate_mapped_lines(buffer, size, start=0, stop=None, progress=None):
+    stop = size if stop is None else min(stop, size)
+    pos = start
+    if 0 < pos and buffer[pos-1:pos] != b'\n':
+        pos = buffer.find(b'\n', pos) + 1 or size
+    find = buffer.find
+    report = pos + PROGRESS_BYTES if progress else size + 1
+    while pos < stop:
+        end = find(b'\n', pos)
+        if end < 0:
+            end = size
+        yield buffer[pos:end]
+        pos = end + 1
+        if pos >= report:
+            progress(pos)
+            report = pos + PROGRESS_BYTES
+    if progress:
+        progress(min(pos, size))
+
+# Same, for an opened binary file.  Only seeks for ranges, so streams work.
+def generate_file_lines(file, start=0, stop=None, progress=None):
+    pos = start
+    if 0 < pos:
+        file.seek(pos - 1)
+        if file.read(1) != b'\n':
+            pos += len(file.readline())
+    report = pos + PROGRESS_BYTES if progress else float('inf')
+    for line in file:
+        if stop is not None and pos >= stop:
+            break
+        pos += len(line)
+        yield line
+        if pos >= report:
+            progress(pos)
+            report = pos + PROGRESS_BYTES
+    if progress:
+        progress(pos)
+
+def generate_source_lines(source, start=0, stop=None, progress=None):
+    with mapped_source(source) as (buffer, size):
+        if buffer is None:
+            yield from generate_file_lines(source, start, stop, progress)
+        else:
+            yield from generate_mapped_lines(buffer, size, start, stop, progress)
+
+# Reads a source in large blocks.  align(buffer, size, pos) moves start and
+# stop onto record boundaries; ranges need a path, so the file can be mapped.
+def generate_source_blocks(source, start=0, stop=None, block=1<<20, align=None, progress=None):
+    with mapped_source(source) as (buffer, size):
+        if buffer is None:
+            if start != 0 or stop is not None:
+                raise ValueError("Byte ranges need a path to the file.")
+            pos = 0
+            for chunk in iter(lambda: source.read(block), b''):
+                yield chunk
+                pos += len(chunk)
+                if progress:
+                    progress(pos)
+            return
+        stop = size if stop is None else min(stop, size)
+        if align is not None:
+            start, stop = align(buffer, size, start), align(buffer, size, stop)
+        for pos in range(start, stop, block):
+            yield buffer[pos:min(pos + block, stop)]
+            if progress:
+                progress(min(pos + block, stop))
+
+# Groups frames into blocks of n, as NumPy arrays:
+# ids (n,) uint32, dlc (n,) uint8 and payloads (n, 8) uint8, zero padded.
+def frame_blocks(frames, n=65536):
+    ids, dlcs, payloads = [], [], bytearray(8*n)
+    for arbitration_id, dlc, payload in frames:
+        i = len(ids)
+        ids.append(arbitration_id)
+        dlcs.append(dlc)
+        payloads[8*i:8*i + len(payload)] = payload[:8]
+        if len(ids) == n:
+            yield (np.array(ids, dtype=np.uint32), np.array(dlcs, dtype=np.uint8),
+                np.frombuffer(payloads, dtype=np.uint8).reshape(n, 8))
+            ids, dlcs, payloads = [], [], bytearray(8*n)
+    if ids:
+        yield (np.array(ids, dtype=np.uint32), np.array(dlcs, dtype=np.uint8),
+            np.frombuffer(payloads, dtype=np.uint8)[:8*len(ids)].reshape(-1, 8))
+
 # Can dump with ID 58
 #   can0  08EF003A   [5]  19 C0 3C 19 E6
 class Candump(CanReader):
@@ -60,6 +182,26 @@ class Candump(CanReader):
         msg_data = ''.join(argv)
         return msg_id, msg_data
 
+    # Memory maps the dump (or reads an opened binary file) and scans it as
+    # bytes.  start/stop are byte offsets; lines are taken whole.
+    # Blank and malformed lines are skipped.
+    def generate_frames(source, start=0, stop=None, progress=None):
+        unhexlify = binascii.unhexlify
+        for line in generate_source_lines(source, start, stop, progress):
+            items = line.split()
+            if len(items) < 3:
+                continue
+            try:
+                arbitration_id = int(items[1], 16)
+                dlc = int(items[2][1:-1])
+                payload = unhexlify(b''.join(items[3:3 + dlc]))
+            except (ValueError, binascii.Error):
+                continue
+            yield arbitration_id, dlc, payload
+
+    def generate_frame_blocks(source, n=65536, start=0, stop=None):
+        return frame_blocks(Candump.generate_frames(source, start, stop), n)
+
 class Coolterm(CanReader):
     # Generator for handling coolterm reads.
     # Newlines appear to be in random places.  I'll have to write my own here.
@@ -87,6 +229,88 @@ class Coolterm(CanReader):
             for chunk in gen_chunk(gen):
                 yield chunk
 
+    # A record is "id:b0,b1,...,b7", starting the buffer or after a comma or
+    # newline, and ended by a comma or, after the last byte, a newline.
+    # Whitespace between the fields is skipped, and newlines inside the ID or
+    # the first seven bytes are dropped ("1\n01" is 101).  The last byte can't
+    # have one: "8\n101:" is the end of one record and the start of the next.
+    RECORD = re.compile(rb'(?<![^,\n])(\d[\d\r\n]*)\s*:' + rb'\s*(\d[\d\r\n]*)\s*,'*7
+        + rb'\s*(\d+)[ \t\r]*(?:,|\n|\Z)')
+    SEPARATORS = b' \t\r\n,'
+
+    # Start of the record whose ':' is at colon: the byte after the comma or
+    # newline before its ID.
+    def record_start(buffer, colon):
+        return max(buffer.rfind(b',', 0, colon), buffer.rfind(b'\n', 0, colon)) + 1
+
+    # Moves pos to the start of the next record.  Records are assigned to
+    # whichever range their start falls in.  Matching starts from the record
+    # before pos, as a serial read goes, so a newline in an ID isn't taken
+    # for a record start.
+    def align(buffer, size, pos):
+        if pos <= 0 or pos >= size:
+            return min(max(pos, 0), size)
+        colon = buffer.rfind(b':', 0, pos)
+        for match in Coolterm.RECORD.finditer(buffer, Coolterm.record_start(buffer, colon) if colon >= 0 else 0):
+            if match.start() >= pos:
+                return match.start()
+        return size
+
+    # (arbitration_id, dlc, payload) of a RECORD match, or None if a field is
+    # out of range.
+    def record_frame(match, rejected=None):
+        fields = match.groups()
+        try:
+            values = [int(field) for field in fields]
+        except ValueError:
+            values = [int(field.translate(None, b'\r\n')) for field in fields]
+        try:
+            payload = bytes(values[1:])
+        except ValueError:
+            if rejected is not None:
+                rejected.append(match.group())
+            return None
+        return values[0], len(payload), payload
+
+    # Parses the records in data.  Spans that aren't records go in rejected,
+    # if given.  Unless final, the last record is left for the next block, as
+    # its last byte may go on there, and the offset it starts at is returned.
+    def generate_records(data, rejected=None, final=True):
+        end = 0
+        last = None
+        for match in Coolterm.RECORD.finditer(data):
+            if last is not None:
+                frame = Coolterm.record_frame(last, rejected)
+                if frame is not None:
+                    yield frame
+            if rejected is not None and data[end:match.start()].strip(Coolterm.SEPARATORS):
+                rejected.append(data[end:match.start()])
+            last, end = match, match.end()
+        if not final:
+            return last.start() if last is not None else 0
+        if last is not None:
+            frame = Coolterm.record_frame(last, rejected)
+            if frame is not None:
+                yield frame
+        if rejected is not None and data[end:].strip(Coolterm.SEPARATORS):
+            rejected.append(data[end:])
+        return len(data)
+
+    # Bytes-level reader over large blocks.  Yields (arbitration_id, dlc,
+    # payload); records split across blocks are carried over.  rejected, if
+    # given, is a list that gets the bytes of every span that isn't a record.
+    def generate_frames(source, start=0, stop=None, block=1<<20, progress=None, rejected=None):
+        carry = b''
+        for chunk in generate_source_blocks(source, start, stop, block, Coolterm.align, progress):
+            data = carry + chunk
+            end = yield from Coolterm.generate_records(data, rejected, final=False)
+            carry = data[end:]
+        if carry:
+            yield from Coolterm.generate_records(carry, rejected)
+
+    def generate_frame_blocks(source, n=65536, start=0, stop=None):
+        return frame_blocks(Coolterm.generate_frames(source, start, stop), n)
+
     # Converts a coolterm line into a prepared packet.
     def prep_format(line):
         try:
@@ -143,69 +367,37 @@ class RD2(Driver):
         
         return ID_A, msg_id_bin, data_bin, data_list_hex
 
+    # Integer-native counterpart of parse, for CanReceive.translateFrame.
+    def parse_frame(msg_in):
+        msg_id = int(msg_in.arbitration_id)
+        return msg_id & CanReceive.ID_MASK, msg_id, bytes(msg_in.data)
 
-@timed
-def get_entry_size(name, file, fmt, drv):
-    num = 0
-    print("Finding total number of entries in %s..."%name)
-    file.seek(0)
-    for i,line in enumerate(fmt.generate_entries(file)):
-        num = i
-    file.seek(0)
-    return num
-
-@timed
-def prep_preprocess(name, file, fmt, drv):
-    print("Preparing lines for multiprocessing...")
-    file.seek(0)
-    prepped = [[line, fmt.prep_format, drv.prep, drv.parse] for line in fmt.generate_entries(file)]
-    print(len(prepped))
-    return prepped
-
-def preprocess(args):
-    line, prep_format, prep, parse = args
-    return parse(prep(*prep_format(line)))
 
+# This file is 160mb.  Single pass, streamed; see Pipeline.py.
+# sink: where the ledgers go.  Defaults to in-memory ledgers.
 @timed
-def run_preprocess(lines):
-    cores = multiprocessing.cpu_count()
-    print("Preprocessing lines on %d cores..."%cores)
-    with multiprocessing.Pool(cores) as pool:
-        preprocessed = pool.map(preprocess, lines)
-        #preprocessed = pool.map(drv.batch, lines)
-    return preprocessed
-
-# This file is 160mb.  Please be careful running this script.
-def parse_raw_candump(name, file, fmt, drv):
+def parse_raw_candump(name, file, fmt, sink=None):
     print("Running tests for %s."%name)
-    maxlines = get_entry_size(name, file, fmt, drv)
-    preprocessed = run_preprocess(prep_preprocess(name, file, fmt, drv))
-    print(f'{len(preprocessed) = }')
-
-
-    canrecieve = CanReceive.CanReceive('virtual', 'virtual')
-    pct = 0
-    for i, (ID_A, msg_id_bin, data_bin, data_list_hex) in enumerate(preprocessed):
-        p = int(100*i/maxlines)
-        if 5 <= p - pct:
-            pct += 5
-            print("%i%%"%pct)
-
-        canrecieve.translateMessage(ID_A, msg_id_bin, data_bin, data_list_hex)
-    
-    return canrecieve
+    return Pipeline.parse_stream(file, fmt, sink=sink)
 
 ################################################################################
 # There are two primary test files: a Coolterm Capture, and a very large can
 # dump.  The can dump extraction is performed here, before other imports.
 
-# Opens .txt and .zip files.
+# Opens .txt, .zip, .gz, .bz2 and .xz files.
 # paths is a list of strings to test files.
 # https://www.geeksforgeeks.org/with-statement-in-python/
+#
+# Archives are streamed: zip members through ZipFile.open, compressed dumps
+# through the stdlib decompressors, so nothing is held in memory whole.
+# binary=True yields binary streams, otherwise text.
+
+COMPRESSED = {'gz': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
 
 class lazy_open:
-    def __init__(self, path):
+    def __init__(self, path, binary=False):
         self.path = path
+        self.binary = binary
 
     def __enter__(self):
 
@@ -214,19 +406,25 @@ class lazy_open:
         Name = FileName[:-1-len(Type)]
         
         if Type == 'txt':
-            self.file = open(self.path, 'r')
+            self.file = open(self.path, 'rb' if self.binary else 'r')
             return ((self.file, FileName),)
+
+        elif Type in COMPRESSED:
+            # dump.txt.gz reads as dump.txt
+            self.file = COMPRESSED[Type](self.path, 'rb' if self.binary else 'rt')
+            return ((self.file, Name),)
         
         elif Type == 'zip':
-            with open(self.path, 'rb') as file:
-                self.file = zipfile.ZipFile(io.BytesIO(file.read()))
+            self.file = zipfile.ZipFile(self.path)
 
-            def generator(zipped):
-                for name in zipped.namelist():
-                    unzipped = zipped.read(name).decode()
-                    yield io.StringIO(unzipped), name
+            def generator(zipped, binary):
+                for info in zipped.infolist():
+                    if info.is_dir():
+                        continue
+                    with zipped.open(info) as member:
+                        yield (member if binary else io.TextIOWrapper(member)), info.filename
 
-            return generator(self.file)
+            return generator(self.file, self.binary)
 
         else:
             raise NotImplementedError("Filetype unsupported.")
@@ -261,21 +459,33 @@ def graphs(canrecieve):
     #time_value = np.array([item[1] for item in canrecieve2.timeLedger])
     #plt.plot(time_entry, time_value-time_value[0], 'o-')
 
+    # Each line is drawn from a min/max pyramid at about the axes' pixel
+    # width, and redrawn from it on zoom.
+    lines = []
+    def redraw(ax):
+        start, stop = ax.get_xlim()
+        width = max(int(ax.bbox.width), 100)
+        for line, pyramid in lines:
+            line.set_data(*pyramid.query(start, stop, width))
+
     def showsensor(ax, sensor=52, t0=0):
         print("sensor", sensor)
-        m, b = 1, 0
+        convert = False
         labelSuffix = ""
         if sensor%2 == 1: # Converted value!
             sensor = sensor - 1
             #print(sensor + 1, "converted to", sensor)
-            m, b = SensorDefs.sensorList[SensorDefs.sensor_index_from_id[sensor]][2]
+            convert = True
             labelSuffix = " converted"
         ledger = canrecieve.sensorLedgers[sensor]
-        ledger = np.array(ledger)
-        print("ledger shape", ledger.shape)
-        sens_time, sens_value = ledger.T
-        sens_value = sens_value*m + b
-        ax.plot((sens_time - t0)*1000, sens_value, label=SensorDefs.sensor_name_from_id[sensor] + labelSuffix)
+        print("ledger length", len(ledger))
+        sens_time, sens_value = ledger.times, ledger.values
+        if convert:
+            sens_value = Calibration.calibrate_sensor(sensor, sens_value)
+        pyramid = Decimate.Pyramid((sens_time - t0)*1000, sens_value)
+        line, = ax.plot(*pyramid.query(-np.inf, np.inf, 2000),
+            label=SensorDefs.sensor_name_from_id[sensor] + labelSuffix)
+        lines.append((line, pyramid))
 
     t0 = 578.4427533519122
     fig, ax = plt.subplots()
@@ -284,32 +494,36 @@ def graphs(canrecieve):
     for sensor in [62, 64, 52, 50, 60, 58, 54, 66, 68]:
         #showsensor(ax, sensor, t0)
         showsensor(ax, sensor+1, t0)
-    ast = np.array(canrecieve.AutosequenceLedger)
-    #ax.plot(ast.T[0] - t0, ast.T[1]*10, 'o-', label="Autosequence")
+    ast = canrecieve.AutosequenceLedger
+    #ax.plot(ast.times - t0, ast.values*10, 'o-', label="Autosequence")
     ax.legend()
     ax.set_xlabel('milliseconds')
     ax.set_ylabel('PSI')
     #ax.set_xbound(-1000, 12000)
+    ax.callbacks.connect('xlim_changed', redraw)
     plt.show()
 
 
 #TJ 5/31 
 #candump to csv
 if __name__ == "__main__":
+    import DecodeCache
     m, b = 1, 0
-    with lazy_open(r'CoolTerm_Capture_2022-09-17_17-29-51.txt') as files: 
+    path = r'CoolTerm_Capture_2022-09-17_17-29-51.txt'
+    cache = DecodeCache.DecodeCache()
+    with lazy_open(path) as files: 
         for file, name in files:
             print(name)
             
-            canrecieve = parse_raw_candump(name, file, *filter_format(name))
-            for sensor in  [62, 64, 52, 50, 60, 58, 54, 66, 68]:
+            # Re-runs load the decoded ledgers from the cache.
+            canrecieve = cache.cached(path,
+                lambda: parse_raw_candump(name, file, filter_format(name)[0]), member=name)
+            sensors = [62, 64, 52, 50, 60, 58, 54, 66, 68]
+            for sensor in sensors:
                 dataframe = pandas.DataFrame()
-                m, b = SensorDefs.sensorList[SensorDefs.sensor_index_from_id[sensor]][2]#!!!
                 ledger = canrecieve.sensorLedgers[sensor]
-                ledger = np.array(ledger)
-                #print("ledger shape", ledger.shape)
-                sens_time, sens_value = ledger.T
-                sens_value = sens_value*m + b
+                sens_time = ledger.times
+                sens_value = Calibration.calibrate_sensor(sensor, ledger.values)
                 print("sensor " , sensor)
                 print ("sens time " , len(sens_time))
                 print("sens val " , len(sens_value))
@@ -320,6 +534,11 @@ if __name__ == "__main__":
                 dataframe["PSI"] = sens_value.tolist()
                 print(dataframe)
                 dataframe.to_csv("_"+ str(SensorDefs.sensor_name_from_id[sensor]) + '.csv', index=False)
+            # All of them in one table, forward filled on every timestamp.
+            Merge.write_csv("_merged.csv", Merge.union(canrecieve.sensorLedgers, sensors, calibrated=True),
+                Merge.column_names(sensors))
+            # Every ledger, columnar, for loading single sensors back quickly.
+            Export.export_receiver(canrecieve, "_export")
                 
         
         
@@ -331,7 +550,7 @@ if(False):
         for file, name in files:
             print(name)
             with file:
-                graphs(parse_raw_candump(name, file, *filter_format(name)))
+                graphs(parse_raw_candump(name, file, filter_format(name)[0]))
 
 
         fileName = input("Please copy and paste the name of the .txt file (do not include extension): ")
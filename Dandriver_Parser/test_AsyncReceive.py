@@ -0,0 +1,108 @@
+# test_AsyncReceive.py
+################################################################################
+#     Checks that AsyncReceive publishes events for frames ingested into it.
+
+import asyncio
+
+import can
+import pytest
+
+import CanReceive, AsyncReceive, ClockModel
+
+def sensor_message(raw_timestamp, sensor, value):
+    return can.Message(arbitration_id=(raw_timestamp << 11) | sensor,
+        data=bytes([value >> 8, value & 0xFF]), is_extended_id=True, timestamp=raw_timestamp)
+
+async def sensor_events(install_clock):
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    if install_clock == 'before':
+        ClockModel.ClockModel(receiver).install()
+    live = AsyncReceive.AsyncReceive(receiver)
+    if install_clock == 'after':
+        ClockModel.ClockModel(receiver).install()
+    subscription = live.subscribe('sensor', coalesce=False)
+    for i, value in enumerate((100, 200, 300)):
+        live.ingest(sensor_message(10 + i, 52, value))
+    subscription.close()
+    return receiver, [event async for event in subscription]
+
+@pytest.mark.parametrize('install_clock', [None, 'before', 'after'])
+def test_sensor_events(install_clock):
+    receiver, events = asyncio.run(sensor_events(install_clock))
+    assert [(event.kind, event.id, event.value[0]) for event in events] == \
+        [('sensor', 52, 100), ('sensor', 52, 200), ('sensor', 52, 300)]
+    assert events[-1].value[1] == receiver.sensorTimestamps[52]
+    assert (receiver.clock is not None) == (install_clock is not None)
+
+def subscribed(**options):
+    live = AsyncReceive.AsyncReceive(CanReceive.CanReceive('virtual', 'virtual'))
+    return live, live.subscribe('sensor', maxsize=2, **options)
+
+async def drain(subscription):
+    subscription.close()
+    return [event.value[0] async for event in subscription]
+
+def test_full_subscription_drops_oldest():
+    async def run():
+        live, subscription = subscribed(coalesce=False)
+        for value in range(5):
+            assert live.ingest(sensor_message(10 + value, 52, value)) == []
+        return subscription, await drain(subscription)
+    subscription, values = asyncio.run(run())
+    assert values == [3, 4]
+    assert subscription.counters() == {'queued': 0, 'delivered': 2, 'coalesced': 0, 'dropped': 3}
+
+def test_coalescing_keeps_newest():
+    async def run():
+        live, subscription = subscribed()
+        for value in range(5):
+            live.ingest(sensor_message(10 + value, 52, value))
+        live.ingest(sensor_message(20, 50, 9))
+        live.ingest(sensor_message(21, 54, 8))
+        return subscription, await drain(subscription)
+    subscription, values = asyncio.run(run())
+    # 52 coalesced to its newest value, then dropped for 54.
+    assert values == [9, 8]
+    assert subscription.counters() == {'queued': 0, 'delivered': 2, 'coalesced': 4, 'dropped': 1}
+
+@pytest.mark.parametrize('coalesce', [False, True])
+def test_waiting_subscription_holds_up_ingest(coalesce):
+    async def run():
+        live, subscription = subscribed(coalesce=coalesce, wait=True)
+        # Different IDs, so nothing coalesces.
+        async def produce():
+            for value in range(6):
+                await live.put(sensor_message(10 + value, 50 + 2*value, value))
+        producer = asyncio.ensure_future(produce())
+        await asyncio.sleep(0.01)
+        # Stopped at the third event, with the buffer full.
+        assert not producer.done()
+        assert len(subscription._events) == 2
+        assert live.receiver.msgs_read == 3
+        values = []
+        async for event in subscription:
+            values.append(event.value[0])
+            await asyncio.sleep(0)
+            if len(values) == 6:
+                break
+        await producer
+        return subscription, values
+    subscription, values = asyncio.run(run())
+    assert values == list(range(6))
+    assert subscription.dropped == 0
+
+def test_ingest_hands_back_refused_events():
+    async def run():
+        live, subscription = subscribed(coalesce=False, wait=True)
+        refused = [live.ingest(sensor_message(10 + value, 52, value)) for value in range(3)]
+        assert refused[:2] == [[], []]
+        assert [(s, e.value[0]) for s, e in refused[2]] == [(subscription, 2)]
+        putting = asyncio.ensure_future(subscription.put(refused[2][0][1]))
+        await asyncio.sleep(0)
+        assert not putting.done()
+        # Closing releases a waiting put, dropping its event.
+        values = await drain(subscription)
+        await putting
+        assert subscription.counters()['queued'] == 0
+        return values
+    assert asyncio.run(run()) == [0, 1]
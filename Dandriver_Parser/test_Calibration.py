@@ -0,0 +1,43 @@
+# test_Calibration.py
+################################################################################
+#     Checks the vectorized calibrations against converting one value at a
+# time, straight from the sensorList coefficients.
+
+import numpy as np
+import pytest
+
+import CanReceive, SensorDefs, Calibration
+
+# Linear, a cubic and an uncalibrated ID.
+SENSOR_LIST = [['Lox Dome', [52, 2], [0.5, -10.0]], ['Fuel Dome', [53, 2], [2.0, 1.0]],
+    ['Thermocouple', [60, 3], [1e-6, -2e-3, 1.5, -20.0]]]
+
+def reference(sensor_list, sensor, raw):
+    for name, (ID, node), coefficients in sensor_list:
+        if ID == sensor:
+            return sum(c*raw**power for power, c in enumerate(reversed(coefficients)))
+    return raw
+
+@pytest.mark.parametrize('sensor_list', [SENSOR_LIST, SensorDefs.sensorList], ids=['custom', 'SensorDefs'])
+def test_calibrate(sensor_list):
+    calibrations = Calibration.Calibrations(sensor_list)
+    rng = np.random.default_rng(0)
+    sensors = np.array([entry[1][0] for entry in sensor_list] + [54, 1000])
+    sensor_ids = rng.choice(sensors, 500)
+    raw = rng.integers(0, 1 << 16, 500)
+    expected = [reference(sensor_list, sensor, value) for sensor, value in zip(sensor_ids.tolist(), raw.tolist())]
+    np.testing.assert_allclose(calibrations.calibrate(sensor_ids, raw), expected, rtol=1e-12)
+    for sensor in sensors.tolist():
+        select = sensor_ids == sensor
+        np.testing.assert_allclose(calibrations.calibrate_sensor(sensor, raw[select]),
+            np.array(expected)[select], rtol=1e-12)
+        assert calibrations.value(sensor, 1234) == pytest.approx(reference(sensor_list, sensor, 1234), rel=1e-12)
+
+def test_engineering_view():
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    receiver.Sensors[52], receiver.Sensors[60], receiver.Sensors[54] = 100, 2000, 7
+    view = Calibration.EngineeringView(receiver, Calibration.Calibrations(SENSOR_LIST))
+    assert (view[52], view[54]) == (40.0, 7)
+    assert view[60] == pytest.approx(reference(SENSOR_LIST, 60, 2000))
+    assert len(view) == len(receiver.Sensors)
+    np.testing.assert_allclose(view.array()[[52, 54, 60]], [view[52], view[54], view[60]])
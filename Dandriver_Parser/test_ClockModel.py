@@ -0,0 +1,31 @@
+# test_ClockModel.py
+################################################################################
+#     Checks ClockModel's per-node unwrapping and clock fit.
+
+import pytest
+
+import ClockModel
+
+def unwrapped(timestamps, reorder=5.0):
+    clock = ClockModel.NodeClock(reorder)
+    return [round(clock.unwrap(t)*8000, 6) for t in timestamps]
+
+def test_rollover():
+    assert unwrapped([1, 5, 9, 2, 3, 8, 0.5]) == [1, 5, 9, 12, 13, 18, 20.5]
+
+def test_first_timestamp_is_not_late():
+    assert unwrapped([7, 8, 1]) == [7, 8, 11]
+
+def test_out_of_order_is_not_a_rollover():
+    assert unwrapped([4, 5, 4.9, 6, 5.5, 7]) == [4, 5, 4.9, 6, 5.5, 7]
+
+def test_late_frame_from_before_a_rollover():
+    assert unwrapped([8, 9.8, 0.1, 9.9, 0.3]) == [8, 9.8, 10.1, 9.9, 10.3]
+
+def test_fit():
+    fit = ClockModel.StreamingFit()
+    for x in range(100):
+        fit.add(x*0.01, 1000.0 + 1.0001*x*0.01)
+    assert fit.slope() == pytest.approx(1.0001)
+    assert fit.intercept() == pytest.approx(1000.0)
+    assert fit.predict(2.0) == pytest.approx(1000.0 + 2.0002)
@@ -0,0 +1,94 @@
+# test_Decimate.py
+################################################################################
+#     Checks the decimators against straightforward one-bucket-at-a-time
+# versions, on a signal with spikes a stride would miss.
+
+import numpy as np
+import pytest
+
+import Ledgers, Decimate
+
+SPIKES = [1234, 5000, 9999]
+
+def signal(size=10007, seed=0):
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.uniform(0.5, 1.5, size))
+    values = np.sin(times/300) + rng.normal(0, 0.01, size)
+    if size > max(SPIKES):
+        values[SPIKES] = [5.0, -5.0, 3.0]
+    return times, values
+
+def reference_minmax(times, values, n):
+    edges = np.searchsorted(times, np.linspace(times[0], times[-1], n + 1)[1:-1]).tolist()
+    picked = {0, len(times) - 1}
+    for a, b in zip([0] + edges, edges + [len(times)]):
+        if a < b:
+            picked.add(a + int(np.argmin(values[a:b])))
+            picked.add(a + int(np.argmax(values[a:b])))
+    return sorted(picked)
+
+def reference_lttb(times, values, n):
+    size = len(times)
+    edges = [int(edge) for edge in np.linspace(1, size - 1, n - 1).astype(np.int64)]
+    picked = [0]
+    for b in range(n - 2):
+        lo, hi = edges[b], edges[b + 1]
+        if b + 1 < n - 2:
+            following = range(edges[b + 1], edges[b + 2])
+            ct = sum(times[i] for i in following)/len(following)
+            cv = sum(values[i] for i in following)/len(following)
+        else:
+            ct, cv = times[-1], values[-1]
+        a = picked[-1]
+        areas = [abs((times[a] - ct)*(values[i] - values[a]) - (times[a] - times[i])*(cv - values[a]))
+            for i in range(lo, hi)]
+        picked.append(lo + areas.index(max(areas)))
+    return picked + [size - 1]
+
+@pytest.mark.parametrize('n', [1, 10, 333, 2000])
+def test_minmax(n):
+    times, values = signal()
+    picked = Decimate.minmax_indices(times, values, n)
+    assert picked.tolist() == reference_minmax(times, values, n)
+    if n >= 10:
+        assert set(SPIKES) <= set(picked.tolist())
+
+def test_minmax_short():
+    times, values = signal(15)
+    assert Decimate.minmax_indices(times, values, 10).tolist() == list(range(15))
+
+@pytest.mark.parametrize('n', [3, 4, 100, 1000, 5003])
+def test_lttb(n):
+    times, values = signal()
+    picked = Decimate.lttb_indices(times, values, n)
+    assert picked.tolist() == reference_lttb(times.tolist(), values.tolist(), n)
+    assert len(picked) == n and (np.diff(picked) > 0).all()
+    if n >= 100:
+        assert set(SPIKES) <= set(picked.tolist())
+
+def test_lttb_short():
+    times, values = signal(50)
+    assert Decimate.lttb_indices(times, values, 50).tolist() == list(range(50))
+    assert Decimate.lttb_indices(times, values, 2).tolist() == list(range(50))
+
+@pytest.mark.parametrize('window', [(0, np.inf), (2000, 4000), (4990, 5010)])
+def test_pyramid(window):
+    times, values = signal(200000, seed=1)
+    times[:] = np.arange(len(times))
+    values[[1234, 5000, 150000]] = [5.0, -5.0, 3.0]
+    pyramid = Decimate.Pyramid(times, values)
+    assert len(pyramid.levels) > 2
+    t, v = pyramid.query(window[0], window[1], 500)
+    assert len(t) <= 2*500 + 2
+    select = (times >= window[0]) & (times <= window[1])
+    # The window's extremes are kept, whichever level served it.
+    assert v.max() == values[select].max() and v.min() == values[select].min()
+    assert t[0] <= max(window[0], times[0]) + 1 and t[-1] >= min(window[1], times[-1]) - 1
+
+def test_recent():
+    ledger = Ledgers.Ledger()
+    times, values = signal()
+    ledger.extend_columns(times, values)
+    t, v = Decimate.recent(ledger, 100, seconds=1000)
+    select = times >= times[-1] - 1000
+    np.testing.assert_array_equal(t, times[select][reference_minmax(times[select], values[select], 100)])
@@ -0,0 +1,82 @@
+# test_DecodeCache.py
+################################################################################
+#     Checks that the decode cache returns what was parsed, misses when the
+# input, decoder or sensor definitions change, and evicts least recently used
+# entries first.
+
+import itertools
+
+import pytest
+
+import CanReceive, SensorDefs, Pipeline, DecodeCache, Benchmark
+import blt_parser_rd2_hrc as parser
+from test_equivalence import assert_same_state
+
+def write_dump(path, seed, n=2000):
+    Benchmark.write_candump(str(path), Benchmark.synthetic_frames(n, seed=seed))
+    return str(path)
+
+class Parses:
+    """parse() for DecodeCache.cached, counting the calls."""
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return Pipeline.parse_stream(self.path, parser.Candump, progress=False)
+
+@pytest.fixture
+def cache(tmp_path):
+    return DecodeCache.DecodeCache(str(tmp_path/'cache'))
+
+def test_hit_and_miss(tmp_path, cache):
+    path = write_dump(tmp_path/'a.txt', seed=1)
+    parse = Parses(path)
+    assert cache.load(path) is None
+    parsed = cache.cached(path, parse)
+    loaded = cache.cached(path, parse)
+    assert parse.calls == 1
+    assert_same_state(loaded, parsed)
+    # A new cache on the same directory hits too.
+    assert_same_state(DecodeCache.DecodeCache(cache.directory).load(path), parsed)
+
+def test_changed_input_misses(tmp_path, cache):
+    path = write_dump(tmp_path/'a.txt', seed=1)
+    cache.cached(path, Parses(path))
+    write_dump(path, seed=2)
+    parse = Parses(path)
+    assert_same_state(cache.cached(path, parse), parse())
+    assert parse.calls == 2
+
+@pytest.mark.parametrize('change', ['decoder', 'sensordefs'])
+def test_changed_decoder_misses(tmp_path, cache, monkeypatch, change):
+    path = write_dump(tmp_path/'a.txt', seed=1)
+    cache.cached(path, Parses(path))
+    if change == 'decoder':
+        monkeypatch.setattr(CanReceive, 'DECODER_VERSION', CanReceive.DECODER_VERSION + 1)
+    else:
+        monkeypatch.setattr(SensorDefs, 'sensorList', SensorDefs.sensorList[:-1])
+    assert cache.load(path) is None
+    monkeypatch.undo()
+    assert cache.load(path) is not None
+
+def test_invalidate(tmp_path, cache):
+    path = write_dump(tmp_path/'a.txt', seed=1)
+    cache.cached(path, Parses(path))
+    cache.invalidate(path)
+    assert cache.load(path) is None
+    assert cache.index['entries'] == {}
+
+def test_lru_eviction(tmp_path, cache, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(DecodeCache.time, 'time', lambda: next(clock))
+    paths = [write_dump(tmp_path/('%d.txt'%i), seed=i) for i in range(3)]
+    keys = [cache.store(path, Parses(path)()) for path in paths[:2]]
+    # Room for two entries; the first is used since the second was stored.
+    cache.max_bytes = sum(entry['bytes'] for entry in cache.index['entries'].values()) + 1000
+    assert cache.load(paths[0]) is not None
+    keys.append(cache.store(paths[2], Parses(paths[2])()))
+    assert sorted(cache.index['entries']) == sorted([keys[0], keys[2]])
+    assert cache.load(paths[1]) is None
+    assert cache.nbytes() <= cache.max_bytes
@@ -0,0 +1,50 @@
+# test_DumpIndex.py
+################################################################################
+#     Checks that a time window decoded from the index's checkpoints is that
+# window of a full parse, and that the sidecar is reused until the dump
+# changes.
+
+import numpy as np
+import pytest
+
+import Pipeline, DumpIndex, Benchmark
+from test_equivalence import FORMATS
+
+SENSORS = [52, 53, 268, 300]
+
+@pytest.fixture(scope='module', params=sorted(FORMATS))
+def dump(request, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('dump')/('synthetic.%s.txt'%request.param))
+    Benchmark.FORMATS[request.param][1](path, Benchmark.synthetic_frames(20000, seed=11))
+    fmt = FORMATS[request.param]
+    return path, fmt, Pipeline.parse_stream(path, fmt, progress=False)
+
+def test_query_matches_full_parse(dump):
+    path, fmt, full = dump
+    index = DumpIndex.DumpIndex(path, fmt, interval=1 << 14).build()
+    assert len(index.checkpoints) > 4
+    times = np.concatenate([full.sensorLedgers[sensor].times for sensor in SENSORS])
+    first, last = times.min(), times.max()
+    # The whole dump, windows inside one segment and across several, and an
+    # empty one past the end.
+    for t_start, t_end in [(first, last), (first, first + (last - first)/50),
+            (first + (last - first)/3, first + (last - first)/2), (last - (last - first)/7, last),
+            (last + 1, last + 2)]:
+        window = index.query(SENSORS, t_start, t_end)
+        assert sorted(window) == SENSORS
+        for sensor in SENSORS:
+            expected = full.sensorLedgers[sensor].window(t_start, t_end)
+            assert len(window[sensor]) == len(expected) == 2
+            for got, column in zip(window[sensor], expected):
+                np.testing.assert_array_equal(got, column)
+        samples = sum(len(window[sensor][0]) for sensor in SENSORS)
+        assert samples > 0 if t_start <= last else samples == 0
+
+def test_sidecar(dump, monkeypatch):
+    path, fmt, full = dump
+    built = DumpIndex.open_index(path, fmt, interval=1 << 15)
+    with monkeypatch.context() as patch:
+        patch.setattr(DumpIndex.DumpIndex, 'build', None)
+        assert DumpIndex.open_index(path, fmt, interval=1 << 15).checkpoints == built.checkpoints
+    # Another interval doesn't reuse it.
+    assert len(DumpIndex.open_index(path, fmt, interval=1 << 16).checkpoints) < len(built.checkpoints)
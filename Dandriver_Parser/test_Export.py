@@ -0,0 +1,76 @@
+# test_Export.py
+################################################################################
+#     Checks that an export reads back as the ledgers it was written from, in
+# both formats, whether written from a parsed receiver or streamed as a dump
+# is decoded.
+
+import numpy as np
+import pytest
+
+import CanReceive, Pipeline, Ledgers, Export, Benchmark
+import blt_parser_rd2_hrc as parser
+
+FORMATS = [fmt for fmt in Export.FORMATS if fmt != 'parquet' or Export.pq is not None]
+
+@pytest.fixture(scope='module')
+def dump(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('dump')/'synthetic.candump.txt')
+    Benchmark.write_candump(path, Benchmark.synthetic_frames(20000, seed=5))
+    return path
+
+@pytest.fixture(scope='module')
+def receiver(dump):
+    return Pipeline.parse_stream(dump, parser.Candump, progress=False)
+
+def assert_round_trip(prefix, fmt, receiver):
+    sensors = Export.read_sensors(prefix, fmt=fmt)
+    sampled = [i for i, ledger in enumerate(receiver.sensorLedgers) if len(ledger)]
+    assert sorted(sensors) == sampled
+    for sensor in sampled:
+        np.testing.assert_array_equal(sensors[sensor][0], receiver.sensorLedgers[sensor].times)
+        np.testing.assert_array_equal(sensors[sensor][1], receiver.sensorLedgers[sensor].values)
+
+    # Asked for by ID, a sensor with no samples reads back empty.
+    empty = next(i for i, ledger in enumerate(receiver.sensorLedgers) if not len(ledger))
+    times, values = Export.read_sensors(prefix, [empty, sampled[0]], fmt=fmt)[empty]
+    assert len(times) == len(values) == 0
+
+    for ledger, name in (('time', 'timeLedger'), ('autosequence', 'AutosequenceLedger')):
+        columns = Export.read_ledger(prefix, ledger, fmt=fmt)
+        assert list(columns) == list(Export.COLUMNS[ledger])
+        rows = getattr(receiver, name).rows()
+        np.testing.assert_array_equal(np.column_stack(list(columns.values())), rows)
+    assert Export.read_metadata(prefix, fmt)['decoder_version'] == CanReceive.DECODER_VERSION
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_export_receiver(tmp_path, receiver, fmt):
+    prefix = str(tmp_path/'export')
+    Export.export_receiver(receiver, prefix, fmt, chunk=100)
+    assert Export.detect_format(prefix) == fmt
+    assert_round_trip(prefix, fmt, receiver)
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('chunk', [7, 1 << 16])
+def test_export_sink(tmp_path, dump, receiver, fmt, chunk):
+    prefix = str(tmp_path/'export')
+    Pipeline.parse_stream(dump, parser.Candump, sink=Export.ExportSink(prefix, fmt, chunk=chunk), progress=False)
+    assert_round_trip(prefix, fmt, receiver)
+
+def test_chunk_rows_blocks():
+    """Appended rows and columns reach the writer in order, chunk rows at a time."""
+    class Writer:
+        def __init__(self):
+            self.blocks = []
+        def write(self, ledger, sensor, columns):
+            self.blocks.append(columns.copy())
+    writer = Writer()
+    rows = Export.ChunkRows(writer, 'sensors', 52, 2, chunk=10, stage=3)
+    expected = np.arange(2*57, dtype=np.float64).reshape(-1, 2)
+    for row in expected[:20]:
+        rows.append(row.tolist())
+    rows.extend_columns(*expected[20:45].T)
+    for row in expected[45:]:
+        rows.append(row.tolist())
+    rows.flush()
+    assert [block.shape[1] for block in writer.blocks] == [10]*5 + [7]
+    np.testing.assert_array_equal(np.concatenate(writer.blocks, axis=1).T, expected)
@@ -0,0 +1,101 @@
+# test_Ledgers.py
+################################################################################
+#     Checks the bounded retention ledgers: the ring keeps exactly the newest
+# rows through wraparound, and what ages out is folded into tiers whose
+# min/max/mean buckets match bucketing the evicted rows directly.
+
+import os
+
+import numpy as np
+import pytest
+
+import Ledgers
+
+def test_window_wraparound():
+    rng = np.random.default_rng(0)
+    window = Ledgers.Window(2, 10)
+    pushed, evicted = [], []
+    for n in rng.integers(1, 14, 200).tolist():
+        columns = rng.random((2, n))
+        pushed.append(columns)
+        out = window.push(columns)
+        if out is not None:
+            evicted.append(out)
+        assert len(window) <= 10
+        assert window.buffer.shape[1] <= 20
+    everything = np.concatenate(pushed, axis=1)
+    np.testing.assert_array_equal(window.view(), everything[:, -10:])
+    np.testing.assert_array_equal(np.concatenate(evicted + [window.view()], axis=1), everything)
+
+def stream(ledger, times, values):
+    """Half the rows one at a time, half as columns, as the decoders write them."""
+    for start in range(0, len(times), 100):
+        if start % 200:
+            ledger.extend_columns(times[start:start + 100], values[start:start + 100])
+        else:
+            for t, v in zip(times[start:start + 100].tolist(), values[start:start + 100].tolist()):
+                ledger.append((t, v))
+
+def buckets(times, values, bucket):
+    ids = np.floor(times/bucket)
+    result = {}
+    for b in np.unique(ids).tolist():
+        select = values[ids == b]
+        result[b*bucket] = (len(select), select.min(), select.max(), select.mean())
+    return result
+
+def tier_buckets(tier):
+    records = tier.window.view()
+    starts, low, high, mean = tier.summary()
+    return {start: (count, a, b, c) for start, count, a, b, c
+        in zip(starts.tolist(), records[1].tolist(), low.tolist(), high.tolist(), mean.tolist())}
+
+@pytest.mark.parametrize('seconds, capacity', [(2.0, 1 << 16), (None, 150), (2.0, 150)])
+def test_ring_ledger(tmp_path, seconds, capacity):
+    times = np.arange(5000)*0.01
+    values = np.random.default_rng(1).integers(0, 1000, 5000).astype(np.float64)
+    spill = str(tmp_path/'spill.f8')
+    policy = Ledgers.RetentionPolicy(seconds, capacity, tiers=((1.0, 5), (10.0, 2)))
+    ledger = Ledgers.RingLedger(Ledgers.SENSOR_COLUMNS, policy, spill=spill)
+    stream(ledger, times, values)
+
+    # Full rate: the newest rows, within both limits.
+    kept = len(ledger)
+    assert kept <= capacity
+    if seconds is not None:
+        assert times[-1] - ledger.times[0] <= seconds
+    np.testing.assert_array_equal(ledger.times, times[-kept:])
+    np.testing.assert_array_equal(ledger.values, values[-kept:])
+    assert ledger.evicted == len(times) - kept
+
+    # Tiers: the newest buckets of what was evicted, each coarser tier older.
+    old_times, old_values = times[:-kept], values[:-kept]
+    fine = tier_buckets(ledger.tiers[0])
+    assert len(fine) == 5
+    expected = buckets(old_times, old_values, 1.0)
+    for start, (count, low, high, mean) in fine.items():
+        assert (count, low, high) == expected[start][:3]
+        assert mean == pytest.approx(expected[start][3])
+    # The coarse tier holds the rows that left the fine one.
+    fine_start = min(fine)
+    coarse = tier_buckets(ledger.tiers[1])
+    select = old_times < fine_start
+    expected = buckets(old_times[select], old_values[select], 10.0)
+    for start, (count, low, high, mean) in coarse.items():
+        assert (count, low, high) == expected[start][:3]
+        assert mean == pytest.approx(expected[start][3])
+
+    # Everything evicted is counted once: in a tier or the spill.
+    spilled = Ledgers.read_spill(spill, 5) if os.path.exists(spill) else np.empty((0, 5))
+    assert sum(c for c, *_ in fine.values()) + sum(c for c, *_ in coarse.values()) \
+        + spilled[:, 1].sum() == ledger.evicted
+
+def test_bounded_memory():
+    policy = Ledgers.RetentionPolicy(1.0, 1000, tiers=((1.0, 10), (10.0, 10)))
+    ledger = Ledgers.RingLedger(Ledgers.SENSOR_COLUMNS, policy)
+    # Windows hold at most twice their capacity; tier records are 5 wide.
+    bound = 8*(2*1000*2 + 2*10*5 + 2*10*5)
+    for start in range(0, 200000, 997):
+        ledger.extend_columns(np.arange(start, start + 997)*0.01, np.zeros(997))
+        assert ledger.nbytes() <= bound
+    assert len(ledger) == 101
@@ -0,0 +1,99 @@
+# test_LiveReceive.py
+################################################################################
+#     Checks LiveReceive on python-can's virtual bus: frames sent on the bus
+# are decoded as translating them one by one would, a full ring drops and
+# counts, and a failing bus stops it cleanly.
+
+import threading
+import time
+
+import can
+import pytest
+
+import CanReceive, LiveReceive, Benchmark
+from test_equivalence import short_frames, assert_same_state
+
+def send(bus, frames):
+    for arbitration_id, data in frames:
+        bus.send(can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=True))
+
+def wait_received(live, n, timeout=30):
+    deadline = time.monotonic() + timeout
+    while live.received < n:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+@pytest.fixture
+def buses(request):
+    channel = 'test_live_%s'%request.node.name
+    rx = can.interface.Bus(interface='virtual', channel=channel)
+    tx = can.interface.Bus(interface='virtual', channel=channel)
+    yield rx, tx
+    tx.shutdown()
+    rx.shutdown()
+
+@pytest.mark.parametrize('batch', [1, 7, 1024])
+def test_decodes_as_translate(buses, batch):
+    rx, tx = buses
+    frames = Benchmark.synthetic_frames(5000, seed=3) + short_frames(500, seed=4)
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    live = LiveReceive.LiveReceive(receiver, bus=rx, batch=batch, track_latency=True).start()
+    send(tx, frames)
+    assert wait_received(live, len(frames))
+    assert live.wait_idle(timeout=30)
+    live.stop(timeout=5)
+    assert not live.running()
+
+    serial = CanReceive.CanReceive('virtual', 'virtual')
+    for arbitration_id, data in frames:
+        serial.translateFrame(arbitration_id & CanReceive.ID_MASK, arbitration_id, data)
+    assert_same_state(receiver, serial)
+    assert live.counters() == {'received': len(frames), 'decoded': len(frames), 'dropped': 0,
+        'queued': 0, 'high_water': live.ring.high_water, 'errors': 0}
+    assert 1 <= live.ring.high_water <= len(frames)
+    assert len(live.latencies) == len(frames)
+
+def test_full_ring_drops(buses):
+    rx, tx = buses
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    # The first frame holds up decoding until every other frame is received.
+    entered, release = threading.Event(), threading.Event()
+    def hold(ID_A, msg_id, data):
+        entered.set()
+        release.wait(10)
+    receiver.register_handler(600, hold)
+    live = LiveReceive.LiveReceive(receiver, bus=rx, capacity=16, batch=1).start()
+    send(tx, [(600, b'\0')])
+    assert entered.wait(10)
+    send(tx, [(700 + i, b'\1') for i in range(99)])
+    assert wait_received(live, 100)
+    release.set()
+    live.stop(timeout=5)
+    assert live.counters() == {'received': 100, 'decoded': 17, 'dropped': 83,
+        'queued': 0, 'high_water': 16, 'errors': 0}
+    assert receiver.msgs_read == 17
+
+class FailingBus:
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def recv(self, timeout=None):
+        if not self.frames:
+            raise can.CanOperationError("unplugged")
+        arbitration_id, data = self.frames.pop(0)
+        return can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=True)
+
+def test_bus_error_stops(buses):
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    live = LiveReceive.LiveReceive(receiver, bus=FailingBus([(514, b'\2')]*3)).start()
+    live._receive_thread.join(5)
+    assert not live.running()
+    with pytest.raises(can.CanOperationError):
+        live.stop(timeout=5)
+    assert live.counters()['received'] == live.counters()['decoded'] == 3
+    assert live.errors == 1 and isinstance(live.last_error, can.CanOperationError)
+    assert receiver.NodeStatusRenegadeEngine == CanReceive.CanReceive.VehicleStates[2]
+    # Raised once; stopping again is clean.
+    live.stop(timeout=5)
@@ -0,0 +1,71 @@
+# test_Merge.py
+################################################################################
+#     Checks the chunked merges against merging naively, one row at a time from
+# every sensor's samples sorted together, with timestamps shared between
+# sensors and repeated within one.
+
+import numpy as np
+import pytest
+
+import Ledgers, Merge
+
+SENSORS = [52, 53, 54, 55]
+
+@pytest.fixture(scope='module')
+def ledgers():
+    """Random rates and shared timestamps (ties), plus a sensor with no samples."""
+    rng = np.random.default_rng(0)
+    grid = np.round(np.sort(rng.uniform(0, 10, 400)), 2)
+    ledgers = {}
+    for sensor, n in zip(SENSORS, (300, 120, 7, 0)):
+        ledger = Ledgers.Ledger()
+        times = np.sort(rng.choice(grid, n))
+        ledger.extend_columns(times, rng.integers(0, 1000, n))
+        ledgers[sensor] = ledger
+    return ledgers
+
+# Of samples sharing a time, the last one in the ledger.
+def last_before(ledger, time, tolerance=None):
+    times, values = ledger.times, ledger.values
+    i = np.flatnonzero(times <= time)
+    if not len(i) or (tolerance is not None and time - times[i[-1]] > tolerance):
+        return np.nan
+    return values[i[-1]]
+
+def collect(chunks):
+    chunks = list(chunks)
+    return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+@pytest.mark.parametrize('chunk', [1, 3, 50, 1 << 16])
+def test_union(ledgers, chunk):
+    times, table = collect(Merge.union(ledgers, SENSORS, chunk=chunk))
+    expected_times = np.unique(np.concatenate([ledgers[s].times for s in SENSORS]))
+    np.testing.assert_array_equal(times, expected_times)
+    expected = np.array([[last_before(ledgers[s], t) for s in SENSORS] for t in expected_times])
+    np.testing.assert_array_equal(table, expected)
+    assert np.isnan(table[:, SENSORS.index(55)]).all()
+
+@pytest.mark.parametrize('tolerance', [None, 0.05])
+@pytest.mark.parametrize('chunk', [1, 7, 1 << 16])
+def test_asof(ledgers, tolerance, chunk):
+    others = [53, 54, 55]
+    times, table = collect(Merge.asof(ledgers, 52, others, tolerance, chunk=chunk))
+    np.testing.assert_array_equal(times, ledgers[52].times)
+    np.testing.assert_array_equal(table[:, 0], ledgers[52].values)
+    expected = np.array([[last_before(ledgers[s], t, tolerance) for s in others] for t in times])
+    np.testing.assert_array_equal(table[:, 1:], expected)
+
+@pytest.mark.parametrize('chunk', [5, 1 << 16])
+def test_resample(ledgers, chunk):
+    times, table = collect(Merge.resample(ledgers, SENSORS, rate=20, chunk=chunk))
+    first = min(ledgers[s].times[0] for s in SENSORS if len(ledgers[s]))
+    np.testing.assert_allclose(np.diff(times), 1/20)
+    assert times[0] == first
+    for k, sensor in enumerate(SENSORS):
+        # Interpolated between the last samples at each time.
+        samples = {}
+        for t, v in zip(ledgers[sensor].times.tolist(), ledgers[sensor].values.tolist()):
+            samples[t] = v
+        expected = np.interp(times, list(samples), list(samples.values()), left=np.nan, right=np.nan) \
+            if samples else np.full(len(times), np.nan)
+        np.testing.assert_array_equal(table[:, k], expected)
@@ -0,0 +1,90 @@
+# test_Replay.py
+################################################################################
+#     Checks the replayer's pacing and bursts against a simulated clock, and
+# recorded frame times across a sensor timestamp rollover.
+
+import can
+import numpy as np
+import pytest
+
+import Replay
+
+class Clock:
+    """Simulated time: sleeping moves it on, as does each send."""
+    def __init__(self, send_cost=0.0):
+        self.now = 100.0
+        self.send_cost = send_cost
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        assert seconds > 0
+        self.now += seconds
+
+class Bus:
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append((self.clock() - 100.0, msg.arbitration_id))
+        self.clock.now += self.clock.send_cost
+
+def frames(n=20):
+    return [(i, 1, b'\1') for i in range(n)]
+
+TIMES = np.arange(20)*0.1
+
+def send(speed, bursts=(), send_cost=0.0):
+    clock = Clock(send_cost)
+    bus = Bus(clock)
+    replayer = Replay.Replayer(frames(), TIMES, speed, bursts, clock=clock, sleep=clock.sleep)
+    seconds = replayer.send(bus)
+    assert [msg_id for at, msg_id in bus.sent] == list(range(20)) and replayer.sent == 20
+    return replayer, np.array([at for at, msg_id in bus.sent]), seconds
+
+@pytest.mark.parametrize('speed', [1.0, 10.0, 0.5])
+def test_pacing(speed):
+    replayer, sent, seconds = send(speed)
+    np.testing.assert_allclose(sent, TIMES/speed)
+    assert seconds == pytest.approx(TIMES[-1]/speed)
+    assert replayer.max_lag == 0.0
+
+def test_max_speed():
+    replayer, sent, seconds = send(None)
+    assert (sent == 0).all() and seconds == 0
+
+def test_burst():
+    # At 0.5 s the next three frames go out at once; pacing then resumes from
+    # the frame after them, without catching up on the time they skipped.
+    replayer, sent, seconds = send(1.0, bursts=[(0.5, 3)])
+    expected = np.r_[TIMES[:6], [0.5]*3, 0.5 + TIMES[9:] - TIMES[9]]
+    np.testing.assert_allclose(sent, expected)
+
+def test_lag():
+    """A bus slower than the recording falls behind, and says by how much."""
+    replayer, sent, seconds = send(1.0, send_cost=0.2)
+    np.testing.assert_allclose(sent, np.arange(20)*0.2)
+    assert replayer.max_lag == pytest.approx(19*0.1)
+
+def test_send_errors():
+    class Full(Bus):
+        def send(self, msg):
+            if msg.arbitration_id % 2:
+                raise can.CanOperationError("buffer full")
+            super().send(msg)
+    clock = Clock()
+    replayer = Replay.Replayer(frames(), TIMES, None, clock=clock, sleep=clock.sleep)
+    replayer.send(Full(clock))
+    assert (replayer.sent, replayer.send_errors) == (10, 10)
+
+def test_frame_times():
+    # Sensor frames on 52 across a rollover; the 546 valve frame keeps the time.
+    raw = [1000, 2**17, 2**18 - 1, 5]
+    recorded = [((t << 11) | 52, 2, b'\0\1') for t in raw] + [((7 << 11) | 546, 8, bytes(8))]
+    times = Replay.frame_times(recorded)
+    seconds = np.array([t*10/2**18 for t in raw])
+    seconds[3] += 10
+    expected = np.r_[seconds, seconds[3]]/8000
+    np.testing.assert_allclose(times, expected - expected[0])
@@ -0,0 +1,93 @@
+# test_SharedState.py
+################################################################################
+#     Checks that a StateReader sees what a StatePublisher publishes, never a
+# half written state, and that a publisher replaces a stale block.
+
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+
+import CanReceive, SharedState
+
+@pytest.fixture
+def name(request):
+    return 'blt_test_%d_%s'%(os.getpid(), request.node.name[-20:].replace('[', '_').strip(']'))
+
+def test_publish_read(name):
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    publisher = SharedState.StatePublisher(receiver, name)
+    reader = SharedState.StateReader(name)
+    try:
+        receiver.Sensors[52] = 1234
+        receiver.Valves[3] = 1
+        receiver.Controllers[5][6] = 2.5
+        receiver.AutosequenceTime = -3.5
+        receiver.NodeStatusRenegadeEngine = receiver.VehicleStates[2]
+        receiver.msgs_read = 99
+        publisher.publish()
+
+        state = reader.snapshot()
+        assert state['Sensors'][52] == 1234
+        assert state['Valves'][3] == 1
+        assert state['Controllers'][5, 6] == 2.5
+        assert state['AutosequenceTime'][0] == -3.5
+        assert reader.node_states(receiver.VehicleStates)['NodeStatusRenegadeEngine'] == receiver.VehicleStates[2]
+        assert (reader.sequence(), reader.publishes(), reader.msgs_read()) == (2, 1, 99)
+    finally:
+        reader.close()
+        publisher.close()
+
+def test_reads_are_consistent(name):
+    """Every snapshot taken while publishing sees one publish, never a mix."""
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    publisher = SharedState.StatePublisher(receiver, name)
+    reader = SharedState.StateReader(name)
+    done = threading.Event()
+    def publish():
+        for i in range(2000):
+            receiver.Sensors = [i]*len(receiver.Sensors)
+            receiver.sensorTimestamps = [float(i)]*len(receiver.sensorTimestamps)
+            publisher.publish()
+        done.set()
+    thread = threading.Thread(target=publish)
+    try:
+        thread.start()
+        snapshots = 0
+        while not done.is_set() or not snapshots:
+            state = reader.snapshot(['Sensors', 'sensorTimestamps'])
+            assert len(set(state['Sensors'])) == 1
+            np.testing.assert_array_equal(state['sensorTimestamps'], state['Sensors'])
+            snapshots += 1
+        thread.join()
+        assert reader.snapshot(['Sensors'])['Sensors'][0] == 1999
+        assert reader.sequence() % 2 == 0
+    finally:
+        reader.close()
+        publisher.close()
+
+def test_stale_block_replaced(name):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    # What a publisher that died leaves behind.
+    block = shared_memory.SharedMemory(name, create=True, size=SharedState.layout_size())
+    header, arrays = SharedState.map_block(block.buf)
+    header[1], header[2], header[4] = SharedState.LAYOUT_ID, 7, exited.pid
+    del header, arrays
+    block.close()
+
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    publisher = SharedState.StatePublisher(receiver, name)
+    reader = SharedState.StateReader(name)
+    try:
+        assert reader.publishes() == 0
+        # A running publisher's block isn't taken over.
+        with pytest.raises(FileExistsError):
+            SharedState.StatePublisher(receiver, name)
+    finally:
+        reader.close()
+        publisher.close()
@@ -0,0 +1,211 @@
+# test_equivalence.py
+################################################################################
+#     Checks that the fast readers and decoders give exactly what the original
+# ones do: the bytes-level Coolterm reader against generate_entries, the batch
+# and shard-parallel decoders against a serial parse of the same synthetic
+# dump, and the Schema generated handlers against the hand-written ones they
+# replaced.
+#
+#   python -m pytest Dandriver_Parser
+
+import io
+import random
+import struct
+
+import can
+import numpy as np
+import pytest
+
+import CanReceive, Pipeline, BatchDecode, ParallelParse, DecodeCache, Benchmark
+import blt_parser_rd2_hrc as parser
+
+################################################################################
+################################### Readers ####################################
+################################################################################
+
+def coolterm_entries(text):
+    """Records as the original line tokenizer, generate_entries, reads them."""
+    frames = []
+    for entry in parser.Coolterm.generate_entries(io.StringIO(text)):
+        arbitration_id, payload = entry.split(':')
+        frames.append((int(arbitration_id), bytes(int(field) for field in payload.split(','))))
+    return frames
+
+def coolterm_frames(text, block):
+    return [(arbitration_id, payload) for arbitration_id, dlc, payload
+        in parser.Coolterm.generate_frames(io.BytesIO(text.encode()), block=block)]
+
+COOLTERM_RECORDS = ["%d:%s"%(100 + i, ','.join(str((7*i + k) % 256) for k in range(8))) for i in range(50)]
+
+@pytest.mark.parametrize('separator', ['\n', '\r\n', ',\n', ',\r\n', ','])
+@pytest.mark.parametrize('block', [1, 3, 7, 64, 1 << 20])
+def test_coolterm_tokenizer(separator, block):
+    text = separator.join(COOLTERM_RECORDS) + separator
+    expected = coolterm_entries(text)
+    assert len(expected) == len(COOLTERM_RECORDS)
+    assert coolterm_frames(text, block) == expected
+
+@pytest.mark.parametrize('separator', ['\n', '\r\n', ',\n'])
+def test_coolterm_ranges(tmp_path, separator):
+    """Byte ranges, as ParallelParse shards a dump, read every record once."""
+    path = tmp_path/'coolterm.txt'
+    path.write_bytes((separator.join(COOLTERM_RECORDS) + separator).encode())
+    whole = list(parser.Coolterm.generate_frames(str(path)))
+    size = path.stat().st_size
+    for cuts in ([0, size], [0, 5, 17, 100, 333, size], list(range(0, size, 61)) + [size]):
+        shards = [frame for start, stop in zip(cuts, cuts[1:])
+            for frame in parser.Coolterm.generate_frames(str(path), start, stop, block=16)]
+        assert shards == whole
+    assert len(whole) == len(COOLTERM_RECORDS)
+
+# Newlines land anywhere in a Coolterm capture: inside an ID, inside a byte,
+# and in place of the comma after the last byte.
+COOLTERM_SPLIT = [
+    ("100:1,2,3,4,5,6,7,8,1\n01:1,2,3,4,5,6,7,8,", [(100, bytes(range(1, 9))), (101, bytes(range(1, 9)))]),
+    ("101:1,2\n3,4,5,6,7,8,9,102:1,2,3,4,5,6,7,8\n",
+        [(101, bytes([1, 23, 4, 5, 6, 7, 8, 9])), (102, bytes(range(1, 9)))]),
+    ("100:1,2,3,4,5,6,7,8\n101:1,2,3,4,5,6,7,8\n", [(100, bytes(range(1, 9))), (101, bytes(range(1, 9)))]),
+]
+
+@pytest.mark.parametrize('text, expected', COOLTERM_SPLIT)
+@pytest.mark.parametrize('block', [1, 5, 1 << 20])
+def test_coolterm_split_fields(text, expected, block):
+    rejected = []
+    frames = [(arbitration_id, payload) for arbitration_id, dlc, payload
+        in parser.Coolterm.generate_frames(io.BytesIO(text.encode()), block=block, rejected=rejected)]
+    assert frames == expected
+    assert rejected == []
+
+def test_coolterm_rejected():
+    """What isn't a record is counted, and the records around it still read."""
+    text = "100:1,2,3,4,5,6,7,8,garbage,101:1,2,3,4,5,6,7,999,102:1,2,3,4,5,6,7,8,\n103:1,2"
+    rejected = []
+    frames = list(parser.Coolterm.generate_frames(io.BytesIO(text.encode()), block=7, rejected=rejected))
+    assert [frame[0] for frame in frames] == [100, 102]
+    assert rejected == [b'garbage,', b'101:1,2,3,4,5,6,7,999,', b'\n103:1,2']
+
+################################################################################
+################################### Decoders ###################################
+################################################################################
+
+FORMATS = {'candump': parser.Candump, 'coolterm': parser.Coolterm}
+
+def short_frames(n, seed=0):
+    """Valve and controller frames of every payload length, 1 to 8 bytes."""
+    rng = random.Random(seed)
+    ids = [546, 547, 552, 1502, 1504, 1514, 1515, 1614, 1210, 1047, 1948]
+    frames = []
+    for i in range(n):
+        arbitration_id = (rng.getrandbits(18) << 11) | rng.choice(ids)
+        frames.append((arbitration_id, bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 8)))))
+    return frames
+
+@pytest.fixture(scope='module', params=sorted(FORMATS))
+def dump(request, tmp_path_factory):
+    frames = Benchmark.synthetic_frames(20000, seed=7)
+    # Coolterm records always carry 8 bytes; short ones are candump only.
+    if request.param == 'candump':
+        frames += short_frames(2000)
+    path = tmp_path_factory.mktemp('dump')/('synthetic.%s.txt'%request.param)
+    Benchmark.FORMATS[request.param][1](str(path), frames)
+    return str(path), FORMATS[request.param]
+
+# Floats by their bits, so NaNs compare too.
+def exact(value):
+    if isinstance(value, (list, tuple)):
+        return [exact(item) for item in value]
+    return struct.pack('>d', value) if isinstance(value, float) else value
+
+def assert_same_ledgers(a, b, sensors=range(1028)):
+    for sensor in sensors:
+        np.testing.assert_array_equal(a.sensorLedgers[sensor].times, b.sensorLedgers[sensor].times)
+        np.testing.assert_array_equal(a.sensorLedgers[sensor].values, b.sensorLedgers[sensor].values)
+
+def assert_same_state(a, b):
+    assert_same_ledgers(a, b)
+    np.testing.assert_array_equal(a.timeLedger.rows(), b.timeLedger.rows())
+    np.testing.assert_array_equal(a.AutosequenceLedger.rows(), b.AutosequenceLedger.rows())
+    for name in DecodeCache.STATE:
+        assert exact(getattr(a, name)) == exact(getattr(b, name)), name
+
+@pytest.fixture(scope='module')
+def serial(dump):
+    path, fmt = dump
+    return Pipeline.parse_stream(path, fmt, progress=False)
+
+def test_serial_decodes_everything(dump, serial):
+    assert serial.msgs_read == sum(1 for frame in dump[1].generate_frames(dump[0]))
+    assert sum(len(ledger) for ledger in serial.sensorLedgers) > 0
+    assert len(serial.AutosequenceLedger) > 0
+
+def test_batch(dump, serial):
+    path, fmt = dump
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    state = BatchDecode.RolloverState()
+    # Small blocks, so the rollover state is carried between them.
+    for ids, dlc, payloads in fmt.generate_frame_blocks(path, n=1000):
+        mask = BatchDecode.sensor_frame_mask(ids)
+        BatchDecode.apply_sensor_batch(receiver,
+            *BatchDecode.decode_sensor_batch(ids[mask], payloads[mask], dlc[mask], state))
+    assert_same_ledgers(receiver, serial)
+    assert (state.sensorTimestamp, state.sensorRollover) == (serial.sensorTimestamp, serial.sensorRollover)
+
+def test_parallel(dump, serial):
+    path, fmt = dump
+    assert_same_state(ParallelParse.parse_parallel(path, fmt, processes=2, shards=7), serial)
+
+################################################################################
+################################ Schema handlers ###############################
+################################################################################
+
+# The hand-written frame handlers the Schema families replaced.
+def reference_valves(valves, msg_id, data):
+    reverse = lambda value: int(bin(value)[:1:-1], base=2) if value else 0
+    valves[1] = reverse((msg_id >> 12) & 0xFF)
+    valves[2] = reverse((msg_id >> 20) & 0xFF)
+    data = data[:8]
+    valves[3:3 + len(data)] = data
+
+def reference_controller(Controllers, ID_A, data):
+    if not data:
+        return
+    Controller = Controllers[(round(ID_A, -2)-1000)//100]
+    ControllerIndex = ID_A % 100
+    if len(data) == 8:
+        if ID_A == 1502 or ID_A == 1504:
+            code = '>ii'
+        elif ControllerIndex == 14 or ControllerIndex == 15:
+            code = '>II'
+        else:
+            code = '>ff'
+        Controller[ControllerIndex], Controller[ControllerIndex + 1] = struct.unpack(code, data)
+    else:
+        Controller[ControllerIndex] = struct.unpack('f', struct.pack('I', int.from_bytes(data[:4], 'big')))[0]
+
+VALVES = {546: 'ValvesRenegadeEngine', 552: 'Valves', 547: 'ValvesRenegadeProp'}
+
+@pytest.mark.parametrize('engine', ['frame', 'message'])
+def test_schema_handlers(engine):
+    frames = short_frames(5000, seed=1) + Benchmark.synthetic_frames(5000, seed=2)
+    receiver = CanReceive.CanReceive('virtual', 'virtual')
+    reference = {name: [0]*64 for name in VALVES.values()}
+    reference['Controllers'] = [[0]*50 for i in range(12)]
+    for arbitration_id, data in frames:
+        ID_A = arbitration_id & CanReceive.ID_MASK
+        if ID_A in VALVES:
+            reference_valves(reference[VALVES[ID_A]], arbitration_id, data)
+            name, row = VALVES[ID_A], None
+        elif ID_A > 1000 and ID_A not in (1100, 1506):
+            reference_controller(reference['Controllers'], ID_A, data)
+            name, row = 'Controllers', (round(ID_A, -2)-1000)//100
+        else:
+            continue
+        if engine == 'frame':
+            receiver.translateFrame(ID_A, arbitration_id, data)
+        else:
+            receiver.translateMessage(*parser.RD2.parse(can.Message(arbitration_id=arbitration_id, data=data)))
+        # Every frame, before a later one overwrites what it decoded.
+        expected, decoded = reference[name], getattr(receiver, name)
+        if row is not None:
+            expected, decoded = expected[row], decoded[row]
+        assert exact(decoded) == exact(expected), '%d %s'%(ID_A, data.hex())